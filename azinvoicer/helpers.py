@@ -1,5 +1,32 @@
+import io
 import os
+import threading
 import datetime
+import functools
+import importlib.util
+from typing import Iterable, Callable, BinaryIO
+
+
+class FileRangeReader(io.RawIOBase):
+    """reads an open binary file from its current position up to an end offset"""
+
+    __file: BinaryIO
+    __remaining: int
+
+    def __init__(self, f: BinaryIO, byteEnd: int) -> None:
+        self.__file = f
+        self.__remaining = max(0, byteEnd - f.tell())
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:
+        size: int = min(len(buffer), self.__remaining)
+        if size == 0:
+            return 0
+        read: int = self.__file.readinto(memoryview(buffer)[:size])
+        self.__remaining = self.__remaining - read
+        return read
 
 
 class IOHelper(object):
@@ -18,6 +45,32 @@ class IOHelper(object):
     def mkdirFilePath(cts, filePath: str) -> None:
         os.makedirs(os.path.dirname(filePath), exist_ok=True)
 
+    @classmethod
+    def getLastLineEnd(cts, f: BinaryIO, byteEnd: int, blockSize: int = 64 * 1024) -> int:
+        """offset following the last newline before byteEnd, 0 when there is none"""
+        position: int = byteEnd
+        while position > 0:
+            start: int = max(0, position - blockSize)
+            f.seek(start)
+            found: int = f.read(position - start).rfind(b"\n")
+            if found >= 0:
+                return start + found + 1
+            position = start
+        return 0
+
+    @classmethod
+    def writeAtomically(cts, filePath: str, write: Callable[[str], None]) -> None:
+        """writes through a temporary file then moves it in place so that readers never see a partial file"""
+        # the process and the thread make the temporary name unique among concurrent writers
+        tmpPath: str = filePath + ".tmp" + str(os.getpid()) + "." + str(threading.get_ident())
+        try:
+            write(tmpPath)
+            os.replace(tmpPath, filePath)
+        except BaseException:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
     @classmethod
     def listToFile(cts, items: set, filePath: str) -> None:
         with open(filePath, "w") as f:
@@ -27,10 +80,33 @@ class IOHelper(object):
 
 
 class DateHelper(object):
+
+    CACHE_SIZE: int = 4096
+
     @classmethod
     def parseDate(cls, dateFormat: str, dateInStr: str) -> datetime:
         return datetime.datetime.strptime(dateInStr, dateFormat)
 
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def parseDateCached(dateFormat: str, dateInStr: str) -> datetime:
+        # invoices only hold a handful of distinct dates, memoize them per (format, string)
+        return datetime.datetime.strptime(dateInStr, dateFormat)
+
+    @classmethod
+    def parseDistinctDates(cls, dateFormat: str, datesInStr: Iterable[str]) -> dict:
+        parsed: dict = dict()
+        for d in datesInStr:
+            if d not in parsed:
+                parsed[d] = cls.parseDateCached(dateFormat, d)
+        return parsed
+
+    @classmethod
+    def parseDates(cls, dateFormat: str, datesInStr: Iterable[str]) -> list:
+        items: list = list(datesInStr)
+        parsed: dict = cls.parseDistinctDates(dateFormat, items)
+        return [parsed[d] for d in items]
+
     @classmethod
     def periodDays(cls, start: datetime, end: datetime) -> int:
         delta = end - start
@@ -39,3 +115,9 @@ class DateHelper(object):
     @classmethod
     def formatDate(cls, dateFormat: str, dateInDt: datetime) -> str:
         return datetime.datetime.strftime(dateInDt, dateFormat)
+
+
+class ModuleHelper(object):
+    @classmethod
+    def isAvailable(cls, moduleName: str) -> bool:
+        return importlib.util.find_spec(moduleName) is not None
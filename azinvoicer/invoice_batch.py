@@ -0,0 +1,117 @@
+import os
+import glob
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
+
+from azinvoicer.invoice_record import InvoiceStats, InvoiceStatsAccumulator, BatchInvoiceStats
+from azinvoicer.invoice_model import MappingModelRepository, ModelCompliancePicker, ModelCompliancePick, ModelComplianceLevel
+from azinvoicer.invoice_mappers import EnvironnementMapper
+from azinvoicer.invoice_reader import InvoiceLoader, InvoiceParser
+
+
+class InvoiceBatchProcessor(object):
+    """processes a set of invoice files concurrently, models and mappers are shared by all the files"""
+
+    DEFAULT_JOBS: int = 4
+
+    __repo: MappingModelRepository
+    __mapper: EnvironnementMapper
+    __loader: InvoiceLoader
+    __parser: InvoiceParser
+    __jobs: int
+    __keepData: bool
+
+    def __init__(
+        self,
+        repo: MappingModelRepository,
+        mapper: EnvironnementMapper,
+        jobs: int = DEFAULT_JOBS,
+        loader: InvoiceLoader = None,
+        parser: InvoiceParser = None,
+        keepData: bool = False,
+    ) -> None:
+        self.__logger = logging.getLogger("InvoiceBatchProcessor")
+        self.__repo = repo
+        self.__mapper = mapper
+        self.__jobs = max(1, jobs)
+        self.__loader = loader if loader is not None else InvoiceLoader()
+        self.__parser = parser if parser is not None else InvoiceParser()
+        self.__keepData = keepData
+
+    @classmethod
+    def listInvoiceFiles(cls, pathOrPattern: Union[str, list]) -> list:
+        if not isinstance(pathOrPattern, str):
+            # an invoice matched by several paths or patterns is only listed once
+            return list(dict.fromkeys(f for p in pathOrPattern for f in cls.listInvoiceFiles(p)))
+        if os.path.isdir(pathOrPattern):
+            pathOrPattern = os.path.join(pathOrPattern, "*.csv")
+        return sorted(f for f in glob.glob(pathOrPattern) if os.path.isfile(f))
+
+    def getRepository(self) -> MappingModelRepository:
+        return self.__repo
+
+    def getMapper(self) -> EnvironnementMapper:
+        return self.__mapper
+
+    def getLoader(self) -> InvoiceLoader:
+        return self.__loader
+
+    def getParser(self) -> InvoiceParser:
+        return self.__parser
+
+    def getJobs(self) -> int:
+        return self.__jobs
+
+    def processInvoices(self, pathOrPattern: Union[str, list]) -> BatchInvoiceStats:
+        return self.processInvoiceFiles(self.listInvoiceFiles(pathOrPattern))
+
+    def processInvoiceFiles(
+        self, files: list, jobs: int = None, processInvoiceFile: Callable[[str], InvoiceStats] = None
+    ) -> BatchInvoiceStats:
+        """processes the files on the given number of threads, the processor jobs and processInvoiceFile by default"""
+        workers: int = max(1, jobs) if jobs is not None else self.__jobs
+        process: Callable[[str], InvoiceStats] = (
+            processInvoiceFile if processInvoiceFile is not None else self.processInvoiceFile
+        )
+        self.__logger.info("processing " + str(len(files)) + " invoice files using " + str(workers) + " workers")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results: list = list(executor.map(lambda f: self.__processInvoiceFileSafely(process, f), files))
+
+        # merge in the file name order so that the result does not depend on the scheduling
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(self.__keepData)
+        perFile: dict = dict()
+        notCompliant: list = list()
+        failed: dict = dict()
+        for filePath, stats in zip(files, results):
+            if isinstance(stats, Exception):
+                failed[filePath] = repr(stats)
+                continue
+            if stats is None:
+                notCompliant.append(filePath)
+                continue
+            accumulator.fold(stats)
+            perFile[filePath] = stats
+
+        return BatchInvoiceStats(merged=accumulator.getStats(), perFile=perFile, notCompliant=notCompliant, failed=failed)
+
+    def __processInvoiceFileSafely(self, process: Callable[[str], InvoiceStats], invoiceFilePath: str) -> any:
+        # a file that cannot be processed must not discard the results of the other ones
+        try:
+            return process(invoiceFilePath)
+        except Exception as ex:
+            self.__logger.warning("failed to process invoice file " + invoiceFilePath + " error=" + repr(ex))
+            return ex
+
+    def processInvoiceFile(self, invoiceFilePath: str) -> InvoiceStats:
+        pick: ModelCompliancePick = ModelCompliancePicker().getBestMatchingModel(self.__repo, invoiceFilePath)
+        if pick.getLevel() == ModelComplianceLevel.NOT_COMPLIANT:
+            self.__logger.warning("no compliant model found for invoice file " + invoiceFilePath)
+            return None
+
+        table = self.__loader.loadInvoice(pick.getLevel(), pick.getModel(), invoiceFilePath)
+        stats: InvoiceStats = self.__parser.parseInputTableAndAddEnv(pick.getLevel(), pick.getModel(), self.__mapper, table)
+        if not self.__keepData:
+            stats.data = None
+        return stats
@@ -0,0 +1,148 @@
+import os
+import time
+import logging
+import hashlib
+import numpy as np
+import pandas as pd
+
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel
+from azinvoicer.helpers import IOHelper, ModuleHelper
+
+PARQUET_AVAILABLE: bool = ModuleHelper.isAvailable("pyarrow")
+
+
+class InvoiceCache(object):
+    """on disk cache of loaded invoice tables, stored in a binary columnar format"""
+
+    DEFAULT_MAX_SIZE_MB: float = 2048
+    DEFAULT_MAX_AGE_DAYS: float = 31
+    HASH_BLOCK_SIZE: int = 1024 * 1024
+
+    __cacheDirPath: str
+    __maxSizeMb: float
+    __maxAgeDays: float
+    __hashContent: bool
+    __extension: str
+
+    def __init__(
+        self,
+        cacheDirPath: str,
+        maxSizeMb: float = DEFAULT_MAX_SIZE_MB,
+        maxAgeDays: float = DEFAULT_MAX_AGE_DAYS,
+        hashContent: bool = False,
+    ) -> None:
+        self.__logger = logging.getLogger("InvoiceCache")
+        self.__cacheDirPath = cacheDirPath
+        self.__maxSizeMb = maxSizeMb
+        self.__maxAgeDays = maxAgeDays
+        self.__hashContent = hashContent
+        # parquet requires pyarrow, fallback on pickles otherwise
+        self.__extension = ".parquet" if PARQUET_AVAILABLE else ".pkl"
+        IOHelper.mkdir(cacheDirPath)
+
+    def getCacheDirPath(self) -> str:
+        return self.__cacheDirPath
+
+    def getKey(self, level: ModelComplianceLevel, model: MappingModel, invoiceFilePath: str, variant: str = None) -> str:
+        stats = os.stat(invoiceFilePath)
+        parts: list = [
+            os.path.abspath(invoiceFilePath),
+            str(stats.st_size),
+            model.getName(),
+            level.name,
+            self.__getFileSignature(invoiceFilePath),
+        ]
+        # variants are tables derived from the same invoice, stored next to it
+        if variant is not None:
+            parts.append(variant)
+        signature: str = "|".join(parts)
+        return hashlib.sha256(signature.encode("utf-8")).hexdigest()
+
+    def get(self, level: ModelComplianceLevel, model: MappingModel, invoiceFilePath: str, variant: str = None) -> pd.DataFrame:
+        entryPath: str = self.__getEntryPath(self.getKey(level, model, invoiceFilePath, variant))
+        if not os.path.exists(entryPath):
+            return None
+
+        self.__logger.info("loading invoice file " + invoiceFilePath + " from cache entry " + entryPath)
+        try:
+            table: pd.DataFrame = self.__readEntry(entryPath)
+        except Exception as ex:
+            self.__logger.warning("ignoring unreadable cache entry " + entryPath + " error=" + repr(ex))
+            return None
+
+        # refresh the access time so that eviction removes the least recently used entries first
+        os.utime(entryPath)
+        return table
+
+    def put(
+        self,
+        level: ModelComplianceLevel,
+        model: MappingModel,
+        invoiceFilePath: str,
+        table: pd.DataFrame,
+        variant: str = None,
+    ) -> None:
+        entryPath: str = self.__getEntryPath(self.getKey(level, model, invoiceFilePath, variant))
+        # write to a temporary file first so that concurrent readers never see partial entries
+        if PARQUET_AVAILABLE:
+            IOHelper.writeAtomically(entryPath, lambda tmpPath: table.to_parquet(tmpPath, index=False))
+        else:
+            IOHelper.writeAtomically(entryPath, table.to_pickle)
+        self.evict()
+
+    def evict(self) -> None:
+        entries: list = list()
+        now: float = time.time()
+        for f in os.listdir(self.__cacheDirPath):
+            if f.endswith(self.__extension):
+                path: str = os.path.join(self.__cacheDirPath, f)
+                stats = os.stat(path)
+                entries.append((stats.st_mtime, stats.st_size, path))
+
+        # drop the entries that are too old
+        maxAgeSeconds: float = self.__maxAgeDays * 24 * 3600
+        kept: list = list()
+        for mtime, size, path in entries:
+            if now - mtime > maxAgeSeconds:
+                self.__removeEntry(path)
+            else:
+                kept.append((mtime, size, path))
+
+        # then the least recently used ones until the cache fits its size budget
+        kept.sort()
+        totalSize: int = sum(size for mtime, size, path in kept)
+        maxSize: float = self.__maxSizeMb * 1024 * 1024
+        for mtime, size, path in kept:
+            if totalSize <= maxSize:
+                break
+            self.__removeEntry(path)
+            totalSize = totalSize - size
+
+    def __removeEntry(self, path: str) -> None:
+        self.__logger.info("evicting cache entry " + path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __readEntry(self, entryPath: str) -> pd.DataFrame:
+        if PARQUET_AVAILABLE:
+            table: pd.DataFrame = pd.read_parquet(entryPath)
+            # parquet nulls come back as None in text columns, restore the NaN the csv reader produces
+            for c in table.columns:
+                if table[c].dtype == object and table[c].hasnans:
+                    table[c] = table[c].where(table[c].notna(), np.nan)
+            return table
+        return pd.read_pickle(entryPath)
+
+    def __getEntryPath(self, key: str) -> str:
+        return os.path.join(self.__cacheDirPath, key + self.__extension)
+
+    def __getFileSignature(self, invoiceFilePath: str) -> str:
+        if not self.__hashContent:
+            return str(os.stat(invoiceFilePath).st_mtime_ns)
+        digest = hashlib.sha256()
+        with open(invoiceFilePath, "rb") as f:
+            for block in iter(lambda: f.read(self.HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        return digest.hexdigest()
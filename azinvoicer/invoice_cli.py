@@ -0,0 +1,315 @@
+import os
+import time
+import functools
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Union
+import pandas as pd
+
+from azinvoicer.invoice_record import InvoiceStats, BatchInvoiceStats, GroupedInvoiceStats
+from azinvoicer.invoice_model import MappingModelRepository, ModelCompliancePicker, ModelCompliancePick, ModelComplianceLevel
+from azinvoicer.invoice_mappers import EnvironnementMapper
+from azinvoicer.invoice_mapperchain import MapperChain
+from azinvoicer.invoice_reader import InvoiceLoader, InvoiceParser, CsvEngine
+from azinvoicer.invoice_cache import InvoiceCache
+from azinvoicer.invoice_batch import InvoiceBatchProcessor
+from azinvoicer.invoice_parallel import ParallelInvoiceParser
+from azinvoicer.invoice_writer import InvoiceWriter, OutputFormat
+
+
+class InvoiceStageTimer(object):
+    """accumulates the time spent in each pipeline stage, stages may be timed from several threads"""
+
+    __seconds: dict
+    __calls: dict
+
+    def __init__(self) -> None:
+        self.__seconds = dict()
+        self.__calls = dict()
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self.__lock:
+            self.__seconds[stage] = self.__seconds.get(stage, 0.0) + seconds
+            self.__calls[stage] = self.__calls.get(stage, 0) + 1
+
+    def getStages(self) -> list:
+        """stages in the order they were first timed"""
+        return list(self.__seconds.keys())
+
+    def getSeconds(self, stage: str) -> float:
+        return self.__seconds.get(stage, 0.0)
+
+    def getCalls(self, stage: str) -> int:
+        return self.__calls.get(stage, 0)
+
+    def getSummary(self, wallSeconds: float) -> str:
+        # stages timed on several workers may add up to more than the wall clock time
+        total: float = sum(self.__seconds.values())
+        lines: list = ["{:<8} {:>10} {:>7} {:>6}".format("stage", "seconds", "share", "calls")]
+        for stage in self.getStages():
+            share: float = self.__seconds[stage] / total if total > 0 else 0.0
+            lines.append("{:<8} {:>10.3f} {:>6.1%} {:>6}".format(stage, self.__seconds[stage], share, self.__calls[stage]))
+        lines.append("{:<8} {:>10.3f}".format("wall", wallSeconds))
+        return "\n".join(lines)
+
+
+class InvoicePipeline(InvoiceBatchProcessor):
+    """picks a model, loads, maps and groups each invoice then writes the groups and a summary of all the invoices
+
+    the jobs spread several whole invoices over threads, a lone invoice or chunked invoices are spread over processes
+    """
+
+    STAGE_PICK: str = "pick"
+    STAGE_LOAD: str = "load"
+    STAGE_PARSE: str = "parse"
+    STAGE_WRITE: str = "write"
+    GROUPS_SUFFIX: str = "_groups"
+    SUMMARY_NAME: str = "summary"
+    DEFAULT_OUTPUT_DIR_PATH: str = "output"
+
+    __writer: InvoiceWriter
+    __outputDirPath: str
+    __chunkSize: int
+    __timer: InvoiceStageTimer
+
+    def __init__(
+        self,
+        repo: MappingModelRepository,
+        mapper: EnvironnementMapper,
+        writer: InvoiceWriter = None,
+        outputDirPath: str = DEFAULT_OUTPUT_DIR_PATH,
+        jobs: int = 1,
+        chunkSize: int = 0,
+        loader: InvoiceLoader = None,
+        parser: InvoiceParser = None,
+        timer: InvoiceStageTimer = None,
+    ) -> None:
+        super().__init__(repo, mapper, jobs, loader, parser)
+        self.__logger = logging.getLogger("InvoicePipeline")
+        self.__writer = writer if writer is not None else InvoiceWriter()
+        self.__outputDirPath = outputDirPath
+        # a zero chunk size loads whole invoices, which is the only way to use the invoice cache
+        self.__chunkSize = max(0, chunkSize)
+        self.__timer = timer if timer is not None else InvoiceStageTimer()
+
+    def getTimer(self) -> InvoiceStageTimer:
+        return self.__timer
+
+    def processInvoices(self, pathOrPattern: Union[str, list]) -> BatchInvoiceStats:
+        files: list = self.listInvoiceFiles(pathOrPattern)
+        if self.getJobs() > 1 and (self.__chunkSize > 0 or len(files) == 1):
+            # invoices are processed one after the other, each on all the jobs
+            ret: BatchInvoiceStats = self.processInvoiceFiles(
+                files, 1, functools.partial(self.processInvoiceFile, processes=self.getJobs())
+            )
+        else:
+            ret: BatchInvoiceStats = self.processInvoiceFiles(files)
+
+        with self.__timer.time(self.STAGE_WRITE):
+            self.__writer.write(
+                self.getSummary(ret.perFile), self.__writer.getOutputPath(self.__outputDirPath, self.SUMMARY_NAME)
+            )
+        return ret
+
+    def processInvoiceFile(self, invoiceFilePath: str, processes: int = 1) -> InvoiceStats:
+        grouped: GroupedInvoiceStats = self.groupInvoiceFile(invoiceFilePath, processes)
+        if grouped is None:
+            return None
+        name: str = os.path.splitext(os.path.basename(invoiceFilePath))[0] + self.GROUPS_SUFFIX
+        with self.__timer.time(self.STAGE_WRITE):
+            self.__writer.write(grouped.groups, self.__writer.getOutputPath(self.__outputDirPath, name))
+        return grouped.stats
+
+    def groupInvoiceFile(self, invoiceFilePath: str, processes: int = 1, useCache: bool = True) -> GroupedInvoiceStats:
+        """groups the invoice costs without writing anything, None when no model matches the invoice"""
+        with self.__timer.time(self.STAGE_PICK):
+            pick: ModelCompliancePick = ModelCompliancePicker().getBestMatchingModel(self.getRepository(), invoiceFilePath)
+        if pick.getLevel() == ModelComplianceLevel.NOT_COMPLIANT:
+            self.__logger.warning("no compliant model found for invoice file " + invoiceFilePath)
+            return None
+
+        # chunks are loaded lazily while grouping, the loading time is taken out of the parsing one
+        loadSeconds: list = list()
+        start: float = time.perf_counter()
+        if processes > 1:
+            chunkSize: int = self.__chunkSize if self.__chunkSize > 0 else ParallelInvoiceParser.DEFAULT_CHUNK_SIZE
+            parser: ParallelInvoiceParser = ParallelInvoiceParser(
+                processes, chunkSize, self.getParser().getMode(), self.getParser().isCategorical()
+            )
+            # whole invoices still go through the loader cache, they are split once loaded
+            grouped: GroupedInvoiceStats = parser.readAndGroupChunks(
+                pick.getLevel(),
+                pick.getModel(),
+                self.getMapper(),
+                self.__splitChunks(
+                    self.__loadChunks(pick, invoiceFilePath, self.__chunkSize, useCache, loadSeconds), chunkSize
+                ),
+            )
+        else:
+            grouped: GroupedInvoiceStats = self.getParser().readAndGroup(
+                pick.getLevel(),
+                pick.getModel(),
+                self.getMapper(),
+                self.__loadChunks(pick, invoiceFilePath, self.__chunkSize, useCache, loadSeconds),
+            )
+        self.__timer.add(self.STAGE_LOAD, sum(loadSeconds))
+        self.__timer.add(self.STAGE_PARSE, time.perf_counter() - start - sum(loadSeconds))
+        return grouped
+
+    def __loadChunks(
+        self, pick: ModelCompliancePick, invoiceFilePath: str, chunkSize: int, useCache: bool, loadSeconds: list
+    ) -> Iterator[pd.DataFrame]:
+        start: float = time.perf_counter()
+        if chunkSize == 0:
+            table: pd.DataFrame = self.getLoader().loadInvoice(pick.getLevel(), pick.getModel(), invoiceFilePath, useCache)
+            loadSeconds.append(time.perf_counter() - start)
+            yield table
+            return
+        chunks: Iterator[pd.DataFrame] = self.getLoader().streamInvoice(
+            pick.getLevel(), pick.getModel(), invoiceFilePath, chunkSize
+        )
+        for chunk in chunks:
+            loadSeconds.append(time.perf_counter() - start)
+            yield chunk
+            start = time.perf_counter()
+        loadSeconds.append(time.perf_counter() - start)
+
+    def __splitChunks(self, chunks: Iterator[pd.DataFrame], chunkSize: int) -> Iterator[pd.DataFrame]:
+        for chunk in chunks:
+            if len(chunk.index) <= chunkSize:
+                yield chunk
+                continue
+            for start in range(0, len(chunk.index), chunkSize):
+                end: int = start + chunkSize
+                yield chunk.iloc[start:end]
+
+    def getSummary(self, perFile: dict) -> pd.DataFrame:
+        """one line of totals per processed invoice"""
+        rows: list = [
+            {
+                "File": filePath,
+                "StartDate": stats.startDate,
+                "EndDate": stats.endDate,
+                "Currency": stats.currency,
+                "ParsedLines": stats.parsedLines,
+                "ParsedLinesWithoutEnv": stats.parsedLinesWithoutEnv,
+                "TotalBilled": stats.totalBilled,
+                "TotalBilledEnvs": stats.totalBilledEnvs,
+                "DistinctKeyRatio": stats.getDistinctKeyRatio(),
+            }
+            for filePath, stats in perFile.items()
+        ]
+        return pd.DataFrame(rows)
+
+
+class InvoiceCommandLine(object):
+    """command line entry point running the invoice pipeline"""
+
+    DEFAULT_MODELS_DIR_PATH: str = os.path.join(os.path.dirname(__file__), "models", "in")
+    DEFAULT_MAPPERS: list = ["azinvoicer.invoice_mappers:BasicTagsMapper", "azinvoicer.invoice_mappers:BasicRGMapper"]
+
+    @classmethod
+    def createParser(cls) -> argparse.ArgumentParser:
+        parser: argparse.ArgumentParser = argparse.ArgumentParser(
+            prog="azinvoicer", description="maps azure invoice lines to environnements and groups their costs"
+        )
+        parser.add_argument("invoices", nargs="*", help="invoice files, directories or glob patterns")
+        parser.add_argument(
+            "-o", "--output", default=InvoicePipeline.DEFAULT_OUTPUT_DIR_PATH, help="directory the reports are written to"
+        )
+        parser.add_argument("-f", "--format", choices=[f.value for f in OutputFormat], default=OutputFormat.CSV.value)
+        parser.add_argument("-m", "--models", default=cls.DEFAULT_MODELS_DIR_PATH, help="directory of the mapping models")
+        parser.add_argument(
+            "--mapper", action="append", dest="mappers", help="mapper declaration, pkg:Class or entry point name, repeatable"
+        )
+        parser.add_argument("--adaptive", action="store_true", help="reorder the mappers according to their hit rates")
+        parser.add_argument("--mapper-order", default=None, help="file the adaptive mapper order is loaded from and saved to")
+        parser.add_argument("-j", "--jobs", type=int, default=1, help="invoices processed concurrently")
+        parser.add_argument("--chunk-size", type=int, default=0, help="lines streamed at once, 0 loads whole invoices")
+        parser.add_argument("--cache-dir", default=None, help="directory caching the loaded invoices")
+        parser.add_argument("--engine", choices=[e.value for e in CsvEngine], default=CsvEngine.C.value)
+        parser.add_argument("--categorical", action="store_true", help="load low cardinality columns as categories")
+        parser.add_argument("--mapper-cache-size", type=int, default=0, help="mapper decisions memoized, 0 disables the cache")
+        parser.add_argument("--serve", action="store_true", help="serve invoices over a local http api instead")
+        parser.add_argument("--host", default="127.0.0.1", help="address the server listens on")
+        parser.add_argument("--port", type=int, default=8642, help="port the server listens on")
+        parser.add_argument("--root", default=None, help="directory the served invoice paths must be in")
+        return parser
+
+    def run(self, argv: list) -> int:
+        parser: argparse.ArgumentParser = self.createParser()
+        args: argparse.Namespace = parser.parse_args(argv)
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+        if args.chunk_size < 0:
+            parser.error("--chunk-size must not be negative")
+        if not args.serve and len(args.invoices) == 0:
+            parser.error("invoices are required unless serving")
+        if args.cache_dir is not None and args.chunk_size > 0:
+            logging.getLogger("InvoiceCommandLine").warning("--cache-dir is ignored when streaming with --chunk-size")
+
+        start: float = time.perf_counter()
+        chain: MapperChain = MapperChain(
+            args.mappers if args.mappers else self.DEFAULT_MAPPERS,
+            cacheSize=args.mapper_cache_size,
+            adaptive=args.adaptive,
+            orderFilePath=args.mapper_order,
+        )
+        cache: InvoiceCache = InvoiceCache(args.cache_dir) if args.cache_dir is not None else None
+        pipeline: InvoicePipeline = InvoicePipeline(
+            MappingModelRepository(args.models),
+            chain,
+            InvoiceWriter(OutputFormat(args.format)),
+            args.output,
+            jobs=args.jobs,
+            chunkSize=args.chunk_size,
+            loader=InvoiceLoader(cache, CsvEngine(args.engine), args.categorical),
+            parser=InvoiceParser(categorical=args.categorical),
+        )
+        try:
+            if args.serve:
+                return self.__serve(args, pipeline)
+            return self.__process(args, pipeline, start)
+        finally:
+            if args.adaptive and args.mapper_order is not None:
+                chain.saveOrder()
+
+    def __process(self, args: argparse.Namespace, pipeline: InvoicePipeline, start: float) -> int:
+        ret: BatchInvoiceStats = pipeline.processInvoices(args.invoices)
+        print(
+            "processed {} invoices, {} not compliant, {} failed, {} lines, {} without environnement".format(
+                len(ret.perFile),
+                len(ret.notCompliant),
+                len(ret.failed),
+                ret.merged.parsedLines,
+                ret.merged.parsedLinesWithoutEnv,
+            )
+        )
+        for path, error in ret.failed.items():
+            print("failed to process invoice file {}: {}".format(path, error))
+        print(pipeline.getTimer().getSummary(time.perf_counter() - start))
+        return 0 if len(ret.perFile) > 0 and len(ret.failed) == 0 else 1
+
+    def __serve(self, args: argparse.Namespace, pipeline: InvoicePipeline) -> int:
+        # imported here so that batch runs do not pay for the http server
+        from azinvoicer.invoice_server import InvoiceServer, InvoiceService
+
+        server: InvoiceServer = InvoiceServer(InvoiceService(pipeline, args.jobs, rootDirPath=args.root), args.host, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
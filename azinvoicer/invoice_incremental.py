@@ -0,0 +1,203 @@
+import os
+import csv
+import json
+import pathlib
+import logging
+import hashlib
+import datetime
+from dataclasses import dataclass, asdict
+
+from azinvoicer.invoice_record import InvoiceStats, InvoiceStatsAccumulator
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel
+from azinvoicer.invoice_mappers import EnvironnementMapper
+from azinvoicer.invoice_reader import InvoiceLoader, InvoiceParser
+from azinvoicer.helpers import IOHelper
+
+
+@dataclass
+class InvoiceCheckpoint:
+    filePath: str
+    byteOffset: int
+    rowCount: int
+    headerSignature: str
+    prefixSignature: str
+    modelName: str
+    level: str
+    startDate: str
+    endDate: str
+    parsedLines: int
+    parsedLinesWithoutEnv: int
+    totalBilled: float
+    totalBilledEnvs: float
+    currency: str
+    mappedKeys: int = 0
+
+    def getStats(self) -> InvoiceStats:
+        startDate: datetime = datetime.datetime.fromisoformat(self.startDate)
+        endDate: datetime = datetime.datetime.fromisoformat(self.endDate)
+        return InvoiceStats(
+            startDate=startDate,
+            endDate=endDate,
+            parsedLines=self.parsedLines,
+            parsedLinesWithoutEnv=self.parsedLinesWithoutEnv,
+            totalBilled=self.totalBilled,
+            totalBilledEnvs=self.totalBilledEnvs,
+            currency=self.currency,
+            billedDays=(endDate - startDate).days,
+            data=None,
+            mappedKeys=self.mappedKeys,
+        )
+
+
+class InvoiceCheckpointStore(object):
+    """persists one json checkpoint per invoice file"""
+
+    __storeDirPath: str
+
+    def __init__(self, storeDirPath: str) -> None:
+        self.__logger = logging.getLogger("InvoiceCheckpointStore")
+        self.__storeDirPath = storeDirPath
+        IOHelper.mkdir(storeDirPath)
+
+    def get(self, invoiceFilePath: str) -> InvoiceCheckpoint:
+        path: str = self.__getCheckpointPath(invoiceFilePath)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return InvoiceCheckpoint(**json.load(f))
+        except Exception as ex:
+            self.__logger.warning("ignoring unreadable checkpoint " + path + " error=" + repr(ex))
+            return None
+
+    def put(self, checkpoint: InvoiceCheckpoint) -> None:
+        path: str = self.__getCheckpointPath(checkpoint.filePath)
+        content: str = json.dumps(asdict(checkpoint), indent=2)
+        IOHelper.writeAtomically(path, lambda tmpPath: pathlib.Path(tmpPath).write_text(content))
+
+    def __getCheckpointPath(self, invoiceFilePath: str) -> str:
+        key: str = hashlib.sha256(os.path.abspath(invoiceFilePath).encode("utf-8")).hexdigest()
+        return os.path.join(self.__storeDirPath, key + ".json")
+
+
+class IncrementalInvoiceProcessor(object):
+    """parses only the lines appended to an invoice since the last run, falls back to a full parse if the prefix changed"""
+
+    SAMPLE_SIZE: int = 64 * 1024
+    HASH_BLOCK_SIZE: int = 1024 * 1024
+
+    __store: InvoiceCheckpointStore
+    __loader: InvoiceLoader
+    __parser: InvoiceParser
+    __sampledPrefixCheck: bool
+
+    def __init__(
+        self,
+        store: InvoiceCheckpointStore,
+        loader: InvoiceLoader = None,
+        parser: InvoiceParser = None,
+        sampledPrefixCheck: bool = False,
+    ) -> None:
+        self.__logger = logging.getLogger("IncrementalInvoiceProcessor")
+        self.__store = store
+        self.__loader = loader if loader is not None else InvoiceLoader()
+        self.__parser = parser if parser is not None else InvoiceParser()
+        # sampling only hashes the head and the tail of the parsed bytes, an edit in between goes unnoticed
+        self.__sampledPrefixCheck = sampledPrefixCheck
+
+    def processInvoice(
+        self, level: ModelComplianceLevel, model: MappingModel, mapper: EnvironnementMapper, invoiceFilePath: str
+    ) -> InvoiceStats:
+        """returns the stats of the whole invoice, the data only holds the lines parsed during this run"""
+        headerLine, headerEnd, size = self.__readHeaderAndSize(invoiceFilePath)
+        header: list = next(csv.reader([headerLine.decode("utf-8-sig")]))
+        headerSignature: str = hashlib.sha256(headerLine).hexdigest()
+
+        checkpoint: InvoiceCheckpoint = self.__store.get(invoiceFilePath)
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(keepData=True)
+        if self.__isResumable(checkpoint, level, model, invoiceFilePath, size, headerSignature):
+            self.__logger.info("resuming invoice " + invoiceFilePath + " from line " + str(checkpoint.rowCount))
+            accumulator.fold(checkpoint.getStats())
+            table = self.__loader.loadInvoiceFrom(level, model, invoiceFilePath, checkpoint.byteOffset, header, size)
+            rowCount: int = checkpoint.rowCount + len(table.index)
+        else:
+            self.__logger.info("parsing the whole invoice " + invoiceFilePath)
+            table = self.__loader.loadInvoiceFrom(level, model, invoiceFilePath, headerEnd, header, max(headerEnd, size))
+            rowCount: int = len(table.index)
+
+        tail: InvoiceStats = self.__parser.parseInputTableAndAddEnv(level, model, mapper, table)
+        accumulator.fold(tail)
+        stats: InvoiceStats = accumulator.getStats()
+
+        self.__store.put(
+            InvoiceCheckpoint(
+                filePath=os.path.abspath(invoiceFilePath),
+                byteOffset=max(headerEnd, size),
+                rowCount=rowCount,
+                headerSignature=headerSignature,
+                prefixSignature=self.__getPrefixSignature(invoiceFilePath, max(headerEnd, size)),
+                modelName=model.getName(),
+                level=level.name,
+                startDate=stats.startDate.isoformat(),
+                endDate=stats.endDate.isoformat(),
+                parsedLines=stats.parsedLines,
+                parsedLinesWithoutEnv=stats.parsedLinesWithoutEnv,
+                totalBilled=stats.totalBilled,
+                totalBilledEnvs=stats.totalBilledEnvs,
+                currency=stats.currency,
+                mappedKeys=stats.mappedKeys,
+            )
+        )
+        return stats
+
+    def __isResumable(
+        self,
+        checkpoint: InvoiceCheckpoint,
+        level: ModelComplianceLevel,
+        model: MappingModel,
+        invoiceFilePath: str,
+        size: int,
+        headerSignature: str,
+    ) -> bool:
+        if checkpoint is None:
+            return False
+        if checkpoint.modelName != model.getName() or checkpoint.level != level.name:
+            self.__logger.info("model changed since last checkpoint of " + invoiceFilePath)
+            return False
+        if checkpoint.headerSignature != headerSignature:
+            self.__logger.info("header changed since last checkpoint of " + invoiceFilePath)
+            return False
+        if size < checkpoint.byteOffset:
+            self.__logger.info("invoice " + invoiceFilePath + " shrank since last checkpoint")
+            return False
+        if checkpoint.prefixSignature != self.__getPrefixSignature(invoiceFilePath, checkpoint.byteOffset):
+            self.__logger.info("already parsed lines changed since last checkpoint of " + invoiceFilePath)
+            return False
+        return True
+
+    def __readHeaderAndSize(self, invoiceFilePath: str) -> tuple:
+        # only complete lines present now are read, lines still being appended are left for the next run
+        with open(invoiceFilePath, "rb") as f:
+            headerLine: bytes = f.readline()
+            headerEnd: int = f.tell()
+            size: int = IOHelper.getLastLineEnd(f, os.fstat(f.fileno()).st_size)
+        return headerLine.rstrip(b"\r\n"), headerEnd, size
+
+    def __getPrefixSignature(self, invoiceFilePath: str, byteOffset: int) -> str:
+        # hashing the already parsed bytes costs far less than parsing them again
+        digest = hashlib.sha256()
+        digest.update(str(byteOffset).encode("utf-8"))
+        with open(invoiceFilePath, "rb") as f:
+            if not self.__sampledPrefixCheck or byteOffset <= 2 * self.SAMPLE_SIZE:
+                remaining: int = byteOffset
+                while remaining > 0:
+                    block: bytes = f.read(min(self.HASH_BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    digest.update(block)
+                    remaining = remaining - len(block)
+            else:
+                digest.update(f.read(self.SAMPLE_SIZE))
+                f.seek(byteOffset - self.SAMPLE_SIZE)
+                digest.update(f.read(self.SAMPLE_SIZE))
+        return digest.hexdigest()
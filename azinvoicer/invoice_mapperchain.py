@@ -1,35 +1,364 @@
+import os
+import json
+import pathlib
+import time
 import logging
-from azinvoicer.invoice_mappers import Environnement, EnvironnementMapper
-from azinvoicer.module_loader import InvoiceClassToLoad, InvoiceClassLoader
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+import pandas as pd
+import numpy as np
+from azinvoicer.invoice_mappers import Environnement, EnvironnementMapper, MapperInputs
+from azinvoicer.module_loader import InvoiceClassLoader
+from azinvoicer.helpers import IOHelper
+
+
+@dataclass
+class MapperCacheStats:
+    size: int
+    maxSize: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+@dataclass
+class MapperRunStats:
+    declaration: str
+    lines: int = 0
+    hits: int = 0
+    seconds: float = 0.0
+
+    def getHitRate(self) -> float:
+        if self.lines == 0:
+            return 0.0
+        return self.hits / self.lines
+
+    def getCostPerHit(self) -> float:
+        # mappers never tried yet come first so that they get measured
+        if self.lines == 0:
+            return 0.0
+        if self.hits == 0:
+            return float("inf")
+        return self.seconds / self.hits
 
 
 class MapperChain(EnvironnementMapper):
+    """runs mappers in order until one returns an environnement
+
+    a nested list of declarations is a group of order independent mappers, i.e. mappers which never
+    disagree on a line, in adaptive mode each group is reordered by the cost per hit measured so far
+    """
+
+    REORDER_INTERVAL: int = 1000
+    ENTRY_POINT_GROUP: str = "azinvoicer.mappers"
 
     __mappers = list()
 
-    def __init__(self, mappers: list) -> None:
+    def __init__(
+        self,
+        mappers: list,
+        cacheSize: int = 0,
+        adaptive: bool = False,
+        orderFilePath: str = None,
+        sharedMappers: bool = True,
+    ) -> None:
         self.__logger = logging.getLogger("MapperChain")
-        self.__mappers = self.__loadMappers(mappers)
+        self.__mappers = list()
+        self.__groups = list()
+        self.__runStats = list()
+        self.__loadMappers(mappers, sharedMappers)
+        self.__order = [i for g in self.__groups for i in g]
+        self.__inputs = self.__getChainInputs()
+        self.__adaptive = adaptive
+        self.__orderFilePath = orderFilePath
+        self.__decisions = 0
+        # decisions are memoized on the inputs the mappers depend on, a zero size disables the cache
+        self.__cacheSize = cacheSize
+        self.__cache = OrderedDict()
+        self.__cacheLock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        if orderFilePath is not None and os.path.exists(orderFilePath):
+            self.__loadOrder(orderFilePath)
+
+    def __getstate__(self) -> dict:
+        # chains are shipped to worker processes, they start with an empty cache of their own
+        state: dict = self.__dict__.copy()
+        state["_MapperChain__cache"] = OrderedDict()
+        del state["_MapperChain__cacheLock"]
+        return state
 
-    def __loadMappers(self, mappers: list) -> list:
-        mapperInstances = list()
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.__cacheLock = threading.Lock()
 
+    def __loadMappers(self, mappers: list, sharedMappers: bool) -> None:
         for m in mappers:
-            if InvoiceClassToLoad.isValidDeclaration(m):
-                ctl: InvoiceClassToLoad = InvoiceClassToLoad(m)
-                mapperInstance = InvoiceClassLoader.loadClassInstance(ctl)
-                mapperInstances.append(mapperInstance)
-            else:
-                self.__logger.warn("ignoring invalid mapper declaration " + m)
+            declarations: list = m if isinstance(m, list) else [m]
+            group: list = list()
+            for d in declarations:
+                # either a pkg:Class declaration or the name of an entry point published by an installed package
+                mapper: EnvironnementMapper = InvoiceClassLoader.loadDeclaration(
+                    d, self.ENTRY_POINT_GROUP, EnvironnementMapper, sharedMappers
+                )
+                if mapper is None:
+                    self.__logger.warning("ignoring invalid mapper declaration " + str(d))
+                    continue
+                group.append(len(self.__mappers))
+                self.__mappers.append(mapper)
+                self.__runStats.append(MapperRunStats(declaration=d))
+            if len(group) > 0:
+                self.__groups.append(group)
+
+    def __getChainInputs(self) -> list:
+        used: set = set()
+        for m in self.__mappers:
+            used.update(m.getInputs())
+        return [i for i in MapperInputs.ALL_INPUTS if i in used]
 
-        return mapperInstances
+    def getInputs(self) -> list:
+        return self.__inputs
+
+    def getOrder(self) -> list:
+        """declarations of the mappers, in the order they are currently tried"""
+        return [self.__runStats[i].declaration for i in self.__order]
+
+    def getMapperStats(self) -> list:
+        with self.__cacheLock:
+            return [
+                MapperRunStats(declaration=r.declaration, lines=r.lines, hits=r.hits, seconds=r.seconds)
+                for r in self.__runStats
+            ]
+
+    def addMapperStats(self, stats: list) -> None:
+        """adds the stats measured by a copy of the chain, i.e. in a worker process, in adaptive mode the mappers are reordered"""
+        with self.__cacheLock:
+            for r, s in zip(self.__runStats, stats):
+                r.lines = r.lines + s.lines
+                r.hits = r.hits + s.hits
+                r.seconds = r.seconds + s.seconds
+        if self.__adaptive:
+            self.reorder()
+
+    def reorder(self) -> None:
+        with self.__cacheLock:
+            order: list = list()
+            for g in self.__groups:
+                # stable sort, mappers measuring the same keep their declared order
+                order.extend(sorted(g, key=lambda i: self.__runStats[i].getCostPerHit()))
+            if order != self.__order:
+                self.__logger.debug("mappers reordered " + str([self.__runStats[i].declaration for i in order]))
+            self.__order = order
+
+    def saveOrder(self, orderFilePath: str = None) -> None:
+        path: str = orderFilePath if orderFilePath is not None else self.__orderFilePath
+        content: dict = {
+            "order": self.getOrder(),
+            "stats": [
+                {"declaration": r.declaration, "lines": r.lines, "hits": r.hits, "seconds": r.seconds}
+                for r in self.getMapperStats()
+            ],
+        }
+        text: str = json.dumps(content, indent=2)
+        IOHelper.writeAtomically(path, lambda tmpPath: pathlib.Path(tmpPath).write_text(text))
+
+    def __loadOrder(self, orderFilePath: str) -> None:
+        try:
+            with open(orderFilePath, "r") as f:
+                content: dict = json.load(f)
+        except Exception as ex:
+            self.__logger.warning("ignoring unreadable mapper order " + orderFilePath + " error=" + repr(ex))
+            return
+
+        # learned stats are restored for the mappers still declared, the groups always come from the declaration
+        saved: dict = {r["declaration"]: r for r in content.get("stats", list())}
+        for r in self.__runStats:
+            if r.declaration in saved:
+                r.lines = saved[r.declaration]["lines"]
+                r.hits = saved[r.declaration]["hits"]
+                r.seconds = saved[r.declaration]["seconds"]
+        self.reorder()
+
+    def getCacheStats(self) -> MapperCacheStats:
+        with self.__cacheLock:
+            return MapperCacheStats(
+                size=len(self.__cache),
+                maxSize=self.__cacheSize,
+                hits=self.__hits,
+                misses=self.__misses,
+                evictions=self.__evictions,
+            )
 
     def getEnvironnement(
         self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
     ) -> Environnement:
-        for m in self.__mappers:
+        if self.__cacheSize <= 0:
+            return self.__runMappers(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+
+        values: dict = {
+            MapperInputs.SERVICE_FAMILY: serviceFamily,
+            MapperInputs.SERVICE_NAME: serviceName,
+            MapperInputs.SKU_NAME: skuName,
+            MapperInputs.REGION_NAME: regionName,
+            MapperInputs.RESOURCE_GROUP_NAME: resourceGroupName,
+            MapperInputs.TAGS: tags,
+        }
+        key: tuple = tuple(self.__freeze(values[i]) for i in self.__inputs)
+
+        with self.__cacheLock:
+            if key in self.__cache:
+                self.__cache.move_to_end(key)
+                self.__hits = self.__hits + 1
+                return self.__cache[key]
+            self.__misses = self.__misses + 1
+
+        e: Environnement = self.__runMappers(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+
+        with self.__cacheLock:
+            self.__cache[key] = e
+            if len(self.__cache) > self.__cacheSize:
+                self.__cache.popitem(last=False)
+                self.__evictions = self.__evictions + 1
+        return e
+
+    def getEnvironnementBatch(
+        self,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        if self.__cacheSize <= 0:
+            return self.__runMappersBatch(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+
+        values: dict = {
+            MapperInputs.SERVICE_FAMILY: serviceFamily,
+            MapperInputs.SERVICE_NAME: serviceName,
+            MapperInputs.SKU_NAME: skuName,
+            MapperInputs.REGION_NAME: regionName,
+            MapperInputs.RESOURCE_GROUP_NAME: resourceGroupName,
+            MapperInputs.TAGS: tags,
+        }
+        columns: list = [[self.__freeze(v) for v in values[i].tolist()] for i in self.__inputs]
+        # a chain depending on no input decides every line the same way
+        keys: list = list(zip(*columns)) if len(columns) > 0 else [tuple()] * len(resourceGroupName.index)
+
+        # rows whose inputs were already decided are answered from the cache, the other ones run through the mappers
+        result: pd.Series = pd.Series(Environnement.NA, index=resourceGroupName.index, dtype=object)
+        missing: list = list()
+        with self.__cacheLock:
+            for position, key in enumerate(keys):
+                if key in self.__cache:
+                    self.__cache.move_to_end(key)
+                    result.iat[position] = self.__cache[key]
+                else:
+                    missing.append(position)
+            self.__hits = self.__hits + len(keys) - len(missing)
+            self.__misses = self.__misses + len(missing)
+        if len(missing) == 0:
+            return result
+
+        envs: pd.Series = self.__runMappersBatch(
+            serviceFamily.iloc[missing],
+            serviceName.iloc[missing],
+            skuName.iloc[missing],
+            regionName.iloc[missing],
+            resourceGroupName.iloc[missing],
+            tags.iloc[missing],
+        )
+        result.iloc[missing] = envs.to_numpy()
+
+        with self.__cacheLock:
+            for position, e in zip(missing, envs.tolist()):
+                self.__cache[keys[position]] = e
+                if len(self.__cache) > self.__cacheSize:
+                    self.__cache.popitem(last=False)
+                    self.__evictions = self.__evictions + 1
+        return result
+
+    def __runMappersBatch(
+        self,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        # rows are addressed by position, the index may hold duplicated labels
+        result: np.ndarray = np.full(len(resourceGroupName.index), Environnement.NA, dtype=object)
+        remaining: np.ndarray = np.arange(len(resourceGroupName.index))
+        # each mapper only receives the rows the previous ones were not able to map
+        for i in self.__order:
+            if len(remaining) == 0:
+                break
+            start: float = time.perf_counter()
+            envs: np.ndarray = EnvironnementMapper.mapBatch(
+                self.__mappers[i],
+                serviceFamily.iloc[remaining],
+                serviceName.iloc[remaining],
+                skuName.iloc[remaining],
+                regionName.iloc[remaining],
+                resourceGroupName.iloc[remaining],
+                tags.iloc[remaining],
+            ).to_numpy(dtype=object)
+            mapped: np.ndarray = envs != Environnement.NA
+            result[remaining[mapped]] = envs[mapped]
+            if self.__adaptive:
+                self.__record(i, len(remaining), int(mapped.sum()), time.perf_counter() - start)
+            remaining = remaining[~mapped]
+
+        if self.__adaptive:
+            self.reorder()
+        return pd.Series(result, index=resourceGroupName.index, dtype=object)
+
+    def __runMappers(
+        self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
+    ) -> Environnement:
+        if self.__adaptive:
+            return self.__runMappersAdaptive(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+        for i in self.__order:
+            m = self.__mappers[i]
             e: Environnement = m.getEnvironnement(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
             if e != Environnement.NA:
                 self.__logger.debug("mapper " + m.__class__.__name__ + " returned an environnement")
                 return e
         return Environnement.NA
+
+    def __runMappersAdaptive(
+        self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
+    ) -> Environnement:
+        e: Environnement = Environnement.NA
+        for i in self.__order:
+            start: float = time.perf_counter()
+            e = self.__mappers[i].getEnvironnement(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+            self.__record(i, 1, 0 if e == Environnement.NA else 1, time.perf_counter() - start)
+            if e != Environnement.NA:
+                break
+
+        self.__decisions = self.__decisions + 1
+        if self.__decisions % self.REORDER_INTERVAL == 0:
+            self.reorder()
+        return e
+
+    def __record(self, index: int, lines: int, hits: int, seconds: float) -> None:
+        with self.__cacheLock:
+            r: MapperRunStats = self.__runStats[index]
+            r.lines = r.lines + lines
+            r.hits = r.hits + hits
+            r.seconds = r.seconds + seconds
+
+    def __freeze(self, value: any) -> any:
+        # make the input hashable, missing values share the same key
+        if isinstance(value, Mapping):
+            return tuple(sorted((k, self.__freeze(v)) for k, v in value.items()))
+        if isinstance(value, list):
+            return tuple(self.__freeze(v) for v in value)
+        if isinstance(value, float) and value != value:
+            return None
+        return value
@@ -1,6 +1,12 @@
 import re
 import logging
+import functools
+from collections.abc import Mapping
 from enum import Enum
+import numpy as np
+import pandas as pd
+
+from azinvoicer.invoice_tagreader import TagReader
 
 
 class Environnement(Enum):
@@ -18,19 +24,102 @@ class Environnement(Enum):
     GLOBAL = 9
 
 
+class MapperInputs(object):
+    """names of the mapper inputs, in the getEnvironnement arguments order"""
+
+    SERVICE_FAMILY: str = "serviceFamily"
+    SERVICE_NAME: str = "serviceName"
+    SKU_NAME: str = "skuName"
+    REGION_NAME: str = "regionName"
+    RESOURCE_GROUP_NAME: str = "resourceGroupName"
+    TAGS: str = "tags"
+
+    ALL_INPUTS = [SERVICE_FAMILY, SERVICE_NAME, SKU_NAME, REGION_NAME, RESOURCE_GROUP_NAME, TAGS]
+
+
 class EnvironnementMapper(object):
+
+    # inputs the mapper decision depends on, mappers using fewer inputs should narrow it down
+    INPUTS: list = MapperInputs.ALL_INPUTS
+    # stateless mappers can be shared by all the chains of a process
+    SHAREABLE: bool = False
+
+    def getInputs(self) -> list:
+        return self.INPUTS
+
     def getEnvironnement(
         self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
     ) -> Environnement:
         pass
 
+    def getEnvironnementBatch(
+        self,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        """maps whole columns at once, mappers able to use vectorized operations should override it"""
+        return EnvironnementMapper.mapRows(self, serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+
+    @classmethod
+    def mapRows(
+        cls,
+        mapper: any,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        # per row fallback, usable for any object providing getEnvironnement
+        envs: list = [
+            mapper.getEnvironnement(f, n, s, r, g, t)
+            for f, n, s, r, g, t in zip(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+        ]
+        return pd.Series(envs, index=resourceGroupName.index, dtype=object)
+
+    @classmethod
+    def mapBatch(
+        cls,
+        mapper: any,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        # custom mappers not deriving from EnvironnementMapper may lack the batch form
+        if hasattr(mapper, "getEnvironnementBatch"):
+            return mapper.getEnvironnementBatch(serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+        return cls.mapRows(mapper, serviceFamily, serviceName, skuName, regionName, resourceGroupName, tags)
+
 
 class SingleEnvironnementMapper(EnvironnementMapper):
+
+    INPUTS: list = []
+    SHAREABLE: bool = True
+
     def getEnvironnement(
         self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
     ) -> Environnement:
         return Environnement.GLOBAL
 
+    def getEnvironnementBatch(
+        self,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        return pd.Series(Environnement.GLOBAL, index=resourceGroupName.index, dtype=object)
+
 
 class TokenListMatcher(object):
     @classmethod
@@ -90,41 +179,96 @@ class CommonMappingTokens(object):
         return TokenListMatcher.isMatchingAnyToken(item, CommonMappingTokens.GLOBAL_TOKEN)
 
 
-class CommonStringMapper(object):
-    @classmethod
-    def getEnvironnement(cls, token: str) -> Environnement:
-
-        if CommonMappingTokens.isMatchingPreProd(token):
-            return Environnement.PREPRO
+class PriorityTokenMatcher(object):
+    """matches a string against prioritized token lists in a single scan
 
-        if CommonMappingTokens.isMatchingProd(token):
-            return Environnement.PROD
+    the table lists (environnement, tokens) pairs by decreasing priority, the environnement of the highest
+    priority list having any token found anywhere in the string is returned, as successive searches would
+    """
 
-        if CommonMappingTokens.isMatchingTest(token):
-            return Environnement.TEST
+    __table: list
+    __pattern: re.Pattern
+    __priorityPatterns: list
 
-        if CommonMappingTokens.isMatchingStaging(token):
-            return Environnement.STAGING
+    def __init__(self, table: list) -> None:
+        self.__table = list(table)
+        alternatives: list = list()
+        self.__priorityPatterns = list()
+        for index, (environnement, tokens) in enumerate(self.__table):
+            alternative: str = "|".join("(?:" + t + ")" for t in tokens)
+            alternatives.append("(?P<p" + str(index) + ">" + alternative + ")")
+            self.__priorityPatterns.append(re.compile(alternative, re.IGNORECASE))
+        # a lookahead reports the best alternative starting at every position, overlapping tokens included
+        self.__pattern = re.compile("(?=" + "|".join(alternatives) + ")", re.IGNORECASE)
 
-        if CommonMappingTokens.isMatchingDev(token):
-            return Environnement.DEV
+    def getEnvironnement(self, item: str) -> Environnement:
+        if not isinstance(item, str):
+            return Environnement.NA
+        best: int = len(self.__table)
+        for m in self.__pattern.finditer(item):
+            priority: int = self.__getPriority(m)
+            if priority < best:
+                best = priority
+                if best == 0:
+                    break
+        if best == len(self.__table):
+            return Environnement.NA
+        return self.__table[best][0]
+
+    def getEnvironnementBatch(self, items: pd.Series) -> pd.Series:
+        # rows are addressed by position, the index may hold duplicated labels
+        values: np.ndarray = items.to_numpy(dtype=object)
+        result: np.ndarray = np.full(len(values), Environnement.NA, dtype=object)
+        remaining: np.ndarray = np.flatnonzero(np.fromiter((isinstance(i, str) for i in values), dtype=bool, count=len(values)))
+        # resolve the priorities in order, each one only scans the items not matched yet
+        for (environnement, tokens), pattern in zip(self.__table, self.__priorityPatterns):
+            if len(remaining) == 0:
+                break
+            matched: np.ndarray = (
+                pd.Series(values[remaining], dtype=object).str.contains(pattern, regex=True).to_numpy(dtype=bool)
+            )
+            result[remaining[matched]] = environnement
+            remaining = remaining[~matched]
+        return pd.Series(result, index=items.index, dtype=object)
+
+    def __getPriority(self, match: re.Match) -> int:
+        name: str = match.lastgroup
+        if name is None or not name.startswith("p"):
+            # tokens holding their own groups hide the priority group, look it up
+            name = next(k for k, v in match.groupdict().items() if v is not None and k.startswith("p"))
+        return int(name[1:])
 
-        if CommonMappingTokens.isMatchingDemo(token):
-            return Environnement.DEMO
 
-        if CommonMappingTokens.isMatchingSandbox(token):
-            return Environnement.SANDBOX
+class CommonStringMapper(object):
 
-        if CommonMappingTokens.isMatchingInternal(token):
-            return Environnement.INTERNAL
+    MATCHER: PriorityTokenMatcher = PriorityTokenMatcher(
+        [
+            (Environnement.PREPRO, CommonMappingTokens.PREPROD_TOKENS),
+            (Environnement.PROD, CommonMappingTokens.PROD_TOKENS),
+            (Environnement.TEST, CommonMappingTokens.TEST_TOKENS),
+            (Environnement.STAGING, CommonMappingTokens.STAGING_TOKENS),
+            (Environnement.DEV, CommonMappingTokens.DEV_TOKENS),
+            (Environnement.DEMO, CommonMappingTokens.DEMO_TOKENS),
+            (Environnement.SANDBOX, CommonMappingTokens.SANDBOX_TOKENS),
+            (Environnement.INTERNAL, CommonMappingTokens.INTERNAL_TOKENS),
+            (Environnement.GLOBAL, CommonMappingTokens.GLOBAL_TOKEN),
+        ]
+    )
 
-        if CommonMappingTokens.isMatchingGlobal(token):
-            return Environnement.GLOBAL
+    @classmethod
+    def getEnvironnement(cls, token: str) -> Environnement:
+        return cls.MATCHER.getEnvironnement(token)
 
-        return Environnement.NA
+    @classmethod
+    def getEnvironnementBatch(cls, tokens: pd.Series) -> pd.Series:
+        return cls.MATCHER.getEnvironnementBatch(tokens)
 
 
 class BasicRGMapper(EnvironnementMapper):
+
+    INPUTS: list = [MapperInputs.RESOURCE_GROUP_NAME]
+    SHAREABLE: bool = True
+
     def __init__(self) -> None:
         self.logger = logging.getLogger("BasicRGMapper")
 
@@ -133,6 +277,17 @@ class BasicRGMapper(EnvironnementMapper):
     ) -> Environnement:
         return CommonStringMapper.getEnvironnement(resourceGroupName)
 
+    def getEnvironnementBatch(
+        self,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        return CommonStringMapper.getEnvironnementBatch(resourceGroupName)
+
 
 class TagMatcher(object):
 
@@ -140,23 +295,65 @@ class TagMatcher(object):
 
     @classmethod
     def getEnvKey(cls, tags: dict) -> str:
-        for k in tags.keys():
+        return cls.getEnvKeyFromKeys(tuple(tags.keys()))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def getEnvKeyFromKeys(keys: tuple) -> str:
+        # key schemas repeat across lines, the decision is memoized per key tuple
+        for k in keys:
             if TokenListMatcher.isMatchingAnyToken(k, TagMatcher.TAGS_ENV_KEYS):
                 return k
         return None
 
 
 class BasicTagsMapper(EnvironnementMapper):
+
+    INPUTS: list = [MapperInputs.TAGS]
+    SHAREABLE: bool = True
+
     def __init__(self) -> None:
         self.logger = logging.getLogger("BasicRGMapper")
 
     def getEnvironnement(
         self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
     ) -> Environnement:
+        tagvalue: str = self.__getEnvTagValue(tags)
+        if tagvalue is None:
+            return Environnement.NA
+        return CommonStringMapper.getEnvironnement(tagvalue)
+
+    def getEnvironnementBatch(
+        self,
+        serviceFamily: pd.Series,
+        serviceName: pd.Series,
+        skuName: pd.Series,
+        regionName: pd.Series,
+        resourceGroupName: pd.Series,
+        tags: pd.Series,
+    ) -> pd.Series:
+        try:
+            # each distinct tag string is only read once
+            codes, uniques = pd.factorize(tags)
+        except TypeError:
+            # decoded tags are not hashable
+            return CommonStringMapper.getEnvironnementBatch(tags.map(self.__getEnvTagValue))
+        values: np.ndarray = np.array([self.__getEnvTagValue(u) for u in uniques] + [None], dtype=object)
+        return CommonStringMapper.getEnvironnementBatch(pd.Series(values[codes], index=tags.index, dtype=object))
+
+    def __getEnvTagValue(self, tags: any) -> str:
+        # tags come either decoded or as read from the invoice
+        if isinstance(tags, str):
+            # only the value of the env key is extracted from the raw tags
+            key: str = TagMatcher.getEnvKeyFromKeys(TagReader.getTagKeys(tags))
+            if key is None:
+                return None
+            return TagReader.getSelectedTags(tags, [key]).get(key, None)
+        elif not isinstance(tags, Mapping):
+            return None
+
         # check if there is any compelling key in the tags
         key: str = TagMatcher.getEnvKey(tags)
         if key is None:
-            return Environnement.NA
-
-        tagvalue = tags[key]
-        return CommonStringMapper.getEnvironnement(tagvalue)
+            return None
+        return tags[key]
@@ -1,9 +1,17 @@
 import os
+import csv
+import pickle
+import pathlib
 import logging
-import yaml
-from yaml.loader import SafeLoader
+import hashlib
+import time
+import threading
+import weakref
+from dataclasses import dataclass
+from types import MappingProxyType
 from enum import Enum
-import pandas as pd
+
+from azinvoicer.helpers import IOHelper
 
 
 class MandatoryFields(object):
@@ -35,6 +43,16 @@ class MandatoryFields(object):
         BILLING_PERIOD_END,
     ]
 
+    # low cardinality fields, tens to thousands of distinct values for millions of lines
+    CATEGORICAL_FIELDS = [
+        SERVICE_FAMILY,
+        METER_CATEGORY,
+        METER_NAME,
+        RESOURCE_LOCATION,
+        BILLING_CURRENCY,
+        RESOURCE_GROUP_NAME,
+    ]
+
 
 class OptionalFields(object):
     """optional fields keys"""
@@ -58,48 +76,117 @@ class OptionFlags(object):
 class ModelLoader(object):
     @classmethod
     def loadYamlFile(self, filePath: str) -> dict:
+        # imported on first use, processes loading models from a snapshot never need it
+        import yaml
+
+        # libyaml bindings parse several times faster than the pure python loader
+        loader: type = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
         with open(filePath, "r") as f:
-            data = yaml.load(f, Loader=SafeLoader)
+            data = yaml.load(f, Loader=loader)
             return data
 
 
+@dataclass(frozen=True)
+class MappingModelIndex:
+    """immutable lookup tables compiled from a model description"""
+
+    mandatoryColumns: MappingProxyType
+    optionalColumns: MappingProxyType
+    mandatoryColumnNames: tuple
+    optionalColumnNames: tuple
+    mandatoryColumnSet: frozenset
+    optionalColumnSet: frozenset
+    columnTypes: MappingProxyType
+    options: MappingProxyType
+
+    @classmethod
+    def create(cts, mandatory: dict, optional: dict, columnTypes: dict, options: dict) -> "MappingModelIndex":
+        mandatoryNames: tuple = tuple(mandatory[f] for f in MandatoryFields.ALL_FIELDS)
+        optionalNames: tuple = tuple(optional[f] for f in OptionalFields.ALL_FIELDS)
+        return MappingModelIndex(
+            mandatoryColumns=MappingProxyType(dict(mandatory)),
+            optionalColumns=MappingProxyType(dict(optional)),
+            mandatoryColumnNames=mandatoryNames,
+            optionalColumnNames=optionalNames,
+            mandatoryColumnSet=frozenset(mandatoryNames),
+            optionalColumnSet=frozenset(optionalNames),
+            columnTypes=MappingProxyType(dict(columnTypes)),
+            options=MappingProxyType(dict(options)),
+        )
+
+    def __reduce__(self) -> tuple:
+        # mapping proxies can not be pickled, models are shipped to worker processes
+        return (
+            MappingModelIndex.create,
+            (dict(self.mandatoryColumns), dict(self.optionalColumns), dict(self.columnTypes), dict(self.options)),
+        )
+
+
 class MappingModel(object):
     """invoice column mapping model"""
 
-    __modelData: dict = dict()
+    DEFAULT_DATE_FORMAT: str = "%m/%d/%Y"
+
+    __index: MappingModelIndex
     __modelName: str
 
     def __init__(self, filePath: str) -> None:
         self.__logger = logging.getLogger("MappingModel")
-        self.__modelData = ModelLoader.loadYamlFile(filePath)
         modelName = os.path.basename(filePath)
         self.__modelName = modelName.replace(".yaml", "").replace(".yml", "")
+        self.__index = self.__compile(ModelLoader.loadYamlFile(filePath))
+
+    def __compile(self, modelData: dict) -> MappingModelIndex:
+        # the model is looked up for every invoice and column, resolve it once
+        mandatory: dict = modelData["model"]["mandatoryColumns"]
+        optional: dict = modelData["model"]["optionalColumns"]
+        for fields, columns in [(MandatoryFields.ALL_FIELDS, mandatory), (OptionalFields.ALL_FIELDS, optional)]:
+            missing: list = [f for f in fields if f not in columns]
+            if len(missing) > 0:
+                raise ValueError("model " + self.__modelName + " does not map fields " + str(missing))
+
+        # declared types are optional, columns without a declared type are inferred by the reader
+        types: dict = dict()
+        declared: dict = modelData.get("dtypes", None) or dict()
+        for field, dtype in declared.items():
+            if field in mandatory:
+                types[mandatory[field]] = dtype
+            elif field in optional:
+                types[optional[field]] = dtype
+            else:
+                self.__logger.warning("ignoring type declared for unknown field " + field)
+
+        options: dict = dict(modelData.get("options", None) or dict())
+        options.setdefault(OptionFlags.DATE_FORMAT, self.DEFAULT_DATE_FORMAT)
+
+        return MappingModelIndex.create(mandatory, optional, types, options)
+
+    def getIndex(self) -> MappingModelIndex:
+        return self.__index
 
     def getMandatoryColumnName(self, fieldMappingConstant: str) -> str:
-        return self.__modelData["model"]["mandatoryColumns"][fieldMappingConstant]
+        return self.__index.mandatoryColumns[fieldMappingConstant]
 
     def getOptionalColumnName(self, fieldMappingConstant: str) -> str:
-        return self.__modelData["model"]["optionalColumns"][fieldMappingConstant]
+        return self.__index.optionalColumns[fieldMappingConstant]
+
+    def getColumnTypes(self) -> dict:
+        return dict(self.__index.columnTypes)
 
     def getOption(self, optionName: str) -> str:
-        if optionName == OptionFlags.DATE_FORMAT:
-            if OptionFlags.DATE_FORMAT in self.__modelData.keys():
-                return self.__modelData["options"][optionName]
-            else:
-                return "%m/%d/%Y"
-        return self.__modelData["options"][optionName]
+        return self.__index.options[optionName]
 
     def getMandatoryColumnNames(self) -> list:
-        ret = list()
-        for m in MandatoryFields.ALL_FIELDS:
-            ret.append(self.getMandatoryColumnName(m))
-        return ret
+        return list(self.__index.mandatoryColumnNames)
 
     def getOptionalColumnNames(self) -> list:
-        ret = list()
-        for o in OptionalFields.ALL_FIELDS:
-            ret.append(self.getOptionalColumnName(o))
-        return ret
+        return list(self.__index.optionalColumnNames)
+
+    def getMandatoryColumnSet(self) -> frozenset:
+        return self.__index.mandatoryColumnSet
+
+    def getOptionalColumnSet(self) -> frozenset:
+        return self.__index.optionalColumnSet
 
     def getName(self) -> str:
         return self.__modelName
@@ -134,35 +221,125 @@ class OutputModel(object):
 
 
 class MappingModelRepository(object):
-    """repository of all known mapping models read from a single directory location"""
+    """repository of all known mapping models read from a single directory location
+
+    refresh() reloads the model files whose modification time changed, with a refresh interval
+    the repository refreshes itself when accessed so that long running processes stay current
+
+    with a snapshot path the compiled models are saved there and reused by the next processes
+    as long as the model files did not change, the snapshot is a pickle and must not be shared
+    """
+
+    SNAPSHOT_FORMAT: int = 1
 
     __models: dict = dict()
+    __files: dict
+    __version: int
 
-    def __init__(self, repoDirPath: str) -> None:
+    def __init__(self, repoDirPath: str, refreshInterval: float = None, snapshotPath: str = None) -> None:
         self.__logger = logging.getLogger("MappingModelRepository")
-        modelFiles = self.__listModelFilesFromRepo(repoDirPath)
-        self.__models = self.__loadModelFilesFromRepo(modelFiles)
+        self.__repoDirPath = repoDirPath
+        self.__refreshInterval = refreshInterval
+        self.__snapshotPath = snapshotPath
+        self.__refreshLock = threading.Lock()
+        self.__files = dict()
+        self.__version = 0
+        self.__lastRefresh = time.monotonic()
+        if not self.__loadSnapshot():
+            self.refresh()
 
     def listModelNames(self) -> list:
+        self.__refreshIfDue()
         return list(self.__models.keys())
 
     def getModel(self, modelName: str) -> MappingModel:
+        self.__refreshIfDue()
         return self.__models[modelName]
 
+    def getVersion(self) -> int:
+        """incremented each time the set of loaded models changes"""
+        self.__refreshIfDue()
+        return self.__version
+
+    def refresh(self) -> bool:
+        with self.__refreshLock:
+            self.__lastRefresh = time.monotonic()
+            files: dict = dict()
+            for filePath in self.__listModelFilesFromRepo(self.__repoDirPath):
+                mtime: int = os.stat(filePath).st_mtime_ns
+                known: tuple = self.__files.get(filePath, None)
+                if known is not None and known[0] == mtime:
+                    files[filePath] = known
+                    continue
+                # invalid files are remembered too, they are only read again once modified
+                files[filePath] = (mtime, self.__loadModelFile(filePath))
+
+            changed: bool = files.keys() != self.__files.keys() or any(
+                files[f][1] is not self.__files[f][1] for f in files.keys()
+            )
+            if changed:
+                # readers keep using the previous dict until the new one is complete
+                self.__files = files
+                self.__models = {m.getName(): m for mtime, m in files.values() if m is not None}
+                self.__version = self.__version + 1
+                if self.__snapshotPath is not None:
+                    self.__saveSnapshot()
+            return changed
+
+    def __loadSnapshot(self) -> bool:
+        if self.__snapshotPath is None or not os.path.exists(self.__snapshotPath):
+            return False
+        try:
+            with open(self.__snapshotPath, "rb") as f:
+                snapshot: dict = pickle.load(f)
+            if snapshot["format"] != self.SNAPSHOT_FORMAT or snapshot["repoDirPath"] != os.path.abspath(self.__repoDirPath):
+                return False
+            # the snapshot is only valid if the model files are the very same
+            files: dict = snapshot["files"]
+            current: dict = {f: os.stat(f).st_mtime_ns for f in self.__listModelFilesFromRepo(self.__repoDirPath)}
+            if current != {f: mtime for f, (mtime, m) in files.items()}:
+                self.__logger.info("ignoring outdated model snapshot " + self.__snapshotPath)
+                return False
+        except Exception as ex:
+            self.__logger.warning("ignoring unreadable model snapshot " + self.__snapshotPath + " error=" + repr(ex))
+            return False
+
+        self.__logger.info("loading models from snapshot " + self.__snapshotPath)
+        self.__files = files
+        self.__models = {m.getName(): m for mtime, m in files.values() if m is not None}
+        self.__version = self.__version + 1
+        return True
+
+    def __saveSnapshot(self) -> None:
+        snapshot: dict = {
+            "format": self.SNAPSHOT_FORMAT,
+            "repoDirPath": os.path.abspath(self.__repoDirPath),
+            "files": self.__files,
+        }
+        try:
+            content: bytes = pickle.dumps(snapshot)
+            IOHelper.writeAtomically(self.__snapshotPath, lambda tmpPath: pathlib.Path(tmpPath).write_bytes(content))
+        except Exception as ex:
+            self.__logger.warning("unable to save model snapshot " + self.__snapshotPath + " error=" + repr(ex))
+
+    def __refreshIfDue(self) -> None:
+        if self.__refreshInterval is not None and time.monotonic() - self.__lastRefresh >= self.__refreshInterval:
+            self.refresh()
+
     def __listModelFilesFromRepo(self, repoDirPath: str) -> list:
         files: list = list()
-        for f in os.listdir(repoDirPath):
+        for f in sorted(os.listdir(repoDirPath)):
             if f.endswith(".yaml"):
                 files.append(repoDirPath + "/" + f)
         return files
 
-    def __loadModelFilesFromRepo(self, files: list) -> dict:
-        modelsLoaded: dict = dict()
-        for filePath in files:
-            self.__logger.info("loading model from file " + filePath)
-            model: MappingModel = MappingModel(filePath)
-            modelsLoaded[model.getName()] = model
-        return modelsLoaded
+    def __loadModelFile(self, filePath: str) -> MappingModel:
+        self.__logger.info("loading model from file " + filePath)
+        try:
+            return MappingModel(filePath)
+        except Exception as ex:
+            self.__logger.error("ignoring invalid model file " + filePath + " error=" + repr(ex))
+            return None
 
 
 class ModelComplianceLevel(Enum):
@@ -173,35 +350,48 @@ class ModelComplianceLevel(Enum):
     MANDATORY_AND_OPTIONAL = 2
 
 
+class InvoiceHeaderSniffer(object):
+    """reads the column names of an invoice from its first line only"""
+
+    @classmethod
+    def getHeader(cts, invoiceFilePath: str) -> list:
+        # utf-8-sig drops the byte order mark exports usually start with
+        with open(invoiceFilePath, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+            return next(csv.reader(f), list())
+
+    @classmethod
+    def getSignature(cts, header: list) -> str:
+        return hashlib.sha256("\x1f".join(header).encode("utf-8")).hexdigest()
+
+
 class ModelComplianceChecker(object):
     """computes the compliancy level of an invoice with a given model"""
 
-    __columnsInFile: list
+    __columnsInFile: frozenset
     __invoiceFilePath: str
 
-    def __init__(self, invoiceFilePath: str) -> None:
+    def __init__(self, invoiceFilePath: str, header: list = None) -> None:
         self.__invoiceFilePath = invoiceFilePath
         self.__logger = logging.getLogger("ModelComplianceChecker")
-        self.__columnsInFile = self.__getColumnsFromFile(invoiceFilePath)
-
-    def __getColumnsFromFile(self, invoiceFilePath: str) -> list:
-        df: pd.DataFrame = pd.read_csv(invoiceFilePath, index_col=0, nrows=1)
-        return df.columns.values.tolist()
+        if header is None:
+            header = InvoiceHeaderSniffer.getHeader(invoiceFilePath)
+        self.__columnsInFile = frozenset(header)
 
     def getComplianceLevel(self, model: MappingModel) -> ModelComplianceLevel:
 
-        mandatory: list = model.getMandatoryColumnNames()
-        optional: list = model.getOptionalColumnNames()
-
-        for m in mandatory:
-            if m not in self.__columnsInFile:
-                self.__logger.debug("unable to locate mandatory field " + m + " in file " + self.__invoiceFilePath)
-                return ModelComplianceLevel.NOT_COMPLIANT
+        missing: frozenset = model.getMandatoryColumnSet() - self.__columnsInFile
+        if len(missing) > 0:
+            self.__logger.debug(
+                "unable to locate mandatory fields " + str(sorted(missing)) + " in file " + self.__invoiceFilePath
+            )
+            return ModelComplianceLevel.NOT_COMPLIANT
 
-        for o in optional:
-            if o not in self.__columnsInFile:
-                self.__logger.debug("unable to locate optional field " + o + " in file " + self.__invoiceFilePath)
-                return ModelComplianceLevel.MANDATORY_ONLY
+        missing = model.getOptionalColumnSet() - self.__columnsInFile
+        if len(missing) > 0:
+            self.__logger.debug(
+                "unable to locate optional fields " + str(sorted(missing)) + " in file " + self.__invoiceFilePath
+            )
+            return ModelComplianceLevel.MANDATORY_ONLY
 
         return ModelComplianceLevel.MANDATORY_AND_OPTIONAL
 
@@ -225,13 +415,37 @@ class ModelCompliancePick(object):
 class ModelCompliancePicker(object):
     """returns the most compliant model for a given invoice file"""
 
+    PICK_CACHE_SIZE: int = 1024
+
+    # picks are shared by all pickers, per repository version and invoice header signature
+    __picks = weakref.WeakKeyDictionary()
+    __picksLock = threading.Lock()
+
     def __init__(self) -> None:
         self.__logger = logging.getLogger("ModelCompliancePicker")
 
     def getBestMatchingModel(self, repo: MappingModelRepository, invoiceFilePath: str) -> ModelCompliancePick:
+        header: list = InvoiceHeaderSniffer.getHeader(invoiceFilePath)
+        signature: str = InvoiceHeaderSniffer.getSignature(header)
+        # picks made before the repository reloaded its models are stale, the version may reload them so it is read unlocked
+        key: tuple = (repo.getVersion(), signature)
+        with self.__picksLock:
+            picks: dict = self.__picks.setdefault(repo, dict())
+            if key in picks:
+                return picks[key]
+
+        pick: ModelCompliancePick = self.__pick(repo, ModelComplianceChecker(invoiceFilePath, header))
+
+        with self.__picksLock:
+            if len(picks) >= self.PICK_CACHE_SIZE:
+                # drop the oldest pick
+                del picks[next(iter(picks))]
+            picks[key] = pick
+        return pick
+
+    def __pick(self, repo: MappingModelRepository, checker: ModelComplianceChecker) -> ModelCompliancePick:
         levels = dict()
         availableModelNames: list = repo.listModelNames()
-        checker: ModelComplianceChecker = ModelComplianceChecker(invoiceFilePath)
         for modelName in availableModelNames:
             model: MappingModel = repo.getModel(modelName)
             level: ModelComplianceLevel = checker.getComplianceLevel(model)
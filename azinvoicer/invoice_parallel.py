@@ -0,0 +1,201 @@
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Iterable
+import pandas as pd
+
+from azinvoicer.invoice_record import InvoiceStats, InvoiceStatsAccumulator, GroupedInvoiceStats
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel
+from azinvoicer.invoice_mappers import EnvironnementMapper
+from azinvoicer.invoice_reader import InvoiceLoader, InvoiceParser, ParsingMode
+from azinvoicer.invoice_mapperchain import MapperRunStats
+
+
+def parseChunkAndAddEnv(
+    mode: ParsingMode,
+    categorical: bool,
+    level: ModelComplianceLevel,
+    inModel: MappingModel,
+    mapper: EnvironnementMapper,
+    chunk: pd.DataFrame,
+) -> tuple:
+    """worker entry point, must remain a module level function to be usable from a process pool
+
+    returns the stats of the chunk and the mapper stats measured while parsing it
+    """
+    before: list = getMapperStats(mapper)
+    stats: InvoiceStats = InvoiceParser(mode, categorical).parseInputTableAndAddEnv(level, inModel, mapper, chunk)
+    return stats, getLearnedMapperStats(mapper, before)
+
+
+def readAndGroupChunk(
+    mode: ParsingMode,
+    categorical: bool,
+    level: ModelComplianceLevel,
+    inModel: MappingModel,
+    mapper: EnvironnementMapper,
+    chunk: pd.DataFrame,
+) -> tuple:
+    """worker entry point of the grouping, must remain a module level function to be usable from a process pool
+
+    returns the groups of the chunk and the mapper stats measured while grouping it
+    """
+    before: list = getMapperStats(mapper)
+    grouped: GroupedInvoiceStats = InvoiceParser(mode, categorical).readAndGroup(level, inModel, mapper, chunk)
+    return grouped, getLearnedMapperStats(mapper, before)
+
+
+def getMapperStats(mapper: EnvironnementMapper) -> list:
+    # only chains measure their mappers
+    return mapper.getMapperStats() if hasattr(mapper, "getMapperStats") else None
+
+
+def getLearnedMapperStats(mapper: EnvironnementMapper, before: list) -> list:
+    # workers get a copy of the mapper, only what it measured since is sent back to the parent chain
+    if before is None:
+        return None
+    return [
+        MapperRunStats(declaration=a.declaration, lines=a.lines - b.lines, hits=a.hits - b.hits, seconds=a.seconds - b.seconds)
+        for a, b in zip(mapper.getMapperStats(), before)
+    ]
+
+
+class ParallelInvoiceParser(object):
+    """parses a single invoice on several processes, partial results are merged in the invoice order"""
+
+    DEFAULT_CHUNK_SIZE: int = 100000
+
+    __jobs: int
+    __chunkSize: int
+    __mode: ParsingMode
+    __categorical: bool
+
+    def __init__(
+        self, jobs: int, chunkSize: int = DEFAULT_CHUNK_SIZE, mode: ParsingMode = ParsingMode.COLUMNS, categorical: bool = False
+    ) -> None:
+        self.__logger = logging.getLogger("ParallelInvoiceParser")
+        self.__jobs = max(1, jobs)
+        self.__chunkSize = max(1, chunkSize)
+        self.__mode = mode
+        self.__categorical = categorical
+
+    def getJobs(self) -> int:
+        return self.__jobs
+
+    def getChunkSize(self) -> int:
+        return self.__chunkSize
+
+    def parseInvoiceAndAddEnv(
+        self,
+        level: ModelComplianceLevel,
+        inModel: MappingModel,
+        mapper: EnvironnementMapper,
+        invoiceFilePath: str,
+        keepData: bool = True,
+    ) -> InvoiceStats:
+        chunks = InvoiceLoader(categorical=self.__categorical).streamInvoice(level, inModel, invoiceFilePath, self.__chunkSize)
+        return self.parseInputChunksAndAddEnv(level, inModel, mapper, chunks, keepData)
+
+    def parseInputTableAndAddEnv(
+        self,
+        level: ModelComplianceLevel,
+        inModel: MappingModel,
+        mapper: EnvironnementMapper,
+        table: pd.DataFrame,
+        keepData: bool = True,
+    ) -> InvoiceStats:
+        # split the already loaded table in row ranges
+        return self.parseInputChunksAndAddEnv(level, inModel, mapper, self.__splitTable(table), keepData)
+
+    def parseInputChunksAndAddEnv(
+        self,
+        level: ModelComplianceLevel,
+        inModel: MappingModel,
+        mapper: EnvironnementMapper,
+        chunks: Iterable[pd.DataFrame],
+        keepData: bool = True,
+    ) -> InvoiceStats:
+        if self.__jobs == 1:
+            parser: InvoiceParser = InvoiceParser(self.__mode, self.__categorical)
+            return parser.parseInputChunksAndAddEnv(level, inModel, mapper, chunks, keepData)
+
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(keepData)
+        # bound the number of chunks in flight so that memory does not depend on the invoice size
+        maxPending: int = 2 * self.__jobs
+        pending: deque = deque()
+        self.__logger.info("parsing invoice using " + str(self.__jobs) + " processes")
+        with ProcessPoolExecutor(max_workers=self.__jobs) as executor:
+            for chunk in chunks:
+                pending.append(
+                    executor.submit(parseChunkAndAddEnv, self.__mode, self.__categorical, level, inModel, mapper, chunk)
+                )
+                if len(pending) >= maxPending:
+                    self.__foldOldest(pending, accumulator, mapper)
+            while len(pending) > 0:
+                self.__foldOldest(pending, accumulator, mapper)
+        return accumulator.getStats()
+
+    def readAndGroupInvoice(
+        self, level: ModelComplianceLevel, inModel: MappingModel, mapper: EnvironnementMapper, invoiceFilePath: str
+    ) -> GroupedInvoiceStats:
+        chunks = InvoiceLoader(categorical=self.__categorical).streamInvoice(level, inModel, invoiceFilePath, self.__chunkSize)
+        return self.readAndGroupChunks(level, inModel, mapper, chunks)
+
+    def readAndGroupChunks(
+        self,
+        level: ModelComplianceLevel,
+        inModel: MappingModel,
+        mapper: EnvironnementMapper,
+        chunks: Iterable[pd.DataFrame],
+    ) -> GroupedInvoiceStats:
+        parser: InvoiceParser = InvoiceParser(self.__mode, self.__categorical)
+        if self.__jobs == 1:
+            return parser.readAndGroup(level, inModel, mapper, chunks)
+
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(keepData=False)
+        # the groups of the chunks folded so far are summed as they come, at most one frame is kept
+        groups: list = list()
+        maxPending: int = 2 * self.__jobs
+        pending: deque = deque()
+        self.__logger.info("grouping invoice using " + str(self.__jobs) + " processes")
+        with ProcessPoolExecutor(max_workers=self.__jobs) as executor:
+            for chunk in chunks:
+                pending.append(
+                    executor.submit(readAndGroupChunk, self.__mode, self.__categorical, level, inModel, mapper, chunk)
+                )
+                if len(pending) >= maxPending:
+                    self.__foldOldestGroups(pending, accumulator, groups, parser, mapper)
+            while len(pending) > 0:
+                self.__foldOldestGroups(pending, accumulator, groups, parser, mapper)
+        return GroupedInvoiceStats(stats=accumulator.getStats(), groups=parser.mergeGroups(groups))
+
+    def __foldOldestGroups(
+        self,
+        pending: deque,
+        accumulator: InvoiceStatsAccumulator,
+        groups: list,
+        parser: InvoiceParser,
+        mapper: EnvironnementMapper,
+    ) -> None:
+        grouped, learned = pending.popleft().result()
+        self.__addLearnedMapperStats(mapper, learned)
+        accumulator.fold(grouped.stats)
+        groups[:] = [parser.mergeGroups(groups + [grouped.groups])]
+
+    def __splitTable(self, table: pd.DataFrame) -> Iterable[pd.DataFrame]:
+        size: int = len(table.index)
+        for start in range(0, size, self.__chunkSize):
+            end: int = min(start + self.__chunkSize, size)
+            yield table.iloc[start:end]
+
+    def __foldOldest(self, pending: deque, accumulator: InvoiceStatsAccumulator, mapper: EnvironnementMapper) -> None:
+        # results are always folded in submission order to keep the output deterministic
+        future: Future = pending.popleft()
+        stats, learned = future.result()
+        self.__addLearnedMapperStats(mapper, learned)
+        accumulator.fold(stats)
+
+    def __addLearnedMapperStats(self, mapper: EnvironnementMapper, learned: list) -> None:
+        # the adaptive order of the parent chain learns from the workers as it would from its own runs
+        if learned is not None:
+            mapper.addMapperStats(learned)
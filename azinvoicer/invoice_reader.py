@@ -1,7 +1,10 @@
+import io
 import logging
+from enum import Enum
+import numpy as np
 import pandas as pd
 
-from azinvoicer.invoice_record import InvoiceStats
+from azinvoicer.invoice_record import InvoiceStats, InvoiceStatsAccumulator, GroupedInvoiceStats
 
 from azinvoicer.invoice_model import (
     ModelComplianceLevel,
@@ -12,19 +15,139 @@ from azinvoicer.invoice_model import (
     OptionFlags,
 )
 
-from azinvoicer.helpers import IOHelper, DateHelper
-from azinvoicer.invoice_mappers import EnvironnementMapper, Environnement
+from azinvoicer.helpers import IOHelper, DateHelper, ModuleHelper, FileRangeReader
+from azinvoicer.invoice_cache import InvoiceCache
+from azinvoicer.invoice_mappers import EnvironnementMapper, Environnement, MapperInputs
 import datetime
+from typing import Iterable, Iterator, Union, BinaryIO
+
+
+class CsvEngine(Enum):
+    """csv parsing engines usable by the loader"""
+
+    C = "c"
+    PYARROW = "pyarrow"
 
 
 class InvoiceLoader(object):
     """reads the invoce according to a model"""
 
-    def __init__(self) -> None:
+    __cache: InvoiceCache
+    __engine: CsvEngine
+    __categorical: bool
+
+    def __init__(self, cache: InvoiceCache = None, engine: CsvEngine = CsvEngine.C, categorical: bool = False) -> None:
         self.__logger = logging.getLogger("InvoiceLoader")
+        self.__cache = cache
+        self.__engine = engine
+        self.__categorical = categorical
+        if engine == CsvEngine.PYARROW and not ModuleHelper.isAvailable("pyarrow"):
+            self.__logger.warning("pyarrow is not installed, falling back to the default csv engine")
+            self.__engine = CsvEngine.C
+
+    def getEngine(self) -> CsvEngine:
+        return self.__engine
+
+    def loadInvoice(
+        self, level: ModelComplianceLevel, model: MappingModel, invoiceFilePath: str, useCache: bool = True
+    ) -> pd.DataFrame:
+        """loads the columns the model needs, invoices read only once, i.e. uploads, should not use the cache"""
+        cache: InvoiceCache = self.__cache if useCache else None
+        if cache is not None:
+            cached: pd.DataFrame = cache.get(level, model, invoiceFilePath)
+            if cached is not None:
+                return self.__conformCategories(model, cached)
+
+        columns: list = self.__getColumnsToLoad(level, model)
 
-    def loadInvoice(self, level: ModelComplianceLevel, model: MappingModel, invoiceFilePath: str) -> pd.DataFrame:
+        # load only the necessary columns
+        self.__logger.info("loading invoice file " + invoiceFilePath + " size " + str(IOHelper.getFileSize(invoiceFilePath)))
+        dtypes: dict = self.__getColumnTypes(model, columns)
+        if self.__engine == CsvEngine.PYARROW:
+            t = self.__normalize(pd.read_csv(invoiceFilePath, usecols=columns, dtype=dtypes, engine=self.__engine.value))
+        else:
+            t = pd.read_csv(invoiceFilePath, skipinitialspace=True, usecols=columns, dtype=dtypes)
+        t = self.__conformCategories(model, t)
+        self.__logger.info("loaded invoice")
+
+        if cache is not None:
+            cache.put(level, model, invoiceFilePath, t)
+        return t
 
+    def streamInvoice(
+        self, level: ModelComplianceLevel, model: MappingModel, invoiceFilePath: str, chunkSize: int
+    ) -> Iterator[pd.DataFrame]:
+        columns: list = self.__getColumnsToLoad(level, model)
+
+        # yield bounded tables of at most chunkSize lines, only the necessary columns are read
+        self.__logger.info("streaming invoice file " + invoiceFilePath + " size " + str(IOHelper.getFileSize(invoiceFilePath)))
+        # chunks are not supported by the pyarrow engine, always use the default one
+        dtypes: dict = self.__getColumnTypes(model, columns)
+        with pd.read_csv(invoiceFilePath, skipinitialspace=True, usecols=columns, dtype=dtypes, chunksize=chunkSize) as reader:
+            for chunk in reader:
+                yield self.__conformCategories(model, chunk)
+        self.__logger.info("streamed invoice")
+
+    def loadInvoiceFrom(
+        self,
+        level: ModelComplianceLevel,
+        model: MappingModel,
+        invoiceFilePath: str,
+        byteOffset: int,
+        header: list,
+        byteEnd: int = None,
+    ) -> pd.DataFrame:
+        # the lines after the offset carry no header, the one read beforehand is used instead
+        columns: list = self.__getColumnsToLoad(level, model)
+        dtypes: dict = self.__getColumnTypes(model, columns)
+        self.__logger.info("loading invoice file " + invoiceFilePath + " from offset " + str(byteOffset))
+        with open(invoiceFilePath, "rb") as f:
+            f.seek(byteOffset)
+            # bytes written after the end offset are left for later reads
+            source: BinaryIO = f if byteEnd is None else io.BufferedReader(FileRangeReader(f, byteEnd))
+            try:
+                t = pd.read_csv(source, header=None, names=header, skipinitialspace=True, usecols=columns, dtype=dtypes)
+            except pd.errors.EmptyDataError:
+                t = pd.DataFrame({c: pd.Series(dtype=dtypes.get(c, object)) for c in header if c in columns})
+        return self.__conformCategories(model, t)
+
+    def __getColumnTypes(self, model: MappingModel, columns: list) -> dict:
+        declared: dict = model.getColumnTypes()
+        types: dict = {c: declared[c] for c in columns if c in declared}
+        # the default engine can directly build the dictionary encoded columns
+        if self.__categorical and self.__engine == CsvEngine.C:
+            for c in self.__getCategoricalColumns(model):
+                if c in columns:
+                    types[c] = "category"
+        return types
+
+    def __getCategoricalColumns(self, model: MappingModel) -> list:
+        return [model.getMandatoryColumnName(f) for f in MandatoryFields.CATEGORICAL_FIELDS]
+
+    def __conformCategories(self, model: MappingModel, table: pd.DataFrame) -> pd.DataFrame:
+        # low cardinality columns are dictionary encoded only when requested, whatever the table origin
+        for c in self.__getCategoricalColumns(model):
+            if c in table.columns:
+                isCategorical: bool = isinstance(table[c].dtype, pd.CategoricalDtype)
+                if self.__categorical and not isCategorical:
+                    table[c] = table[c].astype("category")
+                elif not self.__categorical and isCategorical:
+                    table[c] = table[c].astype(object)
+        return table
+
+    def __normalize(self, table: pd.DataFrame) -> pd.DataFrame:
+        # pyarrow reads empty text fields as empty strings or None where the default engine yields NaN
+        for c in table.columns:
+            if table[c].dtype == object:
+                values: np.ndarray = table[c].to_numpy()
+                empty: np.ndarray = pd.isna(values) | (values == "")
+                if empty.any():
+                    values = values.copy()
+                    values[empty] = np.nan
+                    table[c] = values
+        return table
+
+    def __getColumnsToLoad(self, level: ModelComplianceLevel, model: MappingModel) -> list:
         # determine the columns to load according to compliance level
         columns = list()
         if level == ModelComplianceLevel.MANDATORY_AND_OPTIONAL:
@@ -32,20 +155,40 @@ class InvoiceLoader(object):
                 columns.append(col)
         for col in model.getMandatoryColumnNames():
             columns.append(col)
+        return columns
 
-        # load only the necessary columns
-        self.__logger.info("loading invoice file " + invoiceFilePath + " size " + str(IOHelper.getFileSize(invoiceFilePath)))
-        t = pd.read_csv(invoiceFilePath, skipinitialspace=True, usecols=columns)
-        self.__logger.info("loaded invoice")
-        return t
+
+class ParsingMode(Enum):
+    """strategy used by the parser to walk through the invoice table"""
+
+    ROWS = 0
+    COLUMNS = 1
 
 
 class InvoiceParser(object):
 
+    GROUP_KEYS: list = [
+        OutputModel.getColumName(OutputModel.ENV_FIELD),
+        OutputModel.getColumName(MandatoryFields.SERVICE_FAMILY),
+        OutputModel.getColumName(MandatoryFields.METER_CATEGORY),
+        OutputModel.getColumName(MandatoryFields.BILLING_CURRENCY),
+    ]
+    LINES_FIELD: str = "Lines"
+
     __headerDict: dict = {"environnement": []}
+    __mode: ParsingMode
+    __categorical: bool
 
-    def __init__(self) -> None:
+    def __init__(self, mode: ParsingMode = ParsingMode.COLUMNS, categorical: bool = False) -> None:
         self.__logger = logging.getLogger("InvoiceParser")
+        self.__mode = mode
+        self.__categorical = categorical
+
+    def getMode(self) -> ParsingMode:
+        return self.__mode
+
+    def isCategorical(self) -> bool:
+        return self.__categorical
 
     def __getOutputHeader(self, level: ModelComplianceLevel) -> dict:
 
@@ -67,9 +210,72 @@ class InvoiceParser(object):
         level: ModelComplianceLevel,
         inModel: MappingModel,
         mapper: EnvironnementMapper,
-        table: pd.DataFrame,
-    ) -> dict:
-        pass
+        table: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+    ) -> GroupedInvoiceStats:
+        # accept either a whole loaded table or streamed chunks
+        chunks: Iterable[pd.DataFrame] = [table] if isinstance(table, pd.DataFrame) else table
+
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(keepData=False)
+        groups: pd.DataFrame = None
+        for chunk in chunks:
+            names, withoutEnv, mappedKeys = self.__mapEnvironnements(inModel, mapper, chunk)
+            accumulator.fold(self.__reduceStats(inModel, chunk, withoutEnv, mappedKeys, None))
+            partial: pd.DataFrame = self.__groupChunk(inModel, chunk, names)
+            if groups is not None:
+                partial = pd.concat([groups, partial], ignore_index=True)
+            groups = self.__aggregate(partial)
+
+        return GroupedInvoiceStats(stats=accumulator.getStats(), groups=self.mergeGroups([] if groups is None else [groups]))
+
+    def mergeGroups(self, groups: list) -> pd.DataFrame:
+        """sums groups computed on parts of the same invoice, sorted on the grouping keys"""
+        if len(groups) == 0:
+            return pd.DataFrame(
+                columns=self.GROUP_KEYS + [OutputModel.getColumName(MandatoryFields.BILLED_COST), self.LINES_FIELD]
+            )
+        merged: pd.DataFrame = groups[0] if len(groups) == 1 else self.__aggregate(pd.concat(groups, ignore_index=True))
+        return merged.sort_values(by=self.GROUP_KEYS, ignore_index=True)
+
+    def __groupChunk(self, inModel: MappingModel, table: pd.DataFrame, names: np.ndarray) -> pd.DataFrame:
+        # only the grouping keys and the cost are projected, no per line output is built
+        keys: pd.DataFrame = pd.DataFrame(
+            {
+                OutputModel.getColumName(OutputModel.ENV_FIELD): names,
+                OutputModel.getColumName(MandatoryFields.SERVICE_FAMILY): table[
+                    inModel.getMandatoryColumnName(MandatoryFields.SERVICE_FAMILY)
+                ].to_numpy(),
+                OutputModel.getColumName(MandatoryFields.METER_CATEGORY): table[
+                    inModel.getMandatoryColumnName(MandatoryFields.METER_CATEGORY)
+                ].to_numpy(),
+                OutputModel.getColumName(MandatoryFields.BILLING_CURRENCY): table[
+                    inModel.getMandatoryColumnName(MandatoryFields.BILLING_CURRENCY)
+                ].to_numpy(),
+                OutputModel.getColumName(MandatoryFields.BILLED_COST): table[
+                    inModel.getMandatoryColumnName(MandatoryFields.BILLED_COST)
+                ]
+                .astype(float)
+                .to_numpy(),
+                self.LINES_FIELD: np.ones(len(names), dtype=int),
+            }
+        )
+        return keys
+
+    def __aggregate(self, partial: pd.DataFrame) -> pd.DataFrame:
+        return partial.groupby(self.GROUP_KEYS, dropna=False, sort=False, as_index=False).sum()
+
+    def parseInputChunksAndAddEnv(
+        self,
+        level: ModelComplianceLevel,
+        inModel: MappingModel,
+        mapper: EnvironnementMapper,
+        chunks: Iterable[pd.DataFrame],
+        keepData: bool = False,
+    ) -> InvoiceStats:
+        # only the running totals are kept unless the data is explicitly requested
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(keepData)
+        for chunk in chunks:
+            accumulator.fold(self.parseInputTableAndAddEnv(level, inModel, mapper, chunk))
+        return accumulator.getStats()
 
     def parseInputTableAndAddEnv(
         self,
@@ -78,6 +284,146 @@ class InvoiceParser(object):
         mapper: EnvironnementMapper,
         table: pd.DataFrame,
     ) -> InvoiceStats:
+        if self.__mode == ParsingMode.ROWS:
+            return self.__parseRows(level, inModel, mapper, table)
+        return self.__parseColumns(level, inModel, mapper, table)
+
+    def __parseColumns(
+        self,
+        level: ModelComplianceLevel,
+        inModel: MappingModel,
+        mapper: EnvironnementMapper,
+        table: pd.DataFrame,
+    ) -> InvoiceStats:
+
+        # fetch the input columns once for the whole table
+        currencies: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.BILLING_CURRENCY)]
+        billedCosts: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.BILLED_COST)].astype(float)
+        families: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.SERVICE_FAMILY)]
+        categories: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.METER_CATEGORY)]
+        skus: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.METER_NAME)]
+
+        names, withoutEnv, mappedKeys = self.__mapEnvironnements(inModel, mapper, table)
+
+        # build the output frame in one go, unmapped output columns are left empty
+        lines: int = len(table.index)
+        columns: dict = dict()
+        for cname in self.__getOutputHeader(level).keys():
+            columns[cname] = np.full(lines, np.nan)
+        columns[OutputModel.getColumName(OutputModel.ENV_FIELD)] = names
+        columns[OutputModel.getColumName(MandatoryFields.SERVICE_FAMILY)] = self.__getOutputValues(families)
+        columns[OutputModel.getColumName(MandatoryFields.METER_CATEGORY)] = self.__getOutputValues(categories)
+        columns[OutputModel.getColumName(MandatoryFields.METER_NAME)] = self.__getOutputValues(skus)
+        columns[OutputModel.getColumName(MandatoryFields.BILLED_COST)] = billedCosts.to_numpy()
+        columns[OutputModel.getColumName(MandatoryFields.BILLING_CURRENCY)] = self.__getOutputValues(currencies)
+
+        if level == ModelComplianceLevel.MANDATORY_AND_OPTIONAL:
+            if inModel.getOption(OptionFlags.USE_PART_NUMBER):
+                partNumbers = table[inModel.getOptionalColumnName(OptionalFields.PART_NUMBER)]
+                columns[OutputModel.getColumName(OptionalFields.PART_NUMBER)] = partNumbers.to_numpy()
+
+        parsed = pd.DataFrame(columns, index=pd.RangeIndex(lines))
+
+        return self.__reduceStats(inModel, table, withoutEnv, mappedKeys, self.__conformCategories(parsed))
+
+    def __getOutputValues(self, column: pd.Series) -> any:
+        # keep dictionary encoded input columns encoded instead of materializing the strings
+        if self.__categorical and isinstance(column.dtype, pd.CategoricalDtype):
+            return column.array
+        return column.to_numpy()
+
+    def __conformCategories(self, parsed: pd.DataFrame) -> pd.DataFrame:
+        if not self.__categorical:
+            return parsed
+        envColumn: str = OutputModel.getColumName(OutputModel.ENV_FIELD)
+        parsed[envColumn] = pd.Categorical(parsed[envColumn], categories=[e.name for e in Environnement])
+        for f in MandatoryFields.CATEGORICAL_FIELDS:
+            cname: str = OutputModel.getColumName(f)
+            if cname in parsed.columns:
+                parsed[cname] = parsed[cname].astype("category")
+        return parsed
+
+    def __mapEnvironnements(self, inModel: MappingModel, mapper: EnvironnementMapper, table: pd.DataFrame) -> tuple:
+        """returns the environnement name and whether it is missing for each line, and the number of mapped keys"""
+
+        # mappers work on positional object columns, whatever the index and encoding of the table
+        def column(field: MandatoryFields) -> pd.Series:
+            return pd.Series(table[inModel.getMandatoryColumnName(field)].to_numpy(dtype=object), dtype=object)
+
+        columns: dict = {
+            MapperInputs.SERVICE_FAMILY: column(MandatoryFields.SERVICE_FAMILY),
+            MapperInputs.SERVICE_NAME: column(MandatoryFields.METER_CATEGORY),
+            MapperInputs.SKU_NAME: column(MandatoryFields.METER_NAME),
+            MapperInputs.REGION_NAME: column(MandatoryFields.RESOURCE_LOCATION),
+            MapperInputs.RESOURCE_GROUP_NAME: column(MandatoryFields.RESOURCE_GROUP_NAME),
+            MapperInputs.TAGS: column(MandatoryFields.TAGS),
+        }
+        lines: int = len(table.index)
+        if lines == 0:
+            return np.empty(0, dtype=object), np.zeros(0, dtype=bool), 0
+
+        # the mapper only runs once per distinct tuple of the inputs it depends on
+        inputs: list = mapper.getInputs() if hasattr(mapper, "getInputs") else MapperInputs.ALL_INPUTS
+        keys: np.ndarray = np.zeros(lines, dtype=np.int64)
+        for i in inputs:
+            codes, uniques = pd.factorize(columns[i])
+            # missing values get their own code, keys are compacted after each column to avoid overflows
+            keys, _ = pd.factorize(keys * (len(uniques) + 1) + (codes + 1))
+        _, firsts = np.unique(keys, return_index=True)
+
+        environnements: pd.Series = EnvironnementMapper.mapBatch(
+            mapper, *[columns[i].iloc[firsts].reset_index(drop=True) for i in MapperInputs.ALL_INPUTS]
+        )
+        # the decisions are read once per key then broadcast back to every line through the key codes
+        names: np.ndarray = np.array([e.name for e in environnements], dtype=object)
+        missing: np.ndarray = np.array([e == Environnement.NA for e in environnements], dtype=bool)
+        return names[keys], missing[keys], len(firsts)
+
+    def __reduceStats(
+        self, inModel: MappingModel, table: pd.DataFrame, withoutEnv: np.ndarray, mappedKeys: int, data: pd.DataFrame
+    ) -> InvoiceStats:
+        currencies: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.BILLING_CURRENCY)]
+        billedCosts: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.BILLED_COST)].astype(float)
+        billingPeriodStarts: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.BILLING_PERIOD_START)]
+        billingPeriodEnds: pd.Series = table[inModel.getMandatoryColumnName(MandatoryFields.BILLING_PERIOD_END)]
+
+        # compute globals using column reductions
+        invoiceEndDate: datetime = datetime.datetime.strptime("03/02/1973", "%d/%m/%Y")
+        invoiceStartDate: datetime = datetime.datetime.now()
+        currency: str = None
+        lines: int = len(table.index)
+        if lines > 0:
+            dateFormat: str = inModel.getOption(OptionFlags.DATE_FORMAT)
+            # each distinct date string is parsed only once
+            startDates: dict = DateHelper.parseDistinctDates(dateFormat, billingPeriodStarts.unique())
+            endDates: dict = DateHelper.parseDistinctDates(dateFormat, billingPeriodEnds.unique())
+            invoiceStartDate = min(invoiceStartDate, min(startDates.values()))
+            invoiceEndDate = max(invoiceEndDate, max(endDates.values()))
+            currency = currencies.iloc[-1]
+
+        totalBilled: float = float(billedCosts.sum())
+        totalBilledEnvs: float = float(billedCosts[~withoutEnv].sum())
+
+        return InvoiceStats(
+            startDate=invoiceStartDate,
+            endDate=invoiceEndDate,
+            parsedLines=lines,
+            parsedLinesWithoutEnv=int(withoutEnv.sum()),
+            totalBilled=totalBilled,
+            totalBilledEnvs=totalBilledEnvs,
+            currency=currency,
+            data=data,
+            billedDays=DateHelper.periodDays(invoiceStartDate, invoiceEndDate),
+            mappedKeys=mappedKeys,
+        )
+
+    def __parseRows(
+        self,
+        level: ModelComplianceLevel,
+        inModel: MappingModel,
+        mapper: EnvironnementMapper,
+        table: pd.DataFrame,
+    ) -> InvoiceStats:
 
         # create output data frame
         parsed = pd.DataFrame(self.__getOutputHeader(level))
@@ -93,6 +439,7 @@ class InvoiceParser(object):
         totalLinesParsed: int = 0
         totalLinesParsedWithoutEnv: int = 0
         linesWithoutEnv: list = list()
+        dateFormat: str = inModel.getOption(OptionFlags.DATE_FORMAT)
 
         for index, row in table.iterrows():
 
@@ -123,19 +470,18 @@ class InvoiceParser(object):
             partNum: str = None
             if level == ModelComplianceLevel.MANDATORY_AND_OPTIONAL:
                 if inModel.getOption(OptionFlags.USE_PART_NUMBER):
-                    partNum = row[inModel.getMandatoryColumnName(OptionalFields.PART_NUMBER)]
+                    partNum = row[inModel.getOptionalColumnName(OptionalFields.PART_NUMBER)]
                     rowData[OutputModel.getColumName(OptionalFields.PART_NUMBER)] = partNum
 
             parsed = parsed.append(rowData, ignore_index=True)
             # parsed = pd.concat(parsed, pd.DataFrame([rowData]))
 
             # check globals vs line info
-            dateFormat: str = inModel.getOption(OptionFlags.DATE_FORMAT)
-            startDate: datetime = DateHelper.parseDate(dateFormat, billingPeriodStart)
+            startDate: datetime = DateHelper.parseDateCached(dateFormat, billingPeriodStart)
             if startDate < invoiceStartDate:
                 invoiceStartDate = startDate
 
-            endDate: datetime = DateHelper.parseDate(dateFormat, billingPeriodEnd)
+            endDate: datetime = DateHelper.parseDateCached(dateFormat, billingPeriodEnd)
             if endDate > invoiceEndDate:
                 invoiceEndDate = endDate
 
@@ -157,6 +503,6 @@ class InvoiceParser(object):
             totalBilled=totalBilled,
             totalBilledEnvs=totalBilledEnvs,
             currency=currency,
-            data=parsed,
+            data=self.__conformCategories(parsed),
             billedDays=DateHelper.periodDays(invoiceStartDate, invoiceEndDate),
         )
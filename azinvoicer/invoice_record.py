@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from azinvoicer.invoice_mappers import Environnement
 import datetime
 import pandas as pd
@@ -30,3 +30,89 @@ class InvoiceStats:
     currency: str
     billedDays: int
     data: pd.DataFrame
+    # mapper input tuples the environnements were resolved on, distinct within each parsed table or chunk
+    mappedKeys: int = 0
+
+    def getDistinctKeyRatio(self) -> float:
+        if self.parsedLines == 0:
+            return 0.0
+        return self.mappedKeys / self.parsedLines
+
+
+@dataclass
+class GroupedInvoiceStats:
+    stats: InvoiceStats
+    groups: pd.DataFrame
+
+
+class InvoiceStatsAccumulator(object):
+    """folds partial invoice stats (i.e chunks of the same invoice) into running totals"""
+
+    __startDate: datetime
+    __endDate: datetime
+    __parsedLines: int
+    __parsedLinesWithoutEnv: int
+    __totalBilled: float
+    __totalBilledEnvs: float
+    __currency: str
+    __mappedKeys: int
+    __frames: list
+    __keepData: bool
+
+    def __init__(self, keepData: bool = True) -> None:
+        self.__startDate = datetime.datetime.now()
+        self.__endDate = datetime.datetime.strptime("03/02/1973", "%d/%m/%Y")
+        self.__parsedLines = 0
+        self.__parsedLinesWithoutEnv = 0
+        self.__totalBilled = 0
+        self.__totalBilledEnvs = 0
+        self.__currency = None
+        self.__mappedKeys = 0
+        self.__frames = list()
+        self.__keepData = keepData
+
+    def fold(self, stats: InvoiceStats) -> None:
+        if stats.parsedLines > 0:
+            if stats.startDate < self.__startDate:
+                self.__startDate = stats.startDate
+            if stats.endDate > self.__endDate:
+                self.__endDate = stats.endDate
+        if stats.currency is not None:
+            self.__currency = stats.currency
+        self.__parsedLines = self.__parsedLines + stats.parsedLines
+        self.__parsedLinesWithoutEnv = self.__parsedLinesWithoutEnv + stats.parsedLinesWithoutEnv
+        self.__totalBilled = self.__totalBilled + stats.totalBilled
+        self.__totalBilledEnvs = self.__totalBilledEnvs + stats.totalBilledEnvs
+        self.__mappedKeys = self.__mappedKeys + stats.mappedKeys
+        if self.__keepData and stats.data is not None:
+            self.__frames.append(stats.data)
+
+    def getStats(self) -> InvoiceStats:
+        data: pd.DataFrame = None
+        if len(self.__frames) > 0:
+            data = pd.concat(self.__frames, ignore_index=True)
+            # chunks rarely share the same categories, concatenation falls back to plain objects
+            for c in self.__frames[0].columns:
+                if isinstance(self.__frames[0][c].dtype, pd.CategoricalDtype):
+                    data[c] = data[c].astype("category")
+        return InvoiceStats(
+            startDate=self.__startDate,
+            endDate=self.__endDate,
+            parsedLines=self.__parsedLines,
+            parsedLinesWithoutEnv=self.__parsedLinesWithoutEnv,
+            totalBilled=self.__totalBilled,
+            totalBilledEnvs=self.__totalBilledEnvs,
+            currency=self.__currency,
+            billedDays=(self.__endDate - self.__startDate).days,
+            data=data,
+            mappedKeys=self.__mappedKeys,
+        )
+
+
+@dataclass
+class BatchInvoiceStats:
+    merged: InvoiceStats
+    perFile: dict
+    notCompliant: list
+    # errors of the files that could not be processed, by file path
+    failed: dict = field(default_factory=dict)
@@ -0,0 +1,212 @@
+import os
+import re
+import logging
+from collections.abc import Mapping
+
+from azinvoicer.invoice_mappers import Environnement, EnvironnementMapper, MapperInputs
+from azinvoicer.invoice_model import ModelLoader
+from azinvoicer.invoice_tagreader import TagReader
+
+
+class MappingRule(object):
+    """a compiled mapping rule, all its conditions must hold for the rule to apply"""
+
+    PATTERN_KEY: str = "pattern"
+
+    __name: str
+    __rank: int
+    __environnement: Environnement
+    __exact: dict
+    __patterns: dict
+    __exactTags: dict
+    __tagPatterns: dict
+
+    def __init__(self, name: str, rank: int, environnement: Environnement, match: dict) -> None:
+        self.__name = name
+        self.__rank = rank
+        self.__environnement = environnement
+        self.__exact = dict()
+        self.__patterns = dict()
+        self.__exactTags = dict()
+        self.__tagPatterns = dict()
+        for field, condition in match.items():
+            if field == MapperInputs.TAGS:
+                for key, tagCondition in condition.items():
+                    self.__compile(str(key).lower(), tagCondition, self.__exactTags, self.__tagPatterns)
+            elif field in MapperInputs.ALL_INPUTS:
+                self.__compile(field, condition, self.__exact, self.__patterns)
+            else:
+                raise ValueError("unknown field " + str(field) + " in rule " + name)
+
+    def __compile(self, key: str, condition: any, exact: dict, patterns: dict) -> None:
+        # a plain value is an exact case insensitive match, a mapping holds a pattern searched in the value
+        if isinstance(condition, dict):
+            patterns[key] = re.compile(condition[self.PATTERN_KEY], re.IGNORECASE)
+        else:
+            exact[key] = str(condition).lower()
+
+    def getName(self) -> str:
+        return self.__name
+
+    def getRank(self) -> int:
+        return self.__rank
+
+    def getEnvironnement(self) -> Environnement:
+        return self.__environnement
+
+    def getInputs(self) -> list:
+        used: set = set(self.__exact.keys()) | set(self.__patterns.keys())
+        if len(self.__exactTags) > 0 or len(self.__tagPatterns) > 0:
+            used.add(MapperInputs.TAGS)
+        return [i for i in MapperInputs.ALL_INPUTS if i in used]
+
+    def getIndexKey(self) -> tuple:
+        """hash key the rule is indexed on, None when the rule has no exact condition"""
+        for field in MapperInputs.ALL_INPUTS:
+            if field in self.__exact:
+                return (field, self.__exact[field])
+        for key, value in self.__exactTags.items():
+            return (MapperInputs.TAGS, key, value)
+        return None
+
+    def matches(self, values: dict, tags: dict) -> bool:
+        for field, expected in self.__exact.items():
+            if values[field] != expected:
+                return False
+        for field, pattern in self.__patterns.items():
+            if values[field] is None or pattern.search(values[field]) is None:
+                return False
+        for key, expected in self.__exactTags.items():
+            if tags.get(key, None) != expected:
+                return False
+        for key, pattern in self.__tagPatterns.items():
+            if key not in tags or pattern.search(tags[key]) is None:
+                return False
+        return True
+
+
+class MappingRuleSet(object):
+    """decision table compiled from yaml rule files
+
+    rules with an exact condition are indexed on it, the others are scanned,
+    the candidate with the lowest priority wins, then the first declared
+    """
+
+    RULES_KEY: str = "rules"
+
+    __rules: list
+    __index: dict
+    __scanned: list
+    __inputs: list
+
+    def __init__(self, filePaths: list) -> None:
+        self.__logger = logging.getLogger("MappingRuleSet")
+        declared: list = list()
+        for filePath in filePaths:
+            self.__logger.info("loading mapping rules from file " + filePath)
+            data: dict = ModelLoader.loadYamlFile(filePath) or dict()
+            for r in data.get(self.RULES_KEY, None) or list():
+                declared.append((filePath, r))
+        self.__rules = self.__compileRules(declared)
+        self.__index = dict()
+        self.__scanned = list()
+        used: set = set()
+        for rule in self.__rules:
+            key: tuple = rule.getIndexKey()
+            if key is None:
+                self.__scanned.append(rule)
+            else:
+                self.__index.setdefault(key, list()).append(rule)
+            used.update(rule.getInputs())
+        self.__inputs = [i for i in MapperInputs.ALL_INPUTS if i in used]
+
+    def __compileRules(self, declared: list) -> list:
+        valid: list = list()
+        for position, (filePath, r) in enumerate(declared):
+            name: str = str(r.get("name", filePath + "#" + str(position)))
+            try:
+                priority: int = int(r.get("priority", 0))
+                environnement: Environnement = Environnement[str(r["environnement"]).upper()]
+                valid.append((priority, position, name, environnement, r["match"]))
+            except Exception as ex:
+                self.__logger.warning("ignoring invalid mapping rule " + name + " error=" + repr(ex))
+
+        rules: list = list()
+        for rank, (priority, position, name, environnement, match) in enumerate(sorted(valid, key=lambda v: v[:2])):
+            try:
+                rules.append(MappingRule(name, rank, environnement, match))
+            except Exception as ex:
+                self.__logger.warning("ignoring invalid mapping rule " + name + " error=" + repr(ex))
+        return rules
+
+    def getRules(self) -> list:
+        return self.__rules
+
+    def getInputs(self) -> list:
+        return self.__inputs
+
+    def getEnvironnement(self, values: dict, tags: dict) -> Environnement:
+        candidates: list = list(self.__scanned)
+        for field in self.__inputs:
+            if field == MapperInputs.TAGS:
+                for key, value in tags.items():
+                    candidates.extend(self.__index.get((MapperInputs.TAGS, key, value), ()))
+            elif values[field] is not None:
+                candidates.extend(self.__index.get((field, values[field]), ()))
+
+        for rule in sorted(candidates, key=MappingRule.getRank):
+            if rule.matches(values, tags):
+                return rule.getEnvironnement()
+        return Environnement.NA
+
+
+class RulesMapper(EnvironnementMapper):
+    """maps environnements using the declarative rules read from a yaml file or a directory of yaml files"""
+
+    DEFAULT_RULES_DIR_PATH: str = os.path.join(os.path.dirname(__file__), "models", "rules")
+    SHAREABLE: bool = True
+
+    __ruleSet: MappingRuleSet
+
+    def __init__(self, rulesPath: str = None) -> None:
+        self.logger = logging.getLogger("RulesMapper")
+        path: str = rulesPath if rulesPath is not None else self.DEFAULT_RULES_DIR_PATH
+        self.__ruleSet = MappingRuleSet(self.__listRuleFiles(path))
+
+    def __listRuleFiles(self, path: str) -> list:
+        if not os.path.isdir(path):
+            return [path]
+        return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".yaml"))
+
+    def getInputs(self) -> list:
+        return self.__ruleSet.getInputs()
+
+    def getRuleSet(self) -> MappingRuleSet:
+        return self.__ruleSet
+
+    def getEnvironnement(
+        self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
+    ) -> Environnement:
+        # compare everything lower cased, missing values never match
+        values: dict = {
+            MapperInputs.SERVICE_FAMILY: self.__normalize(serviceFamily),
+            MapperInputs.SERVICE_NAME: self.__normalize(serviceName),
+            MapperInputs.SKU_NAME: self.__normalize(skuName),
+            MapperInputs.REGION_NAME: self.__normalize(regionName),
+            MapperInputs.RESOURCE_GROUP_NAME: self.__normalize(resourceGroupName),
+        }
+        return self.__ruleSet.getEnvironnement(values, self.__normalizeTags(tags))
+
+    def __normalize(self, value: any) -> str:
+        if not isinstance(value, str):
+            return None
+        return value.lower()
+
+    def __normalizeTags(self, tags: any) -> dict:
+        if MapperInputs.TAGS not in self.__ruleSet.getInputs():
+            return dict()
+        if isinstance(tags, str):
+            tags = TagReader.getDictFromTags(tags)
+        elif not isinstance(tags, Mapping):
+            return dict()
+        return {str(k).lower(): str(v).lower() for k, v in tags.items()}
@@ -0,0 +1,247 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import dataclasses
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Iterator
+import numpy as np
+
+from azinvoicer.invoice_record import GroupedInvoiceStats
+from azinvoicer.invoice_batch import InvoiceBatchProcessor
+from azinvoicer.invoice_cli import InvoicePipeline
+
+
+class InvoiceService(object):
+    """keeps the models, the mappers and their caches warm across requests, invoices run on a bounded pool of workers"""
+
+    DEFAULT_JOBS: int = 4
+
+    __pipeline: InvoicePipeline
+    __rootDirPath: str
+    __executor: ThreadPoolExecutor
+
+    def __init__(
+        self, pipeline: InvoicePipeline, jobs: int = DEFAULT_JOBS, maxPending: int = None, rootDirPath: str = None
+    ) -> None:
+        self.__logger = logging.getLogger("InvoiceService")
+        self.__pipeline = pipeline
+        # invoices outside of the root directory are refused, no root allows any local file
+        self.__rootDirPath = os.path.realpath(rootDirPath) if rootDirPath is not None else None
+        jobs = max(1, jobs)
+        self.__executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="InvoiceService")
+        # submissions block once the queue is full so that memory does not depend on the number of requests
+        self.__slots = threading.BoundedSemaphore(maxPending if maxPending is not None else 2 * jobs)
+
+    def getPipeline(self) -> InvoicePipeline:
+        return self.__pipeline
+
+    def listInvoiceFiles(self, pathsOrPatterns: list) -> list:
+        files: list = InvoiceBatchProcessor.listInvoiceFiles(pathsOrPatterns)
+        if self.__rootDirPath is not None:
+            for f in files:
+                if os.path.commonpath([self.__rootDirPath, os.path.realpath(f)]) != self.__rootDirPath:
+                    raise PermissionError("invoice file " + f + " is outside of " + self.__rootDirPath)
+        return files
+
+    def submit(self, invoiceFilePath: str, useCache: bool = True) -> Future:
+        self.__slots.acquire()
+        try:
+            future: Future = self.__executor.submit(self.__pipeline.groupInvoiceFile, invoiceFilePath, 1, useCache)
+        except Exception:
+            self.__slots.release()
+            raise
+        future.add_done_callback(lambda f: self.__slots.release())
+        return future
+
+    def processInvoiceFiles(self, invoiceFilePaths: list, useCache: bool = True) -> Iterator[tuple]:
+        """yields (path, grouped stats or exception) in the given order, each as soon as it and the previous ones are done"""
+        pending: deque = deque()
+        for path in invoiceFilePaths:
+            while len(pending) > 0 and pending[0][1].done():
+                yield self.__result(*pending.popleft())
+            pending.append((path, self.submit(path, useCache)))
+        while len(pending) > 0:
+            yield self.__result(*pending.popleft())
+
+    def __result(self, path: str, future: Future) -> tuple:
+        try:
+            return path, future.result()
+        except Exception as ex:
+            self.__logger.warning("failed to process invoice file " + path + " error=" + repr(ex))
+            return path, ex
+
+    def getStatus(self) -> dict:
+        timer = self.__pipeline.getTimer()
+        mapper = self.__pipeline.getMapper()
+        return {
+            "models": self.__pipeline.getRepository().listModelNames(),
+            "mappers": mapper.getOrder() if hasattr(mapper, "getOrder") else [type(mapper).__name__],
+            "mapperCache": dataclasses.asdict(mapper.getCacheStats()) if hasattr(mapper, "getCacheStats") else None,
+            "stages": {s: {"seconds": timer.getSeconds(s), "calls": timer.getCalls(s)} for s in timer.getStages()},
+        }
+
+    def shutdown(self) -> None:
+        self.__executor.shutdown(wait=True)
+
+    @classmethod
+    def toRecord(cts, invoiceFilePath: str, result: any) -> dict:
+        if isinstance(result, Exception):
+            return {"file": invoiceFilePath, "error": repr(result)}
+        if result is None:
+            return {"file": invoiceFilePath, "compliant": False}
+        grouped: GroupedInvoiceStats = result
+        stats: dict = {f.name: getattr(grouped.stats, f.name) for f in dataclasses.fields(grouped.stats) if f.name != "data"}
+        return {
+            "file": invoiceFilePath,
+            "compliant": True,
+            "stats": stats,
+            "groups": grouped.groups.to_dict(orient="records"),
+        }
+
+
+class InvoiceRequestHandler(BaseHTTPRequestHandler):
+    """local http api, results are streamed back as one json document per line
+
+    GET /status            models, mappers, caches and stage timings
+    POST /invoices         json body {"paths": [...]} holding files, directories or glob patterns
+    POST /invoices?name=x  the invoice csv itself as the request body
+    """
+
+    INVOICES_PATH: str = "/invoices"
+    STATUS_PATH: str = "/status"
+    JSON_TYPE: str = "application/json"
+    NDJSON_TYPE: str = "application/x-ndjson"
+    COPY_BUFFER_SIZE: int = 1024 * 1024
+
+    server: "InvoiceServer"
+
+    def log_message(self, format: str, *args) -> None:
+        logging.getLogger("InvoiceRequestHandler").info(self.address_string() + " " + (format % args))
+
+    def do_GET(self) -> None:
+        if urlparse(self.path).path != self.STATUS_PATH:
+            self.__sendError(404, "unknown path " + self.path)
+            return
+        self.__sendJson(200, self.server.getService().getStatus())
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != self.INVOICES_PATH:
+            self.__sendError(404, "unknown path " + self.path)
+            return
+        if self.headers.get("Content-Length") is None:
+            self.__sendError(411, "the content length is required")
+            return
+        if self.headers.get_content_type() == self.JSON_TYPE:
+            self.__processPaths()
+        else:
+            self.__processUpload(parse_qs(url.query).get("name", ["upload.csv"])[0])
+
+    def __processPaths(self) -> None:
+        try:
+            paths: any = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["paths"]
+            if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+                raise ValueError("paths must be a list of strings")
+            files: list = self.server.getService().listInvoiceFiles(paths)
+        except PermissionError as ex:
+            self.__sendError(403, str(ex))
+            return
+        except (ValueError, KeyError, TypeError) as ex:
+            self.__sendError(400, "invalid request " + repr(ex))
+            return
+        self.__streamResults(files, {f: f for f in files})
+
+    def __processUpload(self, name: str) -> None:
+        # the body is copied to a temporary file so that the invoice is read as any other
+        fd, uploadPath = tempfile.mkstemp(suffix=".csv", dir=self.server.getUploadDirPath())
+        try:
+            remaining: int = int(self.headers["Content-Length"])
+            with os.fdopen(fd, "wb") as f:
+                while remaining > 0:
+                    block: bytes = self.rfile.read(min(remaining, self.COPY_BUFFER_SIZE))
+                    if len(block) == 0:
+                        break
+                    f.write(block)
+                    remaining = remaining - len(block)
+            # uploads get a new temporary path each time, caching them would only fill the cache with dead entries
+            self.__streamResults([uploadPath], {uploadPath: os.path.basename(name)}, useCache=False)
+        finally:
+            os.remove(uploadPath)
+
+    def __streamResults(self, files: list, names: dict, useCache: bool = True) -> None:
+        # the response has no length, it ends when the connection is closed
+        self.send_response(200)
+        self.send_header("Content-Type", self.NDJSON_TYPE)
+        self.end_headers()
+        failed: int = 0
+        notCompliant: int = 0
+        for path, result in self.server.getService().processInvoiceFiles(files, useCache):
+            record: dict = InvoiceService.toRecord(names[path], result)
+            failed = failed + (1 if "error" in record else 0)
+            notCompliant = notCompliant + (1 if record.get("compliant", True) is False else 0)
+            self.__writeLine(record)
+        self.__writeLine({"done": True, "invoices": len(files), "notCompliant": notCompliant, "failed": failed})
+
+    def __writeLine(self, document: dict) -> None:
+        self.wfile.write(json.dumps(document, default=self.__toJson).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def __sendJson(self, code: int, document: dict) -> None:
+        content: bytes = json.dumps(document, default=self.__toJson).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", self.JSON_TYPE)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def __sendError(self, code: int, message: str) -> None:
+        self.__sendJson(code, {"error": message})
+
+    @staticmethod
+    def __toJson(value: any) -> any:
+        if isinstance(value, np.generic):
+            return value.item()
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return str(value)
+
+
+class InvoiceServer(ThreadingHTTPServer):
+    """http server sharing a single warm invoice service between its request threads"""
+
+    DEFAULT_HOST: str = "127.0.0.1"
+    DEFAULT_PORT: int = 8642
+    daemon_threads: bool = True
+
+    __service: InvoiceService
+    __uploadDirPath: str
+
+    def __init__(self, service: InvoiceService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        super().__init__((host, port), InvoiceRequestHandler)
+        self.__logger = logging.getLogger("InvoiceServer")
+        self.__service = service
+        self.__uploadDirPath = tempfile.mkdtemp(prefix="azinvoicer_uploads_")
+
+    def getService(self) -> InvoiceService:
+        return self.__service
+
+    def getUploadDirPath(self) -> str:
+        return self.__uploadDirPath
+
+    def getPort(self) -> int:
+        return self.server_address[1]
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self.__logger.info("serving invoices on " + self.server_address[0] + ":" + str(self.getPort()))
+        super().serve_forever(poll_interval)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.__service.shutdown()
+        shutil.rmtree(self.__uploadDirPath, ignore_errors=True)
@@ -0,0 +1,98 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel, MandatoryFields, OutputModel
+from azinvoicer.invoice_cache import InvoiceCache
+from azinvoicer.invoice_tagreader import TagReader
+
+
+class InvoiceTagIndex(object):
+    """tags exploded into one dictionary encoded column per tag key, lines without the key hold a missing value"""
+
+    COST_FIELD: str = OutputModel.getColumName(MandatoryFields.BILLED_COST)
+    LINES_FIELD: str = "Lines"
+
+    __table: pd.DataFrame
+
+    def __init__(self, table: pd.DataFrame) -> None:
+        self.__table = table
+
+    @classmethod
+    def fromTags(cts, tags: pd.Series) -> "InvoiceTagIndex":
+        # each distinct tag string is decoded once, lines only carry integer codes
+        codes, uniques = pd.factorize(tags)
+        decoded: list = [TagReader.getDictFromTags(u) for u in uniques]
+        keys: list = list()
+        for d in decoded:
+            keys.extend(k for k in d.keys() if k not in keys)
+
+        columns: dict = dict()
+        for k in keys:
+            values: list = [str(d[k]) if k in d else None for d in decoded]
+            keyCodes, categories = pd.factorize(pd.Series(values, dtype=object))
+            # lines without tags have the -1 code, which picks the trailing missing slot
+            lineCodes: np.ndarray = np.append(keyCodes, -1)[codes]
+            columns[k] = pd.Categorical.from_codes(lineCodes, categories=categories)
+        return InvoiceTagIndex(pd.DataFrame(columns, index=pd.RangeIndex(len(tags.index)), columns=keys))
+
+    def getKeys(self) -> list:
+        return self.__table.columns.tolist()
+
+    def getLines(self) -> int:
+        return len(self.__table.index)
+
+    def getTable(self) -> pd.DataFrame:
+        return self.__table
+
+    def getColumn(self, key: str) -> pd.Series:
+        """values of a tag key for every line, an all missing column when no line has that key"""
+        if key in self.__table.columns:
+            return self.__table[key]
+        return pd.Series(pd.Categorical([None] * self.getLines()), index=self.__table.index, name=key)
+
+    def groupBy(self, keys: list, costs: pd.Series) -> pd.DataFrame:
+        """sums the line costs per distinct combination of the tag keys values, untagged lines included"""
+        lines: int = self.getLines()
+        groups: np.ndarray = np.zeros(lines, dtype=np.int64)
+        for k in keys:
+            codes: np.ndarray = self.getColumn(k).cat.codes.to_numpy(dtype=np.int64)
+            # compact the combined codes after each key so that they never overflow
+            groups, _ = pd.factorize(groups * (codes.max(initial=-1) + 2) + (codes + 1))
+        _, firsts, inverse = np.unique(groups, return_index=True, return_inverse=True)
+
+        result: dict = dict()
+        for k in keys:
+            values: np.ndarray = self.getColumn(k).to_numpy(dtype=object)[firsts]
+            result[k] = np.where(pd.isna(values), None, values)
+        result[self.COST_FIELD] = np.bincount(inverse, weights=np.asarray(costs, dtype=float), minlength=len(firsts))
+        result[self.LINES_FIELD] = np.bincount(inverse, minlength=len(firsts))
+        return pd.DataFrame(result).sort_values(by=keys, ignore_index=True)
+
+
+class InvoiceTagIndexer(object):
+    """builds the tag index of a loaded invoice, cached alongside the invoice table when a cache is provided"""
+
+    CACHE_VARIANT: str = "tags"
+
+    __cache: InvoiceCache
+
+    def __init__(self, cache: InvoiceCache = None) -> None:
+        self.__logger = logging.getLogger("InvoiceTagIndexer")
+        self.__cache = cache
+
+    def getTagIndex(
+        self, level: ModelComplianceLevel, model: MappingModel, invoiceFilePath: str, table: pd.DataFrame
+    ) -> InvoiceTagIndex:
+        lines: int = len(table.index)
+        if self.__cache is not None:
+            cached: pd.DataFrame = self.__cache.get(level, model, invoiceFilePath, self.CACHE_VARIANT)
+            # an index without any key is stored without lines
+            if cached is not None and (len(cached.index) == lines or len(cached.columns) == 0):
+                return InvoiceTagIndex(cached.reindex(pd.RangeIndex(lines)))
+
+        self.__logger.info("indexing tags of invoice file " + invoiceFilePath)
+        index: InvoiceTagIndex = InvoiceTagIndex.fromTags(table[model.getMandatoryColumnName(MandatoryFields.TAGS)])
+        if self.__cache is not None:
+            self.__cache.put(level, model, invoiceFilePath, index.getTable(), self.CACHE_VARIANT)
+        return index
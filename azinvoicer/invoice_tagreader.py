@@ -1,31 +1,191 @@
 import logging
 import json
-import re
+import functools
+import threading
+from types import MappingProxyType
+from typing import Iterable, Iterator
+import numpy as np
+import pandas as pd
 
 
 class TagReader(object):
 
     logger = logging.getLogger("TagReader")
 
+    # resources keep the same tags all month long, distinct tag strings are few
+    CACHE_SIZE: int = 65536
+    QUOTE: str = '"'
+    DOUBLE_QUOTE: str = '""'
+    EMPTY_TAGS = MappingProxyType(dict())
+
+    __failures: int = 0
+    __failuresLock = threading.Lock()
+
     @classmethod
     def getDictFromTags(cts, tags: str) -> dict:
-        data: dict
-        jsonForm: str = ""
-        if '""' in tags:
-            # strip double quotes enclosing strings
-            a: str = re.sub(pattern=r'("")([\w]+)("")', repl='"\\2"', string=tags)
-            # strip quadruple quotes (i.e empty value)
-            b: str = a.replace('""""', '""')
-            jsonForm = b
-        else:
-            jsonForm = tags
-
-        if (not re.match("{", tags)) and (not re.match("}", tags)):
-            jsonForm = "{" + jsonForm + "}"
+        """decodes the tags as found in invoices, the returned mapping is shared and read only"""
+        if not isinstance(tags, str):
+            # lines without tags
+            return cts.EMPTY_TAGS
+        data, failed = cts.__decodeCached(tags)
+        if failed:
+            with cts.__failuresLock:
+                cts.__failures = cts.__failures + 1
+        return data
+
+    @classmethod
+    def getParseFailures(cts) -> int:
+        return cts.__failures
+
+    @classmethod
+    def resetParseFailures(cts) -> None:
+        with cts.__failuresLock:
+            cts.__failures = 0
+
+    @classmethod
+    def getTagKeys(cts, tags: str) -> tuple:
+        """keys of the tags, in their declaration order"""
+        return cts.__getKeysCached(tags)
 
+    @classmethod
+    def getSelectedTags(cts, tags: str, keys: Iterable[str]) -> dict:
+        """values of the requested keys only, keys missing from the tags are left out"""
+        if not isinstance(tags, str):
+            return dict()
+        # look the requested keys up in place instead of decoding every tag, either quoted form
+        quote: str = cts.DOUBLE_QUOTE if cts.__isDoubleQuoted(tags) else cts.QUOTE
+        selected: dict = dict()
         try:
-            data = json.loads(jsonForm)
-        except Exception as ex:
-            data = dict()
-            cts.logger.debug("error while parsing tags from json : " + jsonForm + " error=" + getattr(ex, "message", repr(ex)))
-        return data
+            for k in keys:
+                span: tuple = cts.__findValue(tags, k, quote)
+                if span is not None:
+                    selected[k] = cts.__getValue(tags, span, quote)
+        except ValueError:
+            # values the scanner does not read, i.e not quoted, are left to the decoder
+            decoded: dict = cts.getDictFromTags(tags)
+            return {k: decoded[k] for k in keys if k in decoded}
+        return selected
+
+    @classmethod
+    def getSelectedTagsColumn(cts, tags: pd.Series, keys: list) -> pd.DataFrame:
+        """one column per requested key, each distinct tag string is only read once"""
+        codes, uniques = pd.factorize(tags)
+        selected: list = [cts.getSelectedTags(u, keys) for u in uniques]
+        columns: dict = dict()
+        for k in keys:
+            # missing values get the extra last slot, picked by the -1 code
+            values: np.ndarray = np.array([s.get(k, None) for s in selected] + [None], dtype=object)
+            columns[k] = values[codes]
+        return pd.DataFrame(columns, index=tags.index, columns=keys)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def __getKeysCached(tags: str) -> tuple:
+        if not isinstance(tags, str):
+            return tuple()
+        # keys are scanned in place, either quoted form, the tags are only decoded when the scanner can not read them
+        quote: str = TagReader.DOUBLE_QUOTE if TagReader.__isDoubleQuoted(tags) else TagReader.QUOTE
+        try:
+            return tuple(k for k, valueStart, valueEnd in TagReader.__scan(tags, quote))
+        except ValueError:
+            return tuple(TagReader.getDictFromTags(tags).keys())
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def __decodeCached(tags: str) -> tuple:
+        try:
+            if TagReader.__isDoubleQuoted(tags):
+                return MappingProxyType({k: tags[vs:ve] for k, vs, ve in TagReader.__scan(tags, TagReader.DOUBLE_QUOTE)}), False
+            jsonForm: str = tags if tags.lstrip().startswith("{") else "{" + tags + "}"
+            data: any = json.loads(jsonForm)
+            if not isinstance(data, dict):
+                raise ValueError("tags are not an object")
+            return MappingProxyType(data), False
+        except Exception:
+            return TagReader.EMPTY_TAGS, True
+
+    @classmethod
+    def __isDoubleQuoted(cts, tags: str) -> bool:
+        # the doubled quote format starts with a doubled quote, plain json may still hold empty "" values
+        return tags.find(cts.DOUBLE_QUOTE) == tags.find('"') >= 0
+
+    @classmethod
+    def __scan(cts, tags: str, quote: str) -> Iterator[tuple]:
+        # keys and values are enclosed in quotes, doubled ones i.e ""key"" : ""value"" where a lone "" is an empty value
+        position: int = tags.find(quote)
+        while position >= 0:
+            keyStart: int = position + len(quote)
+            keyEnd: int = tags.find(quote, keyStart) if quote == cts.DOUBLE_QUOTE else cts.__findClosingQuote(tags, keyStart)
+            if keyEnd < 0:
+                raise ValueError("unterminated key at " + str(position))
+            if quote == cts.QUOTE and "\\" in tags[keyStart:keyEnd]:
+                raise ValueError("escaped key at " + str(position))
+            read: tuple = cts.__readValue(tags, keyEnd + len(quote), quote)
+            if read is None:
+                raise ValueError("missing colon at " + str(keyEnd + len(quote)))
+            valueStart, valueEnd, following = read
+            yield tags[keyStart:keyEnd], valueStart, valueEnd
+            position = tags.find(quote, following)
+
+    @classmethod
+    def __findValue(cts, tags: str, key: str, quote: str) -> tuple:
+        quotedKey: str = quote + key + quote
+        position: int = tags.find(quotedKey)
+        while position >= 0:
+            # the same text may be found as a value, only keys are followed by a colon
+            read: tuple = cts.__readValue(tags, position + len(quotedKey), quote)
+            if read is not None:
+                valueStart, valueEnd, following = read
+                return valueStart, valueEnd
+            position = tags.find(quotedKey, position + 1)
+        return None
+
+    @classmethod
+    def __getValue(cts, tags: str, span: tuple, quote: str) -> str:
+        valueStart, valueEnd = span
+        value: str = tags[valueStart:valueEnd]
+        if quote == cts.QUOTE and "\\" in value:
+            # escaped characters are rare, let the json decoder handle them
+            return json.loads(cts.QUOTE + value + cts.QUOTE)
+        return value
+
+    @classmethod
+    def __readValue(cts, tags: str, keyEnd: int, quote: str) -> tuple:
+        # returns the value span and the position to resume scanning from, None when the quoted text is not a key
+        length: int = len(tags)
+        colon: int = cts.__skipSpaces(tags, keyEnd)
+        if colon >= length or tags[colon] != ":":
+            return None
+        valueQuote: int = cts.__skipSpaces(tags, colon + 1)
+        if not tags.startswith(quote, valueQuote):
+            raise ValueError("missing value at " + str(valueQuote))
+        valueStart: int = valueQuote + len(quote)
+        if quote == cts.QUOTE:
+            valueEnd: int = cts.__findClosingQuote(tags, valueStart)
+            return valueStart, valueEnd, valueEnd + 1
+        following: int = cts.__skipSpaces(tags, valueStart)
+        if following >= length or tags[following] in ",}":
+            return valueStart, valueStart, following
+        valueEnd = tags.find(quote, valueStart)
+        if valueEnd < 0:
+            raise ValueError("unterminated value at " + str(valueQuote))
+        return valueStart, valueEnd, valueEnd + 2
+
+    @classmethod
+    def __findClosingQuote(cts, tags: str, valueStart: int) -> int:
+        # a quote preceded by an odd number of backslashes is part of the value
+        position: int = tags.find(cts.QUOTE, valueStart)
+        while position >= 0:
+            backslashes: int = 0
+            while tags[position - 1 - backslashes] == "\\":
+                backslashes = backslashes + 1
+            if backslashes % 2 == 0:
+                return position
+            position = tags.find(cts.QUOTE, position + 1)
+        raise ValueError("unterminated value at " + str(valueStart))
+
+    @classmethod
+    def __skipSpaces(cts, tags: str, position: int) -> int:
+        while position < len(tags) and tags[position] in " \t\r\n":
+            position = position + 1
+        return position
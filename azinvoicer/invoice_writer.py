@@ -0,0 +1,48 @@
+import os
+import logging
+from enum import Enum
+import pandas as pd
+
+from azinvoicer.helpers import IOHelper, ModuleHelper
+
+
+class OutputFormat(Enum):
+    """file formats the reports can be written in"""
+
+    CSV = "csv"
+    XLSX = "xlsx"
+    JSON = "json"
+
+
+class InvoiceWriter(object):
+    """writes report tables, files are written aside then moved so that readers never see partial files"""
+
+    XLSX_ENGINE: str = "openpyxl"
+
+    __format: OutputFormat
+
+    def __init__(self, outputFormat: OutputFormat = OutputFormat.CSV) -> None:
+        self.__logger = logging.getLogger("InvoiceWriter")
+        self.__format = outputFormat
+        if outputFormat == OutputFormat.XLSX and not ModuleHelper.isAvailable(self.XLSX_ENGINE):
+            self.__logger.warning(self.XLSX_ENGINE + " is not installed, falling back to the csv format")
+            self.__format = OutputFormat.CSV
+
+    def getFormat(self) -> OutputFormat:
+        return self.__format
+
+    def getOutputPath(self, outputDirPath: str, name: str) -> str:
+        return os.path.join(outputDirPath, name + "." + self.__format.value)
+
+    def write(self, table: pd.DataFrame, outputFilePath: str) -> None:
+        IOHelper.mkdirFilePath(os.path.abspath(outputFilePath))
+        IOHelper.writeAtomically(outputFilePath, lambda tmpPath: self.__writeTable(table, tmpPath))
+        self.__logger.info("written " + str(len(table.index)) + " lines to " + outputFilePath)
+
+    def __writeTable(self, table: pd.DataFrame, filePath: str) -> None:
+        if self.__format == OutputFormat.XLSX:
+            table.to_excel(filePath, index=False, engine=self.XLSX_ENGINE)
+        elif self.__format == OutputFormat.JSON:
+            table.to_json(filePath, orient="records", date_format="iso")
+        else:
+            table.to_csv(filePath, index=False)
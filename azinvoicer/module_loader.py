@@ -1,5 +1,7 @@
 import importlib
+import importlib.metadata
 import logging
+import threading
 import re
 
 
@@ -26,15 +28,105 @@ class InvoiceClassToLoad(object):
 
 
 class InvoiceClassLoader(object):
+    """process wide registry of the declared classes
+
+    resolved classes are cached, classes declaring SHAREABLE = True may also share a single
+    instance per process, and classes can be published by packages through entry points
+    """
+
+    SHAREABLE_FLAG: str = "SHAREABLE"
 
     __logger = logging.getLogger("InvoiceClassLoader")
+    __lock = threading.RLock()
+    __classes: dict = dict()
+    __instances: dict = dict()
+    __entryPoints: dict = dict()
 
     @classmethod
-    def loadClassInstance(cts, item: InvoiceClassToLoad) -> any:
+    def loadClass(cts, item: InvoiceClassToLoad) -> type:
+        key: str = item.getPackageName() + ":" + item.getClassName()
+        with cts.__lock:
+            if key in cts.__classes:
+                return cts.__classes[key]
         try:
             theModule = importlib.import_module(item.getPackageName())
             theClass = getattr(theModule, item.getClassName())
-            return theClass()
         except:
             cts.__logger.error("unable to load module=" + item.getPackageName() + " class=" + item.getClassName())
             return None
+        with cts.__lock:
+            cts.__classes[key] = theClass
+        return theClass
+
+    @classmethod
+    def loadClassInstance(cts, item: InvoiceClassToLoad, shared: bool = False) -> any:
+        return cts.getInstance(cts.loadClass(item), shared)
+
+    @classmethod
+    def getInstance(cts, theClass: type, shared: bool = False) -> any:
+        if theClass is None:
+            return None
+        if not (shared and getattr(theClass, cts.SHAREABLE_FLAG, False)):
+            return cts.__createInstance(theClass)
+        with cts.__lock:
+            if theClass not in cts.__instances:
+                instance: any = cts.__createInstance(theClass)
+                if instance is None:
+                    return None
+                cts.__instances[theClass] = instance
+            return cts.__instances[theClass]
+
+    @classmethod
+    def __createInstance(cts, theClass: type) -> any:
+        try:
+            return theClass()
+        except:
+            cts.__logger.error("unable to create an instance of class=" + theClass.__module__ + "." + theClass.__name__)
+            return None
+
+    @classmethod
+    def discoverEntryPoints(cts, group: str, baseClass: type = None) -> dict:
+        """classes published under an entry point group, by entry point name, validated once per process"""
+        with cts.__lock:
+            if group in cts.__entryPoints:
+                return cts.__entryPoints[group]
+
+            discovered: dict = dict()
+            for entryPoint in cts.__listEntryPoints(group):
+                try:
+                    theClass: any = entryPoint.load()
+                except:
+                    cts.__logger.error("unable to load entry point " + entryPoint.name + " from group " + group)
+                    continue
+                if not isinstance(theClass, type) or (baseClass is not None and not issubclass(theClass, baseClass)):
+                    cts.__logger.error("ignoring entry point " + entryPoint.name + " which is not a valid class")
+                    continue
+                discovered[entryPoint.name] = theClass
+            cts.__entryPoints[group] = discovered
+            return discovered
+
+    @classmethod
+    def __listEntryPoints(cts, group: str) -> list:
+        try:
+            return list(importlib.metadata.entry_points(group=group))
+        except TypeError:
+            # python < 3.10 only provides entry points indexed by group
+            return list(importlib.metadata.entry_points().get(group, list()))
+
+    @classmethod
+    def loadDeclaration(cts, declaration: str, group: str, baseClass: type = None, shared: bool = False) -> any:
+        """instance of a class declared either as pkg:Class or by the name of an entry point of the group"""
+        if InvoiceClassToLoad.isValidDeclaration(declaration):
+            return cts.loadClassInstance(InvoiceClassToLoad(declaration), shared)
+        theClass: type = cts.discoverEntryPoints(group, baseClass).get(declaration, None)
+        if theClass is None:
+            cts.__logger.error("unknown declaration " + declaration + " in entry point group " + group)
+            return None
+        return cts.getInstance(theClass, shared)
+
+    @classmethod
+    def clear(cts) -> None:
+        with cts.__lock:
+            cts.__classes.clear()
+            cts.__instances.clear()
+            cts.__entryPoints.clear()
@@ -1,7 +1,11 @@
 #!/usr/bin/python3
 
+import sys
 import logging
 
+from azinvoicer.invoice_cli import InvoiceCommandLine
+
 logging.basicConfig(format="[%(asctime)s] [%(levelname)s] %(message)s", level=logging.INFO)
 
-logging.getLogger("main").info("Hello Python")
+if __name__ == "__main__":
+    sys.exit(InvoiceCommandLine().run(sys.argv[1:]))
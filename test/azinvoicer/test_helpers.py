@@ -22,6 +22,47 @@ class TestDateHelper(unittest.TestCase):
         self.assertEquals(date.date().month, 2)
         self.assertEquals(date.date().year, 2023)
 
+    def test_DatesFromStrings(self) -> None:
+        # given a column of dates as strings holding only a few distinct values
+        format: str = "%m/%d/%Y"
+        dates: list = ["01/31/2023", "01/01/2023", "01/31/2023", "01/31/2023"]
+
+        # when I convert the whole column
+        parsed: list = DateHelper.parseDates(format, dates)
+
+        # then each item is converted in order
+        self.assertEqual(len(parsed), 4)
+        self.assertEqual(parsed[0], datetime.datetime(2023, 1, 31))
+        self.assertEqual(parsed[1], datetime.datetime(2023, 1, 1))
+        self.assertEqual(parsed[3], datetime.datetime(2023, 1, 31))
+
+    def test_DistinctDatesFromStrings(self) -> None:
+        # given a column of dates as strings holding only a few distinct values
+        format: str = "%d/%m/%Y"
+        dates: list = ["02/03/2023", "02/03/2023", "28/02/2023"]
+
+        # when I convert the distinct values
+        parsed: dict = DateHelper.parseDistinctDates(format, dates)
+
+        # then each distinct string is converted once using the format
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(parsed["02/03/2023"], datetime.datetime(2023, 3, 2))
+        self.assertEqual(parsed["28/02/2023"], datetime.datetime(2023, 2, 28))
+
+    def test_DateFromStringCached(self) -> None:
+        # given a date already parsed once
+        format: str = "%Y-%m-%d"
+        DateHelper.parseDateCached(format, "2023-04-05")
+        hits: int = DateHelper.parseDateCached.cache_info().hits
+
+        # when parsing it again
+        date: datetime = DateHelper.parseDateCached(format, "2023-04-05")
+
+        # then the result is served from the cache
+        self.assertEqual(date, datetime.datetime(2023, 4, 5))
+        self.assertEqual(DateHelper.parseDateCached.cache_info().hits, hits + 1)
+        self.assertEqual(DateHelper.parseDateCached.cache_info().maxsize, DateHelper.CACHE_SIZE)
+
     def test_DateToString(self) -> None:
         # given a date as a dateformat
         date = datetime.date(2023, 12, 28)
@@ -87,6 +128,29 @@ class TestIOTools(unittest.TestCase):
         # it returns the correct size
         self.assertEqual(fsize, 0.11, "file is correctly sized")
 
+    def test_writeAtomically(self) -> None:
+        # given an existing file
+        fileOut = os.path.join(self.__testTempDirPath, "atomic.txt")
+        IOHelper.listToFile(["old"], fileOut)
+
+        # when the new content fails to be written
+        def failingWrite(tmpPath: str) -> None:
+            with open(tmpPath, "w") as f:
+                f.write("partial")
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            IOHelper.writeAtomically(fileOut, failingWrite)
+        # then the file is left untouched and no temporary file remains
+        self.assertEqual(open(fileOut).read(), "old\n")
+        self.assertEqual(os.listdir(self.__testTempDirPath), ["atomic.txt"])
+
+        # when the new content is written
+        IOHelper.writeAtomically(fileOut, lambda tmpPath: IOHelper.listToFile(["new"], tmpPath))
+        # then it replaces the file
+        self.assertEqual(open(fileOut).read(), "new\n")
+        self.assertEqual(os.listdir(self.__testTempDirPath), ["atomic.txt"])
+
     def tearDown(self) -> None:
         shutil.rmtree(self.__testTempDirPath)
 
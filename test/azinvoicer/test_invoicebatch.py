@@ -0,0 +1,92 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from azinvoicer.invoice_batch import InvoiceBatchProcessor
+from azinvoicer.invoice_model import MappingModelRepository
+from azinvoicer.invoice_mapperchain import MapperChain
+from azinvoicer.invoice_record import BatchInvoiceStats
+
+
+class BatchTestConstants(object):
+    PATH_TO_MODEL_REPO = "./azinvoicer/models/in"
+    PATH_TO_FIXTURES = "./test/azinvoicer/fixtures/invoices"
+    MAPPERS = ["azinvoicer.invoice_mappers:BasicRGMapper"]
+
+
+class TestInvoiceBatchProcessor(unittest.TestCase):
+
+    __testTempDirPath: str
+
+    def setUp(self):
+        self.__testTempDirPath = tempfile.mkdtemp()
+        for f in ["std_multiple_lines.csv", "std_mandatory.csv", "std_not_compliant.csv"]:
+            shutil.copyfile(os.path.join(BatchTestConstants.PATH_TO_FIXTURES, f), os.path.join(self.__testTempDirPath, f))
+        self.repo: MappingModelRepository = MappingModelRepository(BatchTestConstants.PATH_TO_MODEL_REPO)
+        self.chain: MapperChain = MapperChain(BatchTestConstants.MAPPERS)
+
+    def test_list_files(self) -> None:
+        # given a directory holding invoices
+        # when listing the files from the directory or from a pattern
+        fromDir: list = InvoiceBatchProcessor.listInvoiceFiles(self.__testTempDirPath)
+        fromPattern: list = InvoiceBatchProcessor.listInvoiceFiles(os.path.join(self.__testTempDirPath, "std_m*.csv"))
+        # then the files are listed in a stable order
+        self.assertEqual([os.path.basename(f) for f in fromDir], ["std_mandatory.csv", "std_multiple_lines.csv", "std_not_compliant.csv"])
+        self.assertEqual([os.path.basename(f) for f in fromPattern], ["std_mandatory.csv", "std_multiple_lines.csv"])
+
+    def test_process_directory(self) -> None:
+        # given a batch processor using 2 workers
+        processor: InvoiceBatchProcessor = InvoiceBatchProcessor(self.repo, self.chain, jobs=2)
+
+        # when processing the directory
+        ret: BatchInvoiceStats = processor.processInvoices(self.__testTempDirPath)
+
+        # then each compliant file has its own stats
+        self.assertEqual(len(ret.perFile), 2)
+        perFile: dict = {os.path.basename(k): v for k, v in ret.perFile.items()}
+        self.assertEqual(perFile["std_multiple_lines.csv"].parsedLines, 7)
+        self.assertEqual(perFile["std_mandatory.csv"].parsedLines, 1)
+        # and the non compliant file is reported
+        self.assertEqual([os.path.basename(f) for f in ret.notCompliant], ["std_not_compliant.csv"])
+        # and the stats are merged
+        self.assertEqual(ret.merged.parsedLines, 8)
+        self.assertEqual(ret.merged.parsedLinesWithoutEnv, 2)
+        self.assertAlmostEqual(ret.merged.totalBilled, 34.625 + 0.000506)
+        self.assertEqual(ret.merged.currency, "EUR")
+        self.assertIsNone(ret.merged.data)
+
+    def test_process_keeping_data(self) -> None:
+        # given a batch processor keeping the parsed data
+        processor: InvoiceBatchProcessor = InvoiceBatchProcessor(self.repo, self.chain, jobs=3, keepData=True)
+        # when processing the directory
+        ret: BatchInvoiceStats = processor.processInvoices(self.__testTempDirPath)
+        # then the merged data holds the lines of all the compliant files
+        self.assertEqual(len(ret.merged.data.index), 8)
+
+    def test_process_failing_file(self) -> None:
+        # given an invoice with a cost that is not a number next to valid ones
+        with open(os.path.join(BatchTestConstants.PATH_TO_FIXTURES, "std_multiple_lines.csv")) as f:
+            lines: list = f.read().splitlines()
+        header: list = lines[0].split(",")
+        values: list = lines[1].split(",")
+        values[header.index("CostInBillingCurrency")] = "not a number"
+        with open(os.path.join(self.__testTempDirPath, "std_broken.csv"), "w") as f:
+            f.write("\n".join([lines[0], ",".join(values)]) + "\n")
+        processor: InvoiceBatchProcessor = InvoiceBatchProcessor(self.repo, self.chain, jobs=2)
+
+        # when processing the directory
+        ret: BatchInvoiceStats = processor.processInvoices(self.__testTempDirPath)
+
+        # then the failure is reported
+        self.assertEqual([os.path.basename(f) for f in ret.failed], ["std_broken.csv"])
+        # and the other files are still processed
+        self.assertEqual(len(ret.perFile), 2)
+        self.assertEqual(ret.merged.parsedLines, 8)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.__testTempDirPath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+
+from azinvoicer.invoice_cache import InvoiceCache
+from azinvoicer.invoice_reader import InvoiceLoader
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel
+
+
+class CacheTestConstants(object):
+    FILE_DATA_STD_MULTIPLE_LINES = "./test/azinvoicer/fixtures/invoices/std_multiple_lines.csv"
+    FILE_MODEL_STD = "./azinvoicer/models/in/standard.yaml"
+    FILE_MODEL_STD_LC = "./azinvoicer/models/in/standard_lc.yaml"
+
+
+class TestInvoiceCache(unittest.TestCase):
+
+    __testTempDirPath: str
+
+    def setUp(self):
+        self.__testTempDirPath = tempfile.mkdtemp()
+        self.cacheDirPath: str = os.path.join(self.__testTempDirPath, "cache")
+        self.invoicePath: str = os.path.join(self.__testTempDirPath, "invoice.csv")
+        shutil.copyfile(CacheTestConstants.FILE_DATA_STD_MULTIPLE_LINES, self.invoicePath)
+        self.model: MappingModel = MappingModel(CacheTestConstants.FILE_MODEL_STD)
+        self.level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+
+    def test_loader_uses_cache(self) -> None:
+        # given a loader using a cache
+        cache: InvoiceCache = InvoiceCache(self.cacheDirPath)
+        loader: InvoiceLoader = InvoiceLoader(cache)
+        self.assertIsNone(cache.get(self.level, self.model, self.invoicePath))
+
+        # when an invoice is loaded twice
+        first: pd.DataFrame = loader.loadInvoice(self.level, self.model, self.invoicePath)
+        second: pd.DataFrame = loader.loadInvoice(self.level, self.model, self.invoicePath)
+
+        # then the invoice was stored in the cache
+        self.assertIsNotNone(cache.get(self.level, self.model, self.invoicePath))
+        # and the cached table is the same as the one read from the csv
+        pd.testing.assert_frame_equal(first, second)
+        pd.testing.assert_frame_equal(second, InvoiceLoader().loadInvoice(self.level, self.model, self.invoicePath))
+
+    def test_key_depends_on_model_level_and_file(self) -> None:
+        # given a cache
+        cache: InvoiceCache = InvoiceCache(self.cacheDirPath, hashContent=True)
+        key: str = cache.getKey(self.level, self.model, self.invoicePath)
+
+        # then the key depends on the model, the level and the content of the file
+        self.assertEqual(key, cache.getKey(self.level, self.model, self.invoicePath))
+        self.assertNotEqual(key, cache.getKey(ModelComplianceLevel.MANDATORY_ONLY, self.model, self.invoicePath))
+        self.assertNotEqual(key, cache.getKey(self.level, MappingModel(CacheTestConstants.FILE_MODEL_STD_LC), self.invoicePath))
+        with open(self.invoicePath, "a") as f:
+            f.write("\n")
+        self.assertNotEqual(key, cache.getKey(self.level, self.model, self.invoicePath))
+
+    def test_eviction_by_size(self) -> None:
+        # given a cache without any room
+        cache: InvoiceCache = InvoiceCache(self.cacheDirPath, maxSizeMb=0)
+        # when an invoice is stored
+        cache.put(self.level, self.model, self.invoicePath, InvoiceLoader().loadInvoice(self.level, self.model, self.invoicePath))
+        # then it was evicted
+        self.assertIsNone(cache.get(self.level, self.model, self.invoicePath))
+        self.assertEqual(os.listdir(self.cacheDirPath), [])
+
+    def test_eviction_by_age(self) -> None:
+        # given a cache holding an invoice
+        cache: InvoiceCache = InvoiceCache(self.cacheDirPath, maxAgeDays=1)
+        cache.put(self.level, self.model, self.invoicePath, InvoiceLoader().loadInvoice(self.level, self.model, self.invoicePath))
+        self.assertIsNotNone(cache.get(self.level, self.model, self.invoicePath))
+
+        # when the entry gets older than the max age
+        for f in os.listdir(self.cacheDirPath):
+            twoDaysAgo: float = time.time() - 2 * 24 * 3600
+            os.utime(os.path.join(self.cacheDirPath, f), (twoDaysAgo, twoDaysAgo))
+        cache.evict()
+
+        # then it was evicted
+        self.assertIsNone(cache.get(self.level, self.model, self.invoicePath))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.__testTempDirPath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,15 @@
 import unittest
+import os
+import sys
+import shutil
+import tempfile
 from azinvoicer.module_loader import InvoiceClassLoader, InvoiceClassToLoad
+from azinvoicer.invoice_mappers import EnvironnementMapper, BasicRGMapper
+from azinvoicer.invoice_mapperchain import MapperChain
+
+
+class StatefulMapper(EnvironnementMapper):
+    pass
 
 
 class TestInvoiceClassToLoad(unittest.TestCase):
@@ -50,6 +60,79 @@ class TestInvoiceClassLoader(unittest.TestCase):
         # then the class is not loaded
         self.assertTrue(loaded is None)
 
+    def test_class_cached(self) -> None:
+        # given a class loaded twice
+        item: InvoiceClassToLoad = InvoiceClassToLoad("azinvoicer.invoice_mappers:BasicRGMapper")
+        # then the same class is resolved
+        self.assertIs(InvoiceClassLoader.loadClass(item), InvoiceClassLoader.loadClass(item))
+        self.assertIs(InvoiceClassLoader.loadClass(item), BasicRGMapper)
+
+    def test_shared_instances(self) -> None:
+        # given a shareable class and a stateful one
+        shareable: InvoiceClassToLoad = InvoiceClassToLoad("azinvoicer.invoice_mappers:BasicRGMapper")
+        stateful: InvoiceClassToLoad = InvoiceClassToLoad("test.azinvoicer.test_invoiceclassloader:StatefulMapper")
+        # when instances are requested as shared
+        # then only the shareable class gets a single instance
+        self.assertIs(
+            InvoiceClassLoader.loadClassInstance(shareable, shared=True),
+            InvoiceClassLoader.loadClassInstance(shareable, shared=True),
+        )
+        self.assertIsNot(
+            InvoiceClassLoader.loadClassInstance(stateful, shared=True),
+            InvoiceClassLoader.loadClassInstance(stateful, shared=True),
+        )
+        # and instances are not shared unless requested
+        self.assertIsNot(InvoiceClassLoader.loadClassInstance(shareable), InvoiceClassLoader.loadClassInstance(shareable))
+
+
+class TestInvoiceClassLoaderEntryPoints(unittest.TestCase):
+
+    GROUP: str = "azinvoicer.test.mappers"
+    __testTempDirPath: str
+
+    def setUp(self):
+        # given an installed distribution publishing mappers, one of them not being a mapper
+        self.__testTempDirPath = tempfile.mkdtemp()
+        distInfoPath: str = os.path.join(self.__testTempDirPath, "azinvoicer_test_mappers-1.0.dist-info")
+        os.mkdir(distInfoPath)
+        with open(os.path.join(distInfoPath, "METADATA"), "w") as f:
+            f.write("Metadata-Version: 2.1\nName: azinvoicer-test-mappers\nVersion: 1.0\n")
+        with open(os.path.join(distInfoPath, "entry_points.txt"), "w") as f:
+            f.write(
+                "[" + self.GROUP + "]\n"
+                "rg = azinvoicer.invoice_mappers:BasicRGMapper\n"
+                "notamapper = azinvoicer.invoice_model:MappingModel\n"
+                "missing = azinvoicer.invoice_mapperz:Nothing\n"
+            )
+        sys.path.append(self.__testTempDirPath)
+        InvoiceClassLoader.clear()
+
+    def tearDown(self):
+        sys.path.remove(self.__testTempDirPath)
+        InvoiceClassLoader.clear()
+        shutil.rmtree(self.__testTempDirPath)
+
+    def test_discovery(self) -> None:
+        # when the entry points are discovered
+        discovered: dict = InvoiceClassLoader.discoverEntryPoints(self.GROUP, EnvironnementMapper)
+        # then only valid mapper classes are kept
+        self.assertEqual(discovered, {"rg": BasicRGMapper})
+        # and instances are created from their names
+        self.assertIsInstance(InvoiceClassLoader.loadDeclaration("rg", self.GROUP, EnvironnementMapper), BasicRGMapper)
+        self.assertIsNone(InvoiceClassLoader.loadDeclaration("unknown", self.GROUP, EnvironnementMapper))
+
+    def test_chain_from_entry_points(self) -> None:
+        # given the chain looking up the test group
+        group: str = MapperChain.ENTRY_POINT_GROUP
+        MapperChain.ENTRY_POINT_GROUP = self.GROUP
+        try:
+            # when a chain is declared with entry point names and a pkg:Class declaration
+            chain: MapperChain = MapperChain(["rg", "unknown", "azinvoicer.invoice_mappers:SingleEnvironnementMapper"])
+        finally:
+            MapperChain.ENTRY_POINT_GROUP = group
+        # then the known mappers are loaded
+        self.assertEqual(chain.getOrder(), ["rg", "azinvoicer.invoice_mappers:SingleEnvironnementMapper"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,203 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+import contextlib
+import pandas as pd
+
+from azinvoicer.invoice_cli import InvoiceCommandLine, InvoicePipeline, InvoiceStageTimer
+from azinvoicer.invoice_model import MappingModelRepository
+from azinvoicer.invoice_mapperchain import MapperChain
+from azinvoicer.invoice_record import BatchInvoiceStats
+from azinvoicer.invoice_writer import InvoiceWriter, OutputFormat
+
+
+class CliTestConstants(object):
+    PATH_TO_MODEL_REPO = "./azinvoicer/models/in"
+    PATH_TO_FIXTURES = "./test/azinvoicer/fixtures/invoices"
+    MAPPERS = ["azinvoicer.invoice_mappers:BasicRGMapper"]
+
+
+class TestInvoiceStageTimer(unittest.TestCase):
+    def test_stages(self) -> None:
+        # given a timer
+        timer: InvoiceStageTimer = InvoiceStageTimer()
+        # when timing stages
+        timer.add("load", 1.5)
+        with timer.time("parse"):
+            pass
+        timer.add("load", 0.5)
+        # then the time is summed per stage in the order stages were first seen
+        self.assertEqual(timer.getStages(), ["load", "parse"])
+        self.assertEqual(timer.getSeconds("load"), 2.0)
+        self.assertEqual(timer.getCalls("load"), 2)
+        self.assertEqual(timer.getCalls("parse"), 1)
+        self.assertEqual(timer.getSeconds("write"), 0.0)
+        # and the summary holds one line per stage and the wall clock time
+        summary: list = timer.getSummary(3.0).splitlines()
+        self.assertEqual([line.split()[0] for line in summary], ["stage", "load", "parse", "wall"])
+
+
+class TestInvoicePipeline(unittest.TestCase):
+
+    __testTempDirPath: str
+
+    def setUp(self):
+        self.__testTempDirPath = tempfile.mkdtemp()
+        self.repo: MappingModelRepository = MappingModelRepository(CliTestConstants.PATH_TO_MODEL_REPO)
+        self.chain: MapperChain = MapperChain(CliTestConstants.MAPPERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.__testTempDirPath)
+
+    def __process(self, chunkSize: int, jobs: int) -> BatchInvoiceStats:
+        pipeline: InvoicePipeline = InvoicePipeline(
+            self.repo, self.chain, InvoiceWriter(OutputFormat.CSV), self.__testTempDirPath, jobs=jobs, chunkSize=chunkSize
+        )
+        ret: BatchInvoiceStats = pipeline.processInvoices(
+            [CliTestConstants.PATH_TO_FIXTURES, os.path.join(CliTestConstants.PATH_TO_FIXTURES, "std_multiple_lines.csv")]
+        )
+        self.assertEqual(pipeline.getTimer().getStages(), ["pick", "load", "parse", "write"])
+        return ret
+
+    def test_process(self) -> None:
+        # when processing the fixtures, one of them being matched twice
+        ret: BatchInvoiceStats = self.__process(chunkSize=0, jobs=2)
+        # then each file is only processed once
+        self.assertEqual(len(ret.perFile), 3)
+        self.assertEqual([os.path.basename(f) for f in ret.notCompliant], ["std_not_compliant.csv"])
+        self.assertEqual(ret.merged.parsedLines, 9)
+        # and the groups and the summary are written
+        groups: pd.DataFrame = pd.read_csv(os.path.join(self.__testTempDirPath, "std_multiple_lines_groups.csv"))
+        self.assertEqual(groups["Lines"].sum(), 7)
+        summary: pd.DataFrame = pd.read_csv(os.path.join(self.__testTempDirPath, "summary.csv"))
+        self.assertEqual(summary["ParsedLines"].tolist(), [1, 1, 7])
+
+    def test_process_chunks(self) -> None:
+        # given the groups of whole invoices
+        self.__process(chunkSize=0, jobs=1)
+        whole: pd.DataFrame = pd.read_csv(os.path.join(self.__testTempDirPath, "std_multiple_lines_groups.csv"))
+        # when streaming the invoices in small chunks
+        ret: BatchInvoiceStats = self.__process(chunkSize=2, jobs=1)
+        # then the groups are the same
+        chunked: pd.DataFrame = pd.read_csv(os.path.join(self.__testTempDirPath, "std_multiple_lines_groups.csv"))
+        pd.testing.assert_frame_equal(chunked, whole)
+        self.assertEqual(ret.merged.parsedLines, 9)
+
+    def test_process_single_invoice_in_parallel(self) -> None:
+        # given the groups of an invoice processed by a single job
+        path: str = os.path.join(CliTestConstants.PATH_TO_FIXTURES, "std_multiple_lines.csv")
+        InvoicePipeline(self.repo, self.chain, outputDirPath=self.__testTempDirPath).processInvoices(path)
+        serial: pd.DataFrame = pd.read_csv(os.path.join(self.__testTempDirPath, "std_multiple_lines_groups.csv"))
+        # when the lone invoice is spread over several processes in small chunks
+        ret: BatchInvoiceStats = InvoicePipeline(
+            self.repo, self.chain, outputDirPath=self.__testTempDirPath, jobs=2, chunkSize=2
+        ).processInvoices(path)
+        # then the groups are the same
+        parallel: pd.DataFrame = pd.read_csv(os.path.join(self.__testTempDirPath, "std_multiple_lines_groups.csv"))
+        pd.testing.assert_frame_equal(parallel, serial)
+        self.assertEqual(ret.merged.parsedLines, 7)
+
+    def test_process_failure(self) -> None:
+        # given a writer failing on one of the invoices
+        writer: FailingWriter = FailingWriter("std_mandatory_groups")
+        pipeline: InvoicePipeline = InvoicePipeline(self.repo, self.chain, writer, self.__testTempDirPath, jobs=2)
+        # when processing the fixtures
+        ret: BatchInvoiceStats = pipeline.processInvoices(CliTestConstants.PATH_TO_FIXTURES)
+        # then the failing invoice is reported and the others are processed
+        self.assertEqual([os.path.basename(f) for f in ret.failed], ["std_mandatory.csv"])
+        self.assertEqual(len(ret.perFile), 2)
+        self.assertTrue(os.path.isfile(os.path.join(self.__testTempDirPath, "summary.csv")))
+
+
+class FailingWriter(InvoiceWriter):
+    def __init__(self, failingName: str) -> None:
+        super().__init__()
+        self.failingName = failingName
+
+    def write(self, table: pd.DataFrame, outputFilePath: str) -> None:
+        if os.path.basename(outputFilePath).startswith(self.failingName + "."):
+            raise OSError("cannot write " + outputFilePath)
+        super().write(table, outputFilePath)
+
+
+class TestInvoiceCommandLine(unittest.TestCase):
+
+    __testTempDirPath: str
+
+    def setUp(self):
+        self.__testTempDirPath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__testTempDirPath)
+
+    def __run(self, argv: list) -> tuple:
+        out: io.StringIO = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            code: int = InvoiceCommandLine().run(argv)
+        return code, out.getvalue()
+
+    def test_run(self) -> None:
+        # when running the command line on the fixtures with a json output and a cache
+        code, out = self.__run(
+            [
+                CliTestConstants.PATH_TO_FIXTURES,
+                "-o",
+                os.path.join(self.__testTempDirPath, "out"),
+                "-f",
+                "json",
+                "-j",
+                "2",
+                "--cache-dir",
+                os.path.join(self.__testTempDirPath, "cache"),
+                "--mapper",
+                CliTestConstants.MAPPERS[0],
+            ]
+        )
+        # then the run succeeds and the reports are written
+        self.assertEqual(code, 0)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.__testTempDirPath, "out"))),
+            ["std_mandatory_and_optional_groups.json", "std_mandatory_groups.json", "std_multiple_lines_groups.json", "summary.json"],
+        )
+        self.assertTrue(len(os.listdir(os.path.join(self.__testTempDirPath, "cache"))) > 0)
+        # and the timing summary is printed
+        self.assertIn("processed 3 invoices, 1 not compliant, 0 failed, 9 lines", out)
+        self.assertEqual([line.split()[0] for line in out.splitlines()[1:]], ["stage", "pick", "load", "parse", "write", "wall"])
+
+    def test_run_single_invoice_in_parallel_with_cache(self) -> None:
+        # when running the command line on a lone invoice with several jobs and a cache
+        code, out = self.__run(
+            [
+                os.path.join(CliTestConstants.PATH_TO_FIXTURES, "std_multiple_lines.csv"),
+                "-o",
+                os.path.join(self.__testTempDirPath, "out"),
+                "-j",
+                "2",
+                "--cache-dir",
+                os.path.join(self.__testTempDirPath, "cache"),
+                "--mapper",
+                CliTestConstants.MAPPERS[0],
+            ]
+        )
+        # then the invoice is loaded through the cache before being spread over processes
+        self.assertEqual(code, 0)
+        self.assertIn("processed 1 invoices, 0 not compliant, 0 failed, 7 lines", out)
+        self.assertEqual(len(os.listdir(os.path.join(self.__testTempDirPath, "cache"))), 1)
+
+    def test_run_not_compliant(self) -> None:
+        # when no invoice can be processed
+        code, out = self.__run(
+            [os.path.join(CliTestConstants.PATH_TO_FIXTURES, "std_not_compliant.csv"), "-o", self.__testTempDirPath]
+        )
+        # then the run fails
+        self.assertEqual(code, 1)
+
+    def test_invalid_options(self) -> None:
+        # when the options are out of range
+        # then the command line exits with a usage error
+        with contextlib.redirect_stderr(io.StringIO()):
+            for argv in [["-j", "0", "x.csv"], ["--chunk-size", "-1", "x.csv"], ["-f", "xml", "x.csv"]]:
+                with self.assertRaises(SystemExit):
+                    self.__run(argv)
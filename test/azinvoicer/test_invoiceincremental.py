@@ -0,0 +1,196 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from azinvoicer.invoice_incremental import IncrementalInvoiceProcessor, InvoiceCheckpointStore, InvoiceCheckpoint
+from azinvoicer.invoice_reader import InvoiceLoader, InvoiceParser, InvoiceStats
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel
+from azinvoicer.invoice_mappers import BasicRGMapper
+
+
+class IncrementalTestConstants(object):
+    FILE_DATA_STD_MULTIPLE_LINES = "./test/azinvoicer/fixtures/invoices/std_multiple_lines.csv"
+    FILE_MODEL_STD = "./azinvoicer/models/in/standard.yaml"
+
+
+class AppendingLoader(InvoiceLoader):
+    """appends lines to the invoice right before it is read, as an exporter still writing it would"""
+
+    def __init__(self, invoicePath: str, appended: bytes) -> None:
+        super().__init__()
+        self.invoicePath = invoicePath
+        self.appended = appended
+
+    def loadInvoiceFrom(self, level, model, invoiceFilePath, byteOffset, header, byteEnd=None):
+        with open(self.invoicePath, "ab") as f:
+            f.write(self.appended)
+        self.appended = b""
+        return super().loadInvoiceFrom(level, model, invoiceFilePath, byteOffset, header, byteEnd)
+
+
+class TestIncrementalInvoiceProcessor(unittest.TestCase):
+
+    __testTempDirPath: str
+
+    def setUp(self):
+        self.__testTempDirPath = tempfile.mkdtemp()
+        self.invoicePath: str = os.path.join(self.__testTempDirPath, "invoice.csv")
+        shutil.copyfile(IncrementalTestConstants.FILE_DATA_STD_MULTIPLE_LINES, self.invoicePath)
+        with open(self.invoicePath, "rb") as f:
+            self.lines: list = f.read().splitlines(keepends=True)
+        self.model: MappingModel = MappingModel(IncrementalTestConstants.FILE_MODEL_STD)
+        self.level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        self.store: InvoiceCheckpointStore = InvoiceCheckpointStore(os.path.join(self.__testTempDirPath, "checkpoints"))
+        self.processor: IncrementalInvoiceProcessor = IncrementalInvoiceProcessor(self.store)
+
+    def process(self) -> InvoiceStats:
+        return self.processor.processInvoice(self.level, self.model, BasicRGMapper(), self.invoicePath)
+
+    def parseWhole(self) -> InvoiceStats:
+        table = InvoiceLoader().loadInvoice(self.level, self.model, self.invoicePath)
+        return InvoiceParser().parseInputTableAndAddEnv(self.level, self.model, BasicRGMapper(), table)
+
+    def ensure_sameAsWhole(self, ret: InvoiceStats) -> None:
+        whole: InvoiceStats = self.parseWhole()
+        self.assertEqual(ret.parsedLines, whole.parsedLines)
+        self.assertEqual(ret.parsedLinesWithoutEnv, whole.parsedLinesWithoutEnv)
+        self.assertAlmostEqual(ret.totalBilled, whole.totalBilled)
+        self.assertAlmostEqual(ret.totalBilledEnvs, whole.totalBilledEnvs)
+        self.assertEqual(ret.startDate, whole.startDate)
+        self.assertEqual(ret.endDate, whole.endDate)
+        self.assertEqual(ret.billedDays, whole.billedDays)
+        self.assertEqual(ret.currency, whole.currency)
+
+    def test_first_run_records_checkpoint(self) -> None:
+        # given an invoice never processed before
+        self.assertIsNone(self.store.get(self.invoicePath))
+        # when processed
+        ret: InvoiceStats = self.process()
+        # then the whole invoice is parsed
+        self.assertEqual(len(ret.data.index), 7)
+        self.ensure_sameAsWhole(ret)
+        # and a checkpoint is recorded
+        checkpoint: InvoiceCheckpoint = self.store.get(self.invoicePath)
+        self.assertEqual(checkpoint.rowCount, 7)
+        self.assertEqual(checkpoint.byteOffset, os.path.getsize(self.invoicePath))
+        self.assertEqual(checkpoint.parsedLines, 7)
+
+    def test_appended_lines_only(self) -> None:
+        # given an invoice already processed
+        self.process()
+        # when two lines are appended and the invoice is processed again
+        with open(self.invoicePath, "ab") as f:
+            f.write(self.lines[1])
+            f.write(self.lines[3])
+        ret: InvoiceStats = self.process()
+        # then only the new lines are parsed
+        self.assertEqual(len(ret.data.index), 2)
+        # and the stats are the ones of the whole invoice
+        self.ensure_sameAsWhole(ret)
+        self.assertEqual(self.store.get(self.invoicePath).rowCount, 9)
+
+    def test_lines_appended_while_reading(self) -> None:
+        # given lines appended between the size check and the read, the last one still incomplete
+        size: int = os.path.getsize(self.invoicePath)
+        appended: bytes = self.lines[1] + self.lines[3].rstrip(b"\r\n")
+        processor: IncrementalInvoiceProcessor = IncrementalInvoiceProcessor(
+            self.store, loader=AppendingLoader(self.invoicePath, appended)
+        )
+        # when the invoice is processed
+        first: InvoiceStats = processor.processInvoice(self.level, self.model, BasicRGMapper(), self.invoicePath)
+        # then only the lines present at the size check are parsed and checkpointed
+        self.assertEqual(first.parsedLines, 7)
+        self.assertEqual(self.store.get(self.invoicePath).byteOffset, size)
+
+        # when the incomplete line is completed and the invoice processed again
+        with open(self.invoicePath, "ab") as f:
+            f.write(b"\n")
+        ret: InvoiceStats = self.process()
+        # then each appended line is parsed exactly once
+        self.assertEqual(len(ret.data.index), 2)
+        self.ensure_sameAsWhole(ret)
+        self.assertEqual(self.store.get(self.invoicePath).rowCount, 9)
+
+    def test_incomplete_line_left_for_next_run(self) -> None:
+        # given an invoice already processed
+        self.process()
+        # when a line is being appended but is not complete yet
+        with open(self.invoicePath, "ab") as f:
+            f.write(self.lines[1][:20])
+        ret: InvoiceStats = self.process()
+        # then it is not parsed
+        self.assertEqual(len(ret.data.index), 0)
+        self.assertEqual(ret.parsedLines, 7)
+
+    def test_nothing_appended(self) -> None:
+        # given an invoice already processed
+        self.process()
+        # when processed again without any change
+        ret: InvoiceStats = self.process()
+        # then no line is parsed and the stats are unchanged
+        self.assertEqual(len(ret.data.index), 0)
+        self.ensure_sameAsWhole(ret)
+
+    def test_changed_prefix(self) -> None:
+        # given an invoice already processed
+        self.process()
+        # when an already parsed line changes and a line is appended
+        with open(self.invoicePath, "wb") as f:
+            f.write(self.lines[0])
+            f.write(self.lines[1].replace(b",12.5,", b",42.5,"))
+            for line in self.lines[2:]:
+                f.write(line)
+            f.write(self.lines[2])
+        ret: InvoiceStats = self.process()
+        # then the whole invoice is parsed again
+        self.assertEqual(len(ret.data.index), 8)
+        self.ensure_sameAsWhole(ret)
+
+    def writeLargeInvoice(self, repeat: int) -> None:
+        # a prefix larger than what the sampled check reads
+        with open(self.invoicePath, "wb") as f:
+            f.write(self.lines[0])
+            for i in range(repeat):
+                for line in self.lines[1:]:
+                    f.write(line)
+
+    def changeMiddleCost(self) -> None:
+        with open(self.invoicePath, "rb") as f:
+            content: bytes = f.read()
+        middle: int = content.index(b",12.5,", len(content) // 2)
+        end: int = middle + len(b",12.5,")
+        with open(self.invoicePath, "wb") as f:
+            f.write(content[:middle] + b",42.5," + content[end:])
+
+    def test_changed_middle_of_large_prefix(self) -> None:
+        # given a large invoice already processed
+        self.writeLargeInvoice(1000)
+        self.assertGreater(os.path.getsize(self.invoicePath), 4 * IncrementalInvoiceProcessor.SAMPLE_SIZE)
+        self.process()
+        # when a cost in the middle of the parsed lines changes without changing the size
+        self.changeMiddleCost()
+        ret: InvoiceStats = self.process()
+        # then the whole invoice is parsed again
+        self.assertEqual(len(ret.data.index), 7000)
+        self.ensure_sameAsWhole(ret)
+
+    def test_sampled_prefix_check(self) -> None:
+        # given a processor only sampling the prefix and a large invoice already processed
+        self.processor = IncrementalInvoiceProcessor(self.store, sampledPrefixCheck=True)
+        self.writeLargeInvoice(1000)
+        self.process()
+        # when a line is appended
+        with open(self.invoicePath, "ab") as f:
+            f.write(self.lines[5])
+        ret: InvoiceStats = self.process()
+        # then only that line is parsed
+        self.assertEqual(len(ret.data.index), 1)
+        self.ensure_sameAsWhole(ret)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.__testTempDirPath)
+
+
+if __name__ == "__main__":
+    unittest.main()
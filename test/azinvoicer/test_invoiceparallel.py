@@ -0,0 +1,93 @@
+import unittest
+import pandas as pd
+
+from azinvoicer.invoice_parallel import ParallelInvoiceParser
+from azinvoicer.invoice_reader import InvoiceLoader, InvoiceParser, InvoiceStats
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel
+from azinvoicer.invoice_mapperchain import MapperChain
+from azinvoicer.invoice_record import GroupedInvoiceStats
+
+
+class ParallelTestConstants(object):
+    FILE_DATA_STD_MULTIPLE_LINES = "./test/azinvoicer/fixtures/invoices/std_multiple_lines.csv"
+    FILE_MODEL_STD = "./azinvoicer/models/in/standard.yaml"
+    MAPPERS = ["azinvoicer.invoice_mappers:BasicRGMapper", "azinvoicer.invoice_mappers:SingleEnvironnementMapper"]
+
+
+class TestParallelInvoiceParser(unittest.TestCase):
+    def setUp(self):
+        self.model: MappingModel = MappingModel(ParallelTestConstants.FILE_MODEL_STD)
+        self.level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        self.chain: MapperChain = MapperChain(ParallelTestConstants.MAPPERS)
+        self.table: pd.DataFrame = InvoiceLoader().loadInvoice(
+            self.level, self.model, ParallelTestConstants.FILE_DATA_STD_MULTIPLE_LINES
+        )
+        self.serial: InvoiceStats = InvoiceParser().parseInputTableAndAddEnv(self.level, self.model, self.chain, self.table)
+
+    def ensure_sameAsSerial(self, ret: InvoiceStats) -> None:
+        self.assertEqual(ret.startDate, self.serial.startDate)
+        self.assertEqual(ret.endDate, self.serial.endDate)
+        self.assertEqual(ret.parsedLines, self.serial.parsedLines)
+        self.assertEqual(ret.parsedLinesWithoutEnv, self.serial.parsedLinesWithoutEnv)
+        self.assertAlmostEqual(ret.totalBilled, self.serial.totalBilled)
+        self.assertAlmostEqual(ret.totalBilledEnvs, self.serial.totalBilledEnvs)
+        self.assertEqual(ret.currency, self.serial.currency)
+        self.assertEqual(ret.billedDays, self.serial.billedDays)
+        pd.testing.assert_frame_equal(ret.data, self.serial.data)
+
+    def test_parallel_file(self) -> None:
+        # given a parallel parser using 2 processes and tiny chunks
+        parser: ParallelInvoiceParser = ParallelInvoiceParser(jobs=2, chunkSize=2)
+        # when the invoice file is parsed
+        ret: InvoiceStats = parser.parseInvoiceAndAddEnv(
+            self.level, self.model, self.chain, ParallelTestConstants.FILE_DATA_STD_MULTIPLE_LINES
+        )
+        # then the result is the same as the serial one
+        self.ensure_sameAsSerial(ret)
+
+    def test_parallel_table(self) -> None:
+        # given a parallel parser using 3 processes
+        parser: ParallelInvoiceParser = ParallelInvoiceParser(jobs=3, chunkSize=3)
+        # when an already loaded table is parsed
+        ret: InvoiceStats = parser.parseInputTableAndAddEnv(self.level, self.model, self.chain, self.table)
+        # then the result is the same as the serial one
+        self.ensure_sameAsSerial(ret)
+
+    def test_single_job(self) -> None:
+        # given a parallel parser using a single job
+        parser: ParallelInvoiceParser = ParallelInvoiceParser(jobs=1, chunkSize=4)
+        # when an already loaded table is parsed
+        ret: InvoiceStats = parser.parseInputTableAndAddEnv(self.level, self.model, self.chain, self.table)
+        # then the result is the same as the serial one
+        self.assertEqual(parser.getJobs(), 1)
+        self.ensure_sameAsSerial(ret)
+
+    def test_parallel_group(self) -> None:
+        # given the groups computed on a single process
+        serial: GroupedInvoiceStats = InvoiceParser().readAndGroup(self.level, self.model, self.chain, self.table)
+        # when the invoice file is grouped by 2 processes in tiny chunks
+        ret: GroupedInvoiceStats = ParallelInvoiceParser(jobs=2, chunkSize=2).readAndGroupInvoice(
+            self.level, self.model, self.chain, ParallelTestConstants.FILE_DATA_STD_MULTIPLE_LINES
+        )
+        # then the groups and the stats are the same
+        pd.testing.assert_frame_equal(ret.groups, serial.groups)
+        self.assertEqual(ret.stats.parsedLines, serial.stats.parsedLines)
+        self.assertEqual(ret.stats.parsedLinesWithoutEnv, serial.stats.parsedLinesWithoutEnv)
+        self.assertAlmostEqual(ret.stats.totalBilled, serial.stats.totalBilled)
+
+    def test_adaptive_stats_merged(self) -> None:
+        # given two adaptive chains, one fed on a single process with the same chunks
+        chunks: list = [self.table.iloc[0:2], self.table.iloc[2:4], self.table.iloc[4:6], self.table.iloc[6:]]
+        serialChain: MapperChain = MapperChain(ParallelTestConstants.MAPPERS, adaptive=True)
+        InvoiceParser().readAndGroup(self.level, self.model, serialChain, chunks)
+        parallelChain: MapperChain = MapperChain(ParallelTestConstants.MAPPERS, adaptive=True)
+        # when the other one groups the invoice on 2 processes
+        ParallelInvoiceParser(jobs=2, chunkSize=2).readAndGroupChunks(self.level, self.model, parallelChain, chunks)
+        # then the stats measured by the workers are merged back into the parent chain
+        learned: list = [(r.lines, r.hits) for r in parallelChain.getMapperStats()]
+        self.assertEqual(learned, [(r.lines, r.hits) for r in serialChain.getMapperStats()])
+        self.assertGreater(learned[0][0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,17 +4,22 @@ import pandas as pd
 from azinvoicer.helpers import DateHelper
 
 from azinvoicer.invoice_reader import (
+    CsvEngine,
     InvoiceLoader,
     InvoiceParser,
     InvoiceStats,
+    ParsingMode,
 )
 from azinvoicer.invoice_model import (
     ModelComplianceLevel,
     MappingModel,
+    MandatoryFields,
     OptionFlags,
     OutputModel,
 )
-from azinvoicer.invoice_mappers import EnvironnementMapper, BasicRGMapper, Environnement
+from azinvoicer.invoice_record import GroupedInvoiceStats
+from azinvoicer.invoice_mappers import EnvironnementMapper, BasicRGMapper, Environnement, SingleEnvironnementMapper
+from azinvoicer.invoice_mapperchain import MapperChain, MapperCacheStats
 
 
 class TestInvoiceLoaderConstants(object):
@@ -25,6 +30,9 @@ class TestInvoiceLoaderConstants(object):
     FILE_DATA_STD_MANDATORY_ONLY = (
         "./test/azinvoicer/fixtures/invoices/std_mandatory.csv"
     )
+    FILE_DATA_STD_MULTIPLE_LINES = (
+        "./test/azinvoicer/fixtures/invoices/std_multiple_lines.csv"
+    )
     FILE_MODEL_STD = "./azinvoicer/models/in/standard.yaml"
 
 
@@ -82,6 +90,67 @@ class TestInvoiceLoader(unittest.TestCase):
         for c in model.getOptionalColumnNames():
             self.assertNotIn(c, table.columns)
 
+    def test_loading_with_pyarrow_engine(self) -> None:
+        # given the standard model declaring column types
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+
+        # when the same file is loaded with the default engine and the pyarrow one (if installed)
+        default: pd.DataFrame = InvoiceLoader().loadInvoice(
+            level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES
+        )
+        fast: pd.DataFrame = InvoiceLoader(engine=CsvEngine.PYARROW).loadInvoice(
+            level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES
+        )
+
+        # then the declared types are used
+        self.assertEqual(default["CostInBillingCurrency"].dtype, "float64")
+        self.assertEqual(default["Location"].dtype, object)
+        # and both tables hold the same data
+        pd.testing.assert_frame_equal(default, fast[default.columns])
+
+    def test_loading_categorical(self) -> None:
+        # given the standard model
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        # and an invoice loader producing dictionary encoded columns
+        loader: InvoiceLoader = InvoiceLoader(categorical=True)
+
+        # when the invoice is loaded
+        table: pd.DataFrame = loader.loadInvoice(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL,
+            model,
+            TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES,
+        )
+
+        # then the low cardinality columns are categorical
+        for f in MandatoryFields.CATEGORICAL_FIELDS:
+            self.assertIsInstance(table[model.getMandatoryColumnName(f)].dtype, pd.CategoricalDtype)
+        # and the other ones are not
+        self.assertNotIsInstance(table[model.getMandatoryColumnName(MandatoryFields.TAGS)].dtype, pd.CategoricalDtype)
+        self.assertEqual(table[model.getMandatoryColumnName(MandatoryFields.BILLED_COST)].dtype, "float64")
+
+    def test_streaming_chunks(self) -> None:
+        # given the standard model
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        # and an invoicer loader
+        loader: InvoiceLoader = InvoiceLoader()
+
+        # when we stream a file of 7 lines by chunks of 3 lines
+        chunks: list = list(
+            loader.streamInvoice(
+                ModelComplianceLevel.MANDATORY_ONLY,
+                model,
+                TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES,
+                3,
+            )
+        )
+
+        # then we get bounded chunks covering all the lines
+        self.assertEqual([len(c.index) for c in chunks], [3, 3, 1])
+        # and only the mandatory columns are loaded
+        for c in chunks:
+            self.assertEqual(sorted(c.columns), sorted(model.getMandatoryColumnNames()))
+
 
 class TestInvoiceParser(unittest.TestCase):
     def test_invoice_parse_add_env(self) -> None:
@@ -126,6 +195,250 @@ class TestInvoiceParser(unittest.TestCase):
             str(Environnement.TEST.name),
         )
 
+    def test_invoice_parse_columns_same_as_rows(self) -> None:
+        # given an std mapping model
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        # and an invoice table with several lines loaded by the loader
+        loader: InvoiceLoader = InvoiceLoader()
+        invoiceTable: pd.DataFrame = loader.loadInvoice(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL,
+            model,
+            TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES,
+        )
+        mapper: EnvironnementMapper = BasicRGMapper()
+
+        # when the invoice is parsed both by rows and by columns
+        byRows: InvoiceStats = InvoiceParser(ParsingMode.ROWS).parseInputTableAndAddEnv(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, mapper, invoiceTable
+        )
+        byColumns: InvoiceStats = InvoiceParser(ParsingMode.COLUMNS).parseInputTableAndAddEnv(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, mapper, invoiceTable
+        )
+
+        # then the stats are identical
+        self.assertEqual(byColumns.startDate, byRows.startDate)
+        self.assertEqual(byColumns.endDate, byRows.endDate)
+        self.assertEqual(byColumns.parsedLines, 7)
+        self.assertEqual(byColumns.parsedLines, byRows.parsedLines)
+        self.assertEqual(byColumns.parsedLinesWithoutEnv, 2)
+        self.assertEqual(byColumns.parsedLinesWithoutEnv, byRows.parsedLinesWithoutEnv)
+        self.assertAlmostEqual(byColumns.totalBilled, byRows.totalBilled)
+        self.assertAlmostEqual(byColumns.totalBilledEnvs, byRows.totalBilledEnvs)
+        self.assertEqual(byColumns.currency, byRows.currency)
+        self.assertEqual(byColumns.billedDays, byRows.billedDays)
+
+        # and so is the data table
+        pd.testing.assert_frame_equal(byColumns.data, byRows.data)
+
+    def test_invoice_parse_distinct_keys(self) -> None:
+        # given an invoice with a resource group name repeated on several lines
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        invoiceTable: pd.DataFrame = InvoiceLoader().loadInvoice(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL,
+            model,
+            TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES,
+        )
+        parser: InvoiceParser = InvoiceParser(ParsingMode.COLUMNS)
+
+        # when parsed with a mapper only depending on the resource group name
+        byRg: InvoiceStats = parser.parseInputTableAndAddEnv(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, BasicRGMapper(), invoiceTable
+        )
+        # then the mapper ran once per distinct resource group name
+        self.assertEqual(byRg.mappedKeys, 6)
+        self.assertAlmostEqual(byRg.getDistinctKeyRatio(), 6 / 7)
+        # and the decisions were broadcast back to every line
+        envs: pd.Series = byRg.data[OutputModel.getColumName(OutputModel.ENV_FIELD)]
+        self.assertEqual(envs.iloc[0], Environnement.PROD.name)
+        self.assertEqual(envs.iloc[5], Environnement.PROD.name)
+
+        # when parsed with a mapper depending on no input at all
+        single: InvoiceStats = parser.parseInputTableAndAddEnv(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, SingleEnvironnementMapper(), invoiceTable
+        )
+        # then it ran only once
+        self.assertEqual(single.mappedKeys, 1)
+        self.assertEqual(single.parsedLinesWithoutEnv, 0)
+
+    def test_invoice_parse_columns_mapper_cache(self) -> None:
+        # given a chain caching its decisions
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        invoiceTable: pd.DataFrame = InvoiceLoader().loadInvoice(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL,
+            model,
+            TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES,
+        )
+        chain: MapperChain = MapperChain(["azinvoicer.invoice_mappers:BasicRGMapper"], cacheSize=16)
+        parser: InvoiceParser = InvoiceParser(ParsingMode.COLUMNS)
+
+        # when the same invoice is parsed twice
+        first: InvoiceStats = parser.parseInputTableAndAddEnv(ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, chain, invoiceTable)
+        stats: MapperCacheStats = chain.getCacheStats()
+        # then the distinct resource groups are cached by the first parse
+        self.assertEqual((stats.size, stats.hits, stats.misses), (6, 0, 6))
+        second: InvoiceStats = parser.parseInputTableAndAddEnv(ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, chain, invoiceTable)
+        # and answered from the cache by the second one
+        stats = chain.getCacheStats()
+        self.assertEqual((stats.size, stats.hits, stats.misses), (6, 6, 6))
+        envField: str = OutputModel.getColumName(OutputModel.ENV_FIELD)
+        self.assertEqual(second.data[envField].tolist(), first.data[envField].tolist())
+        self.assertEqual(second.parsedLinesWithoutEnv, first.parsedLinesWithoutEnv)
+
+        # when the cache is smaller than the number of distinct keys
+        small: MapperChain = MapperChain(["azinvoicer.invoice_mappers:BasicRGMapper"], cacheSize=4)
+        parser.parseInputTableAndAddEnv(ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, small, invoiceTable)
+        # then the least recently used decisions are evicted
+        self.assertEqual((small.getCacheStats().size, small.getCacheStats().evictions), (4, 2))
+
+    def test_invoice_parse_chunks(self) -> None:
+        # given an std mapping model
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        loader: InvoiceLoader = InvoiceLoader()
+        mapper: EnvironnementMapper = BasicRGMapper()
+        parser: InvoiceParser = InvoiceParser()
+        # and the stats of the whole invoice table
+        whole: InvoiceStats = parser.parseInputTableAndAddEnv(
+            level,
+            model,
+            mapper,
+            loader.loadInvoice(level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES),
+        )
+
+        # when the same invoice is streamed and parsed by chunks of 2 lines
+        chunks = loader.streamInvoice(level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES, 2)
+        streamed: InvoiceStats = parser.parseInputChunksAndAddEnv(level, model, mapper, chunks, keepData=True)
+
+        # then the stats are identical
+        self.assertEqual(streamed.startDate, whole.startDate)
+        self.assertEqual(streamed.endDate, whole.endDate)
+        self.assertEqual(streamed.parsedLines, whole.parsedLines)
+        self.assertEqual(streamed.parsedLinesWithoutEnv, whole.parsedLinesWithoutEnv)
+        self.assertAlmostEqual(streamed.totalBilled, whole.totalBilled)
+        self.assertAlmostEqual(streamed.totalBilledEnvs, whole.totalBilledEnvs)
+        self.assertEqual(streamed.currency, whole.currency)
+        self.assertEqual(streamed.billedDays, whole.billedDays)
+        # and so is the data table
+        pd.testing.assert_frame_equal(streamed.data, whole.data)
+
+    def test_invoice_parse_chunks_without_data(self) -> None:
+        # given an std mapping model and a streamed invoice
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        chunks = InvoiceLoader().streamInvoice(level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES, 2)
+
+        # when the chunks are parsed without keeping the data
+        ret: InvoiceStats = InvoiceParser().parseInputChunksAndAddEnv(level, model, BasicRGMapper(), chunks)
+
+        # then only the running totals are provided
+        self.assertEqual(ret.parsedLines, 7)
+        self.assertEqual(ret.parsedLinesWithoutEnv, 2)
+        self.assertIsNone(ret.data)
+
+    def test_read_and_group(self) -> None:
+        # given an std mapping model and an invoice with several lines
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        loader: InvoiceLoader = InvoiceLoader()
+        invoiceTable: pd.DataFrame = loader.loadInvoice(
+            level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES
+        )
+        parser: InvoiceParser = InvoiceParser()
+
+        # when the invoice is grouped both from the table and from streamed chunks
+        fromTable: GroupedInvoiceStats = parser.readAndGroup(level, model, BasicRGMapper(), invoiceTable)
+        fromChunks: GroupedInvoiceStats = parser.readAndGroup(
+            level,
+            model,
+            BasicRGMapper(),
+            loader.streamInvoice(level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES, 2),
+        )
+
+        # then the costs are rolled up by env, service family, category and currency
+        groups: pd.DataFrame = fromTable.groups
+        self.assertEqual(len(groups.index), 6)
+        prod = groups[groups[OutputModel.getColumName(OutputModel.ENV_FIELD)] == Environnement.PROD.name]
+        self.assertEqual(prod[OutputModel.getColumName(MandatoryFields.BILLED_COST)].tolist(), [25.0])
+        self.assertEqual(prod[InvoiceParser.LINES_FIELD].tolist(), [2])
+        self.assertEqual(groups[InvoiceParser.LINES_FIELD].sum(), 7)
+        # and the stats are provided without any per line data
+        self.assertEqual(fromTable.stats.parsedLines, 7)
+        self.assertEqual(fromTable.stats.parsedLinesWithoutEnv, 2)
+        self.assertAlmostEqual(fromTable.stats.totalBilled, 34.625)
+        self.assertIsNone(fromTable.stats.data)
+        # and both inputs give the same groups
+        pd.testing.assert_frame_equal(fromChunks.groups, fromTable.groups)
+
+    def test_invoice_parse_categorical(self) -> None:
+        # given an std mapping model
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        mapper: EnvironnementMapper = BasicRGMapper()
+        # and the plain parsing of an invoice
+        plain: InvoiceStats = InvoiceParser().parseInputTableAndAddEnv(
+            level,
+            model,
+            mapper,
+            InvoiceLoader().loadInvoice(level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES),
+        )
+
+        # when the invoice is loaded and parsed using dictionary encoded columns
+        for mode in ParsingMode:
+            table: pd.DataFrame = InvoiceLoader(categorical=True).loadInvoice(
+                level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES
+            )
+            encoded: InvoiceStats = InvoiceParser(mode, categorical=True).parseInputTableAndAddEnv(
+                level, model, mapper, table
+            )
+
+            # then the low cardinality output columns are categorical
+            for c in ["Environnement", "ServiceFamily", "ServiceCategory", "SkuName", "Currency"]:
+                self.assertIsInstance(encoded.data[c].dtype, pd.CategoricalDtype)
+                # and hold the same values as the plain ones
+                self.assertEqual(encoded.data[c].astype(object).tolist(), plain.data[c].tolist())
+            self.assertEqual(encoded.parsedLinesWithoutEnv, plain.parsedLinesWithoutEnv)
+            self.assertAlmostEqual(encoded.totalBilled, plain.totalBilled)
+
+    def test_invoice_parse_chunks_categorical(self) -> None:
+        # given an std mapping model and an invoice streamed with dictionary encoded columns
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        chunks = InvoiceLoader(categorical=True).streamInvoice(
+            level, model, TestInvoiceLoaderConstants.FILE_DATA_STD_MULTIPLE_LINES, 2
+        )
+
+        # when the chunks are parsed and the data is kept
+        ret: InvoiceStats = InvoiceParser(categorical=True).parseInputChunksAndAddEnv(
+            level, model, BasicRGMapper(), chunks, keepData=True
+        )
+
+        # then the merged data is still dictionary encoded
+        self.assertEqual(len(ret.data.index), 7)
+        self.assertIsInstance(ret.data["ServiceFamily"].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(ret.data["Environnement"].dtype, pd.CategoricalDtype)
+
+    def test_invoice_parse_columns_empty_table(self) -> None:
+        # given an std mapping model
+        model: MappingModel = MappingModel(TestInvoiceLoaderConstants.FILE_MODEL_STD)
+        # and an invoice table without any line
+        loader: InvoiceLoader = InvoiceLoader()
+        invoiceTable: pd.DataFrame = loader.loadInvoice(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL,
+            model,
+            TestInvoiceLoaderConstants.FILE_DATA_STD_MANDATORY_AND_OPTIONAL,
+        ).iloc[0:0]
+
+        # when the invoice is parsed by columns
+        ret: InvoiceStats = InvoiceParser(ParsingMode.COLUMNS).parseInputTableAndAddEnv(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, BasicRGMapper(), invoiceTable
+        )
+
+        # then nothing was parsed
+        self.assertEqual(ret.parsedLines, 0)
+        self.assertEqual(ret.totalBilled, 0)
+        self.assertEqual(len(ret.data.index), 0)
+        self.assertIsNone(ret.currency)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import datetime
+import pandas as pd
+
+from azinvoicer.invoice_record import InvoiceStats, InvoiceStatsAccumulator
+
+
+class InvoiceStatsFixtures(object):
+    @classmethod
+    def build(cls, start: str, end: str, lines: int, withoutEnv: int, billed: float, billedEnvs: float) -> InvoiceStats:
+        startDate = datetime.datetime.strptime(start, "%m/%d/%Y")
+        endDate = datetime.datetime.strptime(end, "%m/%d/%Y")
+        return InvoiceStats(
+            startDate=startDate,
+            endDate=endDate,
+            parsedLines=lines,
+            parsedLinesWithoutEnv=withoutEnv,
+            totalBilled=billed,
+            totalBilledEnvs=billedEnvs,
+            currency="EUR",
+            billedDays=(endDate - startDate).days,
+            data=pd.DataFrame({"Cost": [billed / lines] * lines}),
+        )
+
+
+class TestInvoiceStatsAccumulator(unittest.TestCase):
+    def test_fold_totals_and_dates(self) -> None:
+        # given two partial stats of the same invoice
+        first: InvoiceStats = InvoiceStatsFixtures.build("01/01/2023", "01/31/2023", 2, 1, 4.0, 2.0)
+        second: InvoiceStats = InvoiceStatsFixtures.build("12/15/2022", "01/20/2023", 3, 0, 3.0, 3.0)
+        # and an accumulator keeping the data
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(keepData=True)
+
+        # when both are folded
+        accumulator.fold(first)
+        accumulator.fold(second)
+        ret: InvoiceStats = accumulator.getStats()
+
+        # then the totals are summed up
+        self.assertEqual(ret.parsedLines, 5)
+        self.assertEqual(ret.parsedLinesWithoutEnv, 1)
+        self.assertEqual(ret.totalBilled, 7.0)
+        self.assertEqual(ret.totalBilledEnvs, 5.0)
+        self.assertEqual(ret.currency, "EUR")
+        # and the period spans both stats
+        self.assertEqual(ret.startDate, datetime.datetime(2022, 12, 15))
+        self.assertEqual(ret.endDate, datetime.datetime(2023, 1, 31))
+        self.assertEqual(ret.billedDays, 47)
+        # and the data is concatenated with a continuous index
+        self.assertEqual(len(ret.data.index), 5)
+        self.assertEqual(ret.data.index.tolist(), [0, 1, 2, 3, 4])
+
+    def test_fold_without_data(self) -> None:
+        # given an accumulator that drops the data
+        accumulator: InvoiceStatsAccumulator = InvoiceStatsAccumulator(keepData=False)
+        # when a stat is folded
+        accumulator.fold(InvoiceStatsFixtures.build("01/01/2023", "01/31/2023", 2, 0, 4.0, 4.0))
+        # then the totals are kept but not the data
+        ret: InvoiceStats = accumulator.getStats()
+        self.assertEqual(ret.parsedLines, 2)
+        self.assertIsNone(ret.data)
+
+    def test_nothing_folded(self) -> None:
+        # given an accumulator on which nothing was folded
+        ret: InvoiceStats = InvoiceStatsAccumulator().getStats()
+        # then nothing was parsed
+        self.assertEqual(ret.parsedLines, 0)
+        self.assertEqual(ret.totalBilled, 0)
+        self.assertIsNone(ret.currency)
+        self.assertIsNone(ret.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
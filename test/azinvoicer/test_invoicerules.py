@@ -0,0 +1,69 @@
+import unittest
+import pandas as pd
+
+from azinvoicer.invoice_rules import RulesMapper
+from azinvoicer.invoice_mappers import Environnement, MapperInputs
+from azinvoicer.invoice_mapperchain import MapperChain
+from azinvoicer.invoice_tagreader import TagReader
+
+
+class RulesTestConstants(object):
+    FILE_RULES = "./test/azinvoicer/fixtures/rules/test_rules.yaml"
+
+
+class TestRulesMapper(unittest.TestCase):
+    def test_rules_loading(self) -> None:
+        # when the rules file is compiled
+        mapper: RulesMapper = RulesMapper(RulesTestConstants.FILE_RULES)
+        # then the invalid rule is ignored and rules are ordered by priority
+        names: list = [r.getName() for r in mapper.getRuleSet().getRules()]
+        self.assertEqual(names, ["storage in west europe labs", "web front", "qa cost center", "labs"])
+        # and the mapper only depends on the fields used by the rules
+        self.assertEqual(
+            mapper.getInputs(),
+            [MapperInputs.SERVICE_FAMILY, MapperInputs.REGION_NAME, MapperInputs.RESOURCE_GROUP_NAME, MapperInputs.TAGS],
+        )
+
+    def test_rules_matching(self) -> None:
+        # given a rules mapper
+        mapper: RulesMapper = RulesMapper(RulesTestConstants.FILE_RULES)
+        # then exact matches are case insensitive
+        self.assertEqual(mapper.getEnvironnement("", "", "", "", "rg-web-prod", dict()), Environnement.PROD)
+        # and tags are matched either decoded or raw
+        self.assertEqual(mapper.getEnvironnement("", "", "", "", "rg", {"CostCenter": "QA"}), Environnement.TEST)
+        self.assertEqual(mapper.getEnvironnement("", "", "", "", "rg", '"costcenter": "qa"'), Environnement.TEST)
+        # and as the read only mappings shared by the tag reader
+        self.assertEqual(
+            mapper.getEnvironnement("", "", "", "", "rg", TagReader.getDictFromTags('{"CostCenter": "QA"}')), Environnement.TEST
+        )
+        # and patterns are searched
+        self.assertEqual(mapper.getEnvironnement("Compute", "", "", "westeurope", "my-lab", dict()), Environnement.SANDBOX)
+        # and the lowest priority wins when several rules match
+        self.assertEqual(mapper.getEnvironnement("Storage", "", "", "WestEurope", "my-lab", dict()), Environnement.DEMO)
+        self.assertEqual(
+            mapper.getEnvironnement("Storage", "", "", "westeurope", "rg-web-prod", {"costcenter": "qa"}),
+            Environnement.PROD,
+        )
+        # and lines matching no rule are not mapped
+        self.assertEqual(mapper.getEnvironnement("", "", "", "", float("nan"), float("nan")), Environnement.NA)
+
+    def test_default_rules(self) -> None:
+        # given the rules shipped next to the mapping models
+        mapper: RulesMapper = RulesMapper()
+        # then they map the usual environment tags
+        self.assertEqual(mapper.getEnvironnement("", "", "", "", "rg", {"Env": "Production"}), Environnement.PROD)
+
+    def test_rules_in_chain(self) -> None:
+        # given a chain using the default rules then the resource group name
+        chain: MapperChain = MapperChain(["azinvoicer.invoice_rules:RulesMapper", "azinvoicer.invoice_mappers:BasicRGMapper"])
+        names: pd.Series = pd.Series(["rg-dev", "rg-other"], dtype=object)
+        tags: pd.Series = pd.Series(['"env": "production"', ""], dtype=object)
+        empty: pd.Series = pd.Series(["", ""], dtype=object)
+        # when lines are mapped
+        envs: pd.Series = chain.getEnvironnementBatch(empty, empty, empty, empty, names, tags)
+        # then the rules take precedence
+        self.assertEqual(envs.tolist(), [Environnement.PROD, Environnement.NA])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import threading
+import urllib.request
+import urllib.error
+
+from azinvoicer.invoice_server import InvoiceServer, InvoiceService
+from azinvoicer.invoice_cli import InvoicePipeline
+from azinvoicer.invoice_model import MappingModelRepository
+from azinvoicer.invoice_mapperchain import MapperChain
+from azinvoicer.invoice_record import GroupedInvoiceStats
+from azinvoicer.invoice_reader import InvoiceLoader
+from azinvoicer.invoice_cache import InvoiceCache
+
+
+class ServerTestConstants(object):
+    PATH_TO_MODEL_REPO = "./azinvoicer/models/in"
+    PATH_TO_FIXTURES = "./test/azinvoicer/fixtures/invoices"
+    MAPPERS = ["azinvoicer.invoice_mappers:BasicRGMapper"]
+
+
+class TestInvoiceService(unittest.TestCase):
+    def setUp(self):
+        pipeline: InvoicePipeline = InvoicePipeline(
+            MappingModelRepository(ServerTestConstants.PATH_TO_MODEL_REPO), MapperChain(ServerTestConstants.MAPPERS)
+        )
+        # a single pending invoice at a time
+        self.service: InvoiceService = InvoiceService(pipeline, jobs=2, maxPending=1)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_process_in_order(self) -> None:
+        # given the fixtures, one of them missing
+        files: list = self.service.listInvoiceFiles([ServerTestConstants.PATH_TO_FIXTURES])
+        files.append(os.path.join(ServerTestConstants.PATH_TO_FIXTURES, "missing.csv"))
+        # when processing them
+        results: list = list(self.service.processInvoiceFiles(files))
+        # then the results come back in the submission order
+        self.assertEqual([path for path, result in results], files)
+        byName: dict = {os.path.basename(path): result for path, result in results}
+        self.assertIsInstance(byName["std_multiple_lines.csv"], GroupedInvoiceStats)
+        self.assertEqual(byName["std_multiple_lines.csv"].stats.parsedLines, 7)
+        self.assertIsNone(byName["std_not_compliant.csv"])
+        # and failures are returned instead of being raised
+        self.assertIsInstance(byName["missing.csv"], Exception)
+        self.assertIn("error", InvoiceService.toRecord("missing.csv", byName["missing.csv"]))
+
+    def test_root_restriction(self) -> None:
+        # given a service restricted to the fixtures directory
+        service: InvoiceService = InvoiceService(self.service.getPipeline(), rootDirPath=ServerTestConstants.PATH_TO_FIXTURES)
+        try:
+            # then the fixtures are accepted but not the models
+            self.assertEqual(len(service.listInvoiceFiles([ServerTestConstants.PATH_TO_FIXTURES])), 4)
+            with self.assertRaises(PermissionError):
+                service.listInvoiceFiles([os.path.join(ServerTestConstants.PATH_TO_MODEL_REPO, "*.yaml")])
+        finally:
+            service.shutdown()
+
+
+class TestInvoiceServer(unittest.TestCase):
+    def setUp(self):
+        # given a server listening on a free local port and caching the loaded invoices
+        self.cacheDirPath: str = tempfile.mkdtemp()
+        chain: MapperChain = MapperChain(ServerTestConstants.MAPPERS, cacheSize=128)
+        pipeline: InvoicePipeline = InvoicePipeline(
+            MappingModelRepository(ServerTestConstants.PATH_TO_MODEL_REPO),
+            chain,
+            loader=InvoiceLoader(InvoiceCache(self.cacheDirPath)),
+        )
+        self.server: InvoiceServer = InvoiceServer(
+            InvoiceService(pipeline, jobs=2, rootDirPath=ServerTestConstants.PATH_TO_FIXTURES), port=0
+        )
+        self.thread: threading.Thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.start()
+        self.url: str = "http://127.0.0.1:" + str(self.server.getPort())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.cacheDirPath)
+        self.assertFalse(os.path.exists(self.server.getUploadDirPath()))
+
+    def __post(self, path: str, body: bytes, contentType: str) -> list:
+        request = urllib.request.Request(self.url + path, data=body, headers={"Content-Type": contentType}, method="POST")
+        with urllib.request.urlopen(request) as response:
+            self.assertEqual(response.headers.get_content_type(), "application/x-ndjson")
+            return [json.loads(line) for line in response]
+
+    def __postPaths(self, paths: list) -> list:
+        return self.__post("/invoices", json.dumps({"paths": paths}).encode("utf-8"), "application/json")
+
+    def test_paths(self) -> None:
+        # when posting the fixtures directory
+        lines: list = self.__postPaths([ServerTestConstants.PATH_TO_FIXTURES])
+        # then one line is streamed per invoice then a last one
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1], {"done": True, "invoices": 4, "notCompliant": 1, "failed": 0})
+        records: dict = {os.path.basename(r["file"]): r for r in lines[:-1]}
+        self.assertFalse(records["std_not_compliant.csv"]["compliant"])
+        multiple: dict = records["std_multiple_lines.csv"]
+        self.assertEqual(multiple["stats"]["parsedLines"], 7)
+        self.assertEqual(multiple["stats"]["currency"], "EUR")
+        self.assertEqual(sum(g["Lines"] for g in multiple["groups"]), 7)
+        self.assertIn(("DEV", "Networking"), [(g["Environnement"], g["ServiceFamily"]) for g in multiple["groups"]])
+        # and the local invoices are cached
+        self.assertEqual(len(os.listdir(self.cacheDirPath)), 3)
+
+    def test_upload(self) -> None:
+        # when posting the content of an invoice
+        with open(os.path.join(ServerTestConstants.PATH_TO_FIXTURES, "std_multiple_lines.csv"), "rb") as f:
+            lines: list = self.__post("/invoices?name=december.csv", f.read(), "text/csv")
+        # then it is processed as a local invoice and the upload is removed
+        self.assertEqual(lines[0]["file"], "december.csv")
+        self.assertEqual(lines[0]["stats"]["parsedLines"], 7)
+        self.assertEqual(lines[1]["invoices"], 1)
+        self.assertEqual(os.listdir(self.server.getUploadDirPath()), [])
+        # and it leaves nothing in the cache
+        self.assertEqual(os.listdir(self.cacheDirPath), [])
+
+    def test_status(self) -> None:
+        # given an invoice processed twice
+        self.__postPaths([os.path.join(ServerTestConstants.PATH_TO_FIXTURES, "std_multiple_lines.csv")])
+        self.__postPaths([os.path.join(ServerTestConstants.PATH_TO_FIXTURES, "std_multiple_lines.csv")])
+        # when requesting the status
+        with urllib.request.urlopen(self.url + "/status") as response:
+            status: dict = json.loads(response.read())
+        # then the warm models, mappers and caches are reported
+        self.assertIn("standard", status["models"])
+        self.assertEqual(status["mappers"], ServerTestConstants.MAPPERS)
+        self.assertEqual(status["mapperCache"]["maxSize"], 128)
+        # and the second run is answered by the mapper cache
+        self.assertGreater(status["mapperCache"]["hits"], 0)
+        self.assertEqual(status["stages"]["pick"]["calls"], 2)
+
+    def test_errors(self) -> None:
+        # when sending invalid requests
+        # then they are refused with the matching status
+        for path, body, contentType, code in [
+            ("/invoices", b"{", "application/json", 400),
+            ("/invoices", b'{"paths": "x"}', "application/json", 400),
+            ("/invoices", json.dumps({"paths": [ServerTestConstants.PATH_TO_MODEL_REPO + "/*.yaml"]}).encode(), "application/json", 403),
+            ("/unknown", b"{}", "application/json", 404),
+        ]:
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                self.__post(path, body, contentType)
+            self.assertEqual(ctx.exception.code, code)
+            self.assertIn("error", json.loads(ctx.exception.read()))
+            ctx.exception.close()
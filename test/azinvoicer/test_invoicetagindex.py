@@ -0,0 +1,87 @@
+import unittest
+import os
+import shutil
+import tempfile
+import pandas as pd
+
+from azinvoicer.invoice_cache import InvoiceCache
+from azinvoicer.invoice_reader import InvoiceLoader
+from azinvoicer.invoice_model import ModelComplianceLevel, MappingModel
+from azinvoicer.invoice_tagindex import InvoiceTagIndex, InvoiceTagIndexer
+
+
+class TagIndexTestConstants(object):
+    FILE_DATA_STD_MULTIPLE_LINES = "./test/azinvoicer/fixtures/invoices/std_multiple_lines.csv"
+    FILE_MODEL_STD = "./azinvoicer/models/in/standard.yaml"
+
+
+class TestInvoiceTagIndex(unittest.TestCase):
+
+    __testTempDirPath: str
+
+    def setUp(self):
+        self.__testTempDirPath = tempfile.mkdtemp()
+        self.invoicePath: str = os.path.join(self.__testTempDirPath, "invoice.csv")
+        shutil.copyfile(TagIndexTestConstants.FILE_DATA_STD_MULTIPLE_LINES, self.invoicePath)
+        self.model: MappingModel = MappingModel(TagIndexTestConstants.FILE_MODEL_STD)
+        self.level: ModelComplianceLevel = ModelComplianceLevel.MANDATORY_AND_OPTIONAL
+        self.table: pd.DataFrame = InvoiceLoader().loadInvoice(self.level, self.model, self.invoicePath)
+
+    def tearDown(self):
+        shutil.rmtree(self.__testTempDirPath)
+
+    def test_index_from_tags(self) -> None:
+        # given tags in both quoting formats and lines without tags
+        tags: pd.Series = pd.Series(
+            ['{ ""Owner"" : ""ops"", ""Project"" : ""p1"" }', float("nan"), '"Owner": "dev"', '{ ""Owner"" : ""ops"" }'],
+            index=[7, 8, 9, 10],
+        )
+        # when indexed
+        index: InvoiceTagIndex = InvoiceTagIndex.fromTags(tags)
+        # then there is one dictionary encoded column per key
+        self.assertEqual(index.getKeys(), ["Owner", "Project"])
+        self.assertEqual(index.getLines(), 4)
+        owner: pd.Series = index.getColumn("Owner")
+        self.assertIsInstance(owner.dtype, pd.CategoricalDtype)
+        self.assertEqual(owner.isna().tolist(), [False, True, False, False])
+        self.assertEqual(owner.dropna().tolist(), ["ops", "dev", "ops"])
+        self.assertEqual(len(owner.cat.categories), 2)
+        # and lines without a key hold a missing value
+        self.assertEqual(index.getColumn("Project").isna().tolist(), [False, True, True, True])
+        self.assertTrue(index.getColumn("Unknown").isna().all())
+
+    def test_group_by(self) -> None:
+        # given the tag index of an invoice
+        index: InvoiceTagIndex = InvoiceTagIndexer().getTagIndex(self.level, self.model, self.invoicePath, self.table)
+        # when costs are grouped by a tag key
+        groups: pd.DataFrame = index.groupBy(["Owner"], self.table["CostInBillingCurrency"])
+        # then each tag value gets its cost and lines, untagged lines included
+        self.assertEqual(groups["Owner"].tolist(), ["dev.team", "ops", None])
+        self.assertEqual(groups[InvoiceTagIndex.COST_FIELD].tolist(), [0.75, 25.0, 8.875])
+        self.assertEqual(groups[InvoiceTagIndex.LINES_FIELD].tolist(), [1, 2, 4])
+
+        # when grouped by several keys
+        groups = index.groupBy(["Env", "Owner"], self.table["CostInBillingCurrency"])
+        # then every combination found is reported
+        self.assertEqual(len(groups.index), 3)
+        self.assertAlmostEqual(groups[InvoiceTagIndex.COST_FIELD].sum(), 34.625)
+
+    def test_index_cached(self) -> None:
+        # given an indexer using a cache
+        cache: InvoiceCache = InvoiceCache(os.path.join(self.__testTempDirPath, "cache"))
+        indexer: InvoiceTagIndexer = InvoiceTagIndexer(cache)
+        # when the index is computed twice
+        first: InvoiceTagIndex = indexer.getTagIndex(self.level, self.model, self.invoicePath, self.table)
+        self.assertIsNotNone(cache.get(self.level, self.model, self.invoicePath, InvoiceTagIndexer.CACHE_VARIANT))
+        second: InvoiceTagIndex = indexer.getTagIndex(self.level, self.model, self.invoicePath, self.table)
+        # then the cached index is the same, still dictionary encoded
+        self.assertEqual(second.getKeys(), first.getKeys())
+        for k in first.getKeys():
+            self.assertEqual(second.getColumn(k).tolist(), first.getColumn(k).tolist())
+            self.assertIsInstance(second.getColumn(k).dtype, pd.CategoricalDtype)
+        # and the invoice table entry is left untouched
+        self.assertIsNone(cache.get(self.level, self.model, self.invoicePath))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import shutil
+import tempfile
+import pandas as pd
+
+from azinvoicer.invoice_writer import InvoiceWriter, OutputFormat
+from azinvoicer.helpers import ModuleHelper
+
+
+class TestInvoiceWriter(unittest.TestCase):
+
+    __testTempDirPath: str
+
+    def setUp(self):
+        self.__testTempDirPath = tempfile.mkdtemp()
+        self.table: pd.DataFrame = pd.DataFrame({"Environnement": ["DEV", "PROD"], "Cost": [1.5, 2.25], "Lines": [1, 2]})
+
+    def tearDown(self):
+        shutil.rmtree(self.__testTempDirPath)
+
+    def test_write_csv(self) -> None:
+        # given a csv writer
+        writer: InvoiceWriter = InvoiceWriter(OutputFormat.CSV)
+        # when writing a table into a directory that does not exist yet
+        path: str = writer.getOutputPath(os.path.join(self.__testTempDirPath, "out"), "groups")
+        writer.write(self.table, path)
+        # then the table is read back without the index and without any temporary file left
+        self.assertTrue(path.endswith("groups.csv"))
+        pd.testing.assert_frame_equal(pd.read_csv(path), self.table)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["groups.csv"])
+
+    def test_write_json(self) -> None:
+        # given a json writer
+        writer: InvoiceWriter = InvoiceWriter(OutputFormat.JSON)
+        # when writing a table
+        path: str = writer.getOutputPath(self.__testTempDirPath, "groups")
+        writer.write(self.table, path)
+        # then one record is written per line
+        self.assertTrue(path.endswith("groups.json"))
+        pd.testing.assert_frame_equal(pd.read_json(path, orient="records"), self.table)
+
+    def test_xlsx_availability(self) -> None:
+        # given a xlsx writer
+        writer: InvoiceWriter = InvoiceWriter(OutputFormat.XLSX)
+        # then it falls back to csv when the excel engine is missing
+        expected: OutputFormat = OutputFormat.XLSX if ModuleHelper.isAvailable(InvoiceWriter.XLSX_ENGINE) else OutputFormat.CSV
+        self.assertEqual(writer.getFormat(), expected)
+        # and the written file can be read back
+        path: str = writer.getOutputPath(self.__testTempDirPath, "groups")
+        writer.write(self.table, path)
+        read: pd.DataFrame = pd.read_excel(path) if expected == OutputFormat.XLSX else pd.read_csv(path)
+        pd.testing.assert_frame_equal(read, self.table)
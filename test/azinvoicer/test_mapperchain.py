@@ -1,7 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
+import pandas as pd
 
-from azinvoicer.invoice_mapperchain import MapperChain
-from azinvoicer.invoice_mappers import EnvironnementMapper, Environnement
+from azinvoicer.invoice_mapperchain import MapperChain, MapperCacheStats, MapperRunStats
+from azinvoicer.invoice_mappers import EnvironnementMapper, Environnement, MapperInputs
 
 
 class DummyMapper(EnvironnementMapper):
@@ -18,6 +22,18 @@ class SandboxMapper(EnvironnementMapper):
         return Environnement.SANDBOX
 
 
+class CountingRGMapper(EnvironnementMapper):
+
+    INPUTS: list = [MapperInputs.RESOURCE_GROUP_NAME]
+    calls: int = 0
+
+    def getEnvironnement(
+        self, serviceFamily: str, serviceName: str, skuName: str, regionName: str, resourceGroupName: str, tags: dict
+    ) -> Environnement:
+        CountingRGMapper.calls = CountingRGMapper.calls + 1
+        return Environnement.PROD if resourceGroupName == "rg-prod" else Environnement.NA
+
+
 class TestMapperChain(unittest.TestCase):
     def test_chain(self) -> None:
         # given a mapper chain
@@ -27,3 +43,132 @@ class TestMapperChain(unittest.TestCase):
         e: Environnement = chain.getEnvironnement("whatever", "whatever", "whatever", "whatever", "whatever", dict())
         # we get the result the only non NA chain item returns
         self.assertEqual(e, Environnement.SANDBOX)
+
+    def test_chain_inputs(self) -> None:
+        # given a chain of mappers only depending on the resource group name
+        chain: MapperChain = MapperChain(["test.azinvoicer.test_mapperchain:CountingRGMapper", "azinvoicer.invoice_mappers:BasicRGMapper"])
+        # then the chain only depends on the resource group name
+        self.assertEqual(chain.getInputs(), [MapperInputs.RESOURCE_GROUP_NAME])
+
+    def test_chain_batch(self) -> None:
+        # given a chain mixing a per line custom mapper and a vectorized one
+        chain: MapperChain = MapperChain(
+            ["azinvoicer.invoice_mappers:BasicRGMapper", "test.azinvoicer.test_mapperchain:CountingRGMapper"]
+        )
+        CountingRGMapper.calls = 0
+        names: pd.Series = pd.Series(["rg-prod", "rg-sandbox", "rg-other", "rg-prod"], index=[10, 11, 12, 13], dtype=object)
+        empty: pd.Series = pd.Series([""] * 4, index=names.index, dtype=object)
+        # when mapping whole columns
+        envs: pd.Series = chain.getEnvironnementBatch(empty, empty, empty, empty, names, empty)
+        # then the decisions are aligned on the input lines
+        self.assertEqual(list(envs.index), [10, 11, 12, 13])
+        self.assertEqual(
+            envs.tolist(), [Environnement.PROD, Environnement.SANDBOX, Environnement.NA, Environnement.PROD]
+        )
+        # and the custom mapper only received the line left unmapped, per line
+        self.assertEqual(CountingRGMapper.calls, 1)
+
+    def test_chain_batch_duplicated_index(self) -> None:
+        # given lines whose index holds duplicated labels, as chunks concatenated without resetting it
+        names: pd.Series = pd.Series(["rg-prod", "rg-sandbox", "rg-other", "rg-dev"], index=[0, 1, 0, 1], dtype=object)
+        empty: pd.Series = pd.Series([""] * 4, index=names.index, dtype=object)
+        for cacheSize in [0, 16]:
+            chain: MapperChain = MapperChain(
+                ["azinvoicer.invoice_mappers:BasicRGMapper", "test.azinvoicer.test_mapperchain:CountingRGMapper"],
+                cacheSize=cacheSize,
+            )
+            # when mapping whole columns
+            envs: pd.Series = chain.getEnvironnementBatch(empty, empty, empty, empty, names, empty)
+            # then each decision lands on its own line
+            self.assertEqual(list(envs.index), [0, 1, 0, 1])
+            self.assertEqual(envs.tolist(), [Environnement.PROD, Environnement.SANDBOX, Environnement.NA, Environnement.DEV])
+
+    def test_chain_adaptive_order(self) -> None:
+        # given an adaptive chain with a mapper never answering grouped with one always answering
+        dummy: str = "test.azinvoicer.test_mapperchain:DummyMapper"
+        sandbox: str = "test.azinvoicer.test_mapperchain:SandboxMapper"
+        chain: MapperChain = MapperChain([[dummy, sandbox]], adaptive=True)
+        self.assertEqual(chain.getOrder(), [dummy, sandbox])
+        # when lines are mapped
+        names: pd.Series = pd.Series(["a", "b", "c"], dtype=object)
+        chain.getEnvironnementBatch(names, names, names, names, names, names)
+        # then the mapper answering is tried first
+        self.assertEqual(chain.getOrder(), [sandbox, dummy])
+        stats: list = chain.getMapperStats()
+        self.assertEqual([(r.lines, r.hits) for r in stats], [(3, 0), (3, 3)])
+        # and the decisions are unchanged
+        self.assertEqual(chain.getEnvironnement("a", "a", "a", "a", "a", dict()), Environnement.SANDBOX)
+
+    def test_chain_adaptive_groups(self) -> None:
+        # given an adaptive chain where the mapper never answering is not part of a group
+        dummy: str = "test.azinvoicer.test_mapperchain:DummyMapper"
+        sandbox: str = "test.azinvoicer.test_mapperchain:SandboxMapper"
+        chain: MapperChain = MapperChain([dummy, [sandbox]], adaptive=True)
+        # when lines are mapped one by one
+        for i in range(MapperChain.REORDER_INTERVAL):
+            chain.getEnvironnement("", "", "", "", "rg", dict())
+        # then the declared order is kept across groups
+        self.assertEqual(chain.getOrder(), [dummy, sandbox])
+        stats: MapperRunStats = chain.getMapperStats()[1]
+        self.assertEqual(stats.hits, MapperChain.REORDER_INTERVAL)
+        self.assertAlmostEqual(stats.getHitRate(), 1.0)
+
+    def test_chain_order_persistence(self) -> None:
+        # given an adaptive chain which learned its order
+        tmpDirPath: str = tempfile.mkdtemp()
+        orderFilePath: str = os.path.join(tmpDirPath, "order.json")
+        dummy: str = "test.azinvoicer.test_mapperchain:DummyMapper"
+        sandbox: str = "test.azinvoicer.test_mapperchain:SandboxMapper"
+        try:
+            chain: MapperChain = MapperChain([[dummy, sandbox]], adaptive=True, orderFilePath=orderFilePath)
+            names: pd.Series = pd.Series(["a"], dtype=object)
+            chain.getEnvironnementBatch(names, names, names, names, names, names)
+            # when it is saved and a new chain is created from the same declaration
+            chain.saveOrder()
+            restored: MapperChain = MapperChain([[dummy, sandbox]], orderFilePath=orderFilePath)
+            # then the learned order and stats are restored
+            self.assertEqual(restored.getOrder(), [sandbox, dummy])
+            self.assertEqual(restored.getMapperStats()[1].hits, 1)
+        finally:
+            shutil.rmtree(tmpDirPath)
+
+    def test_chain_cache(self) -> None:
+        # given a chain with a cache of 2 decisions
+        chain: MapperChain = MapperChain(["test.azinvoicer.test_mapperchain:CountingRGMapper"], cacheSize=2)
+        CountingRGMapper.calls = 0
+
+        # when the same resource group is mapped several times, whatever the other inputs
+        e1: Environnement = chain.getEnvironnement("compute", "vm", "d2", "westeurope", "rg-prod", {"a": "b"})
+        e2: Environnement = chain.getEnvironnement("storage", "blob", "lrs", "northeurope", "rg-prod", dict())
+        e3: Environnement = chain.getEnvironnement("storage", "blob", "lrs", "northeurope", "rg-other", dict())
+
+        # then the decisions are accurate
+        self.assertEqual(e1, Environnement.PROD)
+        self.assertEqual(e2, Environnement.PROD)
+        self.assertEqual(e3, Environnement.NA)
+        # and the mapper ran only once per resource group
+        self.assertEqual(CountingRGMapper.calls, 2)
+        stats: MapperCacheStats = chain.getCacheStats()
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(stats.misses, 2)
+        self.assertEqual(stats.evictions, 0)
+
+        # when a third resource group is mapped
+        chain.getEnvironnement("", "", "", "", "rg-third", dict())
+        # then the least recently used decision is evicted
+        stats = chain.getCacheStats()
+        self.assertEqual(stats.evictions, 1)
+        self.assertEqual(stats.size, 2)
+        chain.getEnvironnement("", "", "", "", "rg-prod", dict())
+        self.assertEqual(chain.getCacheStats().misses, 4)
+
+    def test_chain_without_cache(self) -> None:
+        # given a chain without cache
+        chain: MapperChain = MapperChain(["test.azinvoicer.test_mapperchain:CountingRGMapper"])
+        CountingRGMapper.calls = 0
+        # when the same resource group is mapped twice
+        chain.getEnvironnement("", "", "", "", "rg-prod", dict())
+        chain.getEnvironnement("", "", "", "", "rg-prod", dict())
+        # then the mapper ran twice
+        self.assertEqual(CountingRGMapper.calls, 2)
+        self.assertEqual(chain.getCacheStats().hits, 0)
@@ -1,13 +1,25 @@
+import json
 import unittest
+from unittest import mock
+import pandas as pd
 
 from azinvoicer.invoice_mappers import (
     Environnement,
     CommonMappingTokens,
     CommonStringMapper,
     BasicRGMapper,
+    BasicTagsMapper,
+    SingleEnvironnementMapper,
+    PriorityTokenMatcher,
+    TagMatcher,
 )
 
 
+def asColumns(resourceGroupNames: list, tags: list) -> list:
+    empty: pd.Series = pd.Series([""] * len(resourceGroupNames), dtype=object)
+    return [empty, empty, empty, empty, pd.Series(resourceGroupNames, dtype=object), pd.Series(tags, dtype=object)]
+
+
 class TestCommonMappingTokens(unittest.TestCase):
     def test_mapping_prod(self) -> None:
         # for each token that matches prod, the mapper should return prod env
@@ -84,6 +96,42 @@ class TestCommonStringMapper(unittest.TestCase):
         )
 
 
+class TestPriorityTokenMatcher(unittest.TestCase):
+    def test_priority_wins_over_position(self) -> None:
+        # preprod must win over prod wherever the tokens are located
+        self.assertEqual(
+            Environnement.PREPRO, CommonStringMapper.getEnvironnement("prod-to-preprod")
+        )
+        self.assertEqual(
+            Environnement.PROD, CommonStringMapper.getEnvironnement("dev-and-prod")
+        )
+
+    def test_overlapping_tokens(self) -> None:
+        # test overlaps the lower priority int token, it must still be found
+        self.assertEqual(
+            Environnement.TEST, CommonStringMapper.getEnvironnement("intest")
+        )
+
+    def test_not_a_string(self) -> None:
+        # missing values are not matched
+        self.assertEqual(
+            Environnement.NA, CommonStringMapper.getEnvironnement(float("nan"))
+        )
+
+    def test_custom_table(self) -> None:
+        # given a custom table of tokens, holding regular expressions
+        matcher = PriorityTokenMatcher(
+            [
+                (Environnement.DEMO, ["showcase", "(d)em[o0]"]),
+                (Environnement.SANDBOX, ["lab"]),
+            ]
+        )
+        # then the matching follows the table priorities
+        self.assertEqual(Environnement.DEMO, matcher.getEnvironnement("lab-DEM0"))
+        self.assertEqual(Environnement.SANDBOX, matcher.getEnvironnement("lab-dem"))
+        self.assertEqual(Environnement.NA, matcher.getEnvironnement("prod"))
+
+
 class TestBasicRGMapper(unittest.TestCase):
     def test_rg_matching_envs(self) -> None:
         mapper = BasicRGMapper()
@@ -109,6 +157,80 @@ class TestBasicRGMapper(unittest.TestCase):
         )
         ## TBC ...
 
+    def test_rg_batch(self) -> None:
+        # given resource group names with overlapping tokens and missing values
+        names: list = ["mycompany-071-prod", "preprod-test", "mycompany-071-porod", float("nan"), "DEV-lab"]
+        # when mapping them as a whole column
+        envs: pd.Series = BasicRGMapper().getEnvironnementBatch(*asColumns(names, [dict()] * len(names)))
+        # then the decisions are the per line ones
+        self.assertEqual(envs.tolist(), [CommonStringMapper.getEnvironnement(n) for n in names])
+        self.assertEqual(envs.tolist()[1], Environnement.PREPRO)
+
+    def test_rg_batch_duplicated_index(self) -> None:
+        # given resource group names whose index holds duplicated labels
+        names: list = ["rg-prod", "rg-test", "rg-other", "rg-dev"]
+        columns: list = [c.set_axis([7, 7, 3, 3]) for c in asColumns(names, [dict()] * len(names))]
+        # when mapping them as a whole column
+        envs: pd.Series = BasicRGMapper().getEnvironnementBatch(*columns)
+        # then each decision lands on its own line
+        self.assertEqual(list(envs.index), [7, 7, 3, 3])
+        self.assertEqual(envs.tolist(), [Environnement.PROD, Environnement.TEST, Environnement.NA, Environnement.DEV])
+
+
+class TestBasicTagsMapper(unittest.TestCase):
+    def test_tags_batch(self) -> None:
+        # given decoded and raw tags as read from an invoice
+        tags: list = [
+            {"env": "prod"},
+            '"environment": "preprod"',
+            '"owner": "me"',
+            float("nan"),
+        ]
+        # when mapping them one by one and as a whole column
+        mapper: BasicTagsMapper = BasicTagsMapper()
+        envs: pd.Series = mapper.getEnvironnementBatch(*asColumns([""] * len(tags), tags))
+        # then both forms agree and raw strings are decoded
+        self.assertEqual(envs.tolist(), [Environnement.PROD, Environnement.PREPRO, Environnement.NA, Environnement.NA])
+        self.assertEqual(envs.tolist(), [mapper.getEnvironnement("", "", "", "", "", t) for t in tags])
+
+    def test_tags_doublequoted(self) -> None:
+        # given doubled quoted tags as exported in invoices
+        tags: list = ['{ ""owner"" : ""team-a"", ""Environment"" : ""staging"" }', '{ ""owner"" : ""prod-team"" }']
+        # when mapped as a whole column
+        envs: pd.Series = BasicTagsMapper().getEnvironnementBatch(*asColumns([""] * len(tags), tags))
+        # then only the env like key is considered
+        self.assertEqual(envs.tolist(), [Environnement.STAGING, Environnement.NA])
+
+    def test_tags_json_not_decoded(self) -> None:
+        # given json tags as decoded by the loader
+        tags: list = ['"owner": "team-b", "app-env": "sandbox"', '"app-environment": "uat", "cost": "42"']
+        # when mapped as a whole column
+        with mock.patch.object(json, "loads", side_effect=AssertionError("tags were decoded")):
+            envs: pd.Series = BasicTagsMapper().getEnvironnementBatch(*asColumns([""] * len(tags), tags))
+        # then the env value is picked without decoding the other tags
+        self.assertEqual(envs.tolist(), [Environnement.SANDBOX, Environnement.TEST])
+
+
+class TestTagMatcher(unittest.TestCase):
+    def test_env_key_cached(self) -> None:
+        # given a key schema
+        keys: tuple = ("owner", "CostCenter", "Environment")
+        TagMatcher.getEnvKeyFromKeys.cache_clear()
+        # when the env key is looked up twice
+        self.assertEqual(TagMatcher.getEnvKeyFromKeys(keys), "Environment")
+        self.assertEqual(TagMatcher.getEnvKey({k: "" for k in keys}), "Environment")
+        # then the second decision comes from the cache
+        self.assertEqual(TagMatcher.getEnvKeyFromKeys.cache_info().hits, 1)
+        self.assertIsNone(TagMatcher.getEnvKeyFromKeys(("owner",)))
+
+
+class TestSingleEnvironnementMapper(unittest.TestCase):
+    def test_single_batch(self) -> None:
+        # when mapping a column with the single environnement mapper
+        envs: pd.Series = SingleEnvironnementMapper().getEnvironnementBatch(*asColumns(["a", "b"], [dict(), dict()]))
+        # then every line gets the global environnement
+        self.assertEqual(envs.tolist(), [Environnement.GLOBAL, Environnement.GLOBAL])
+
 
 if __name__ == "__main__":
     unittest.main()
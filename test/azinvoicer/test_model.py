@@ -1,6 +1,13 @@
 import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
 
 from azinvoicer.invoice_model import (
+    InvoiceHeaderSniffer,
     MandatoryFields,
     OptionalFields,
     MappingModel,
@@ -19,6 +26,21 @@ class ModelTestConstants(object):
     STD_MODEL = PATH_TO_TEST_REPO + "/standard.yaml"
 
 
+class SlowRefreshRepository(MappingModelRepository):
+    """holds its first version read until released, as a repository reloading its models from a slow disk would"""
+
+    def __init__(self, repoDirPath: str) -> None:
+        super().__init__(repoDirPath)
+        self.refreshing: threading.Event = threading.Event()
+        self.released: threading.Event = threading.Event()
+
+    def getVersion(self) -> int:
+        if not self.refreshing.is_set():
+            self.refreshing.set()
+            self.released.wait(10)
+        return super().getVersion()
+
+
 class TestMappingModel(unittest.TestCase):
 
     __TEST_FILE = "standard.yaml"
@@ -174,6 +196,19 @@ class TestMappingModel(unittest.TestCase):
             "billingPeriodEndDate is provided as mandatory field",
         )
 
+    def test_column_types(self) -> None:
+        # given a model descrition file declaring column types
+        filePath: str = ModelTestConstants.PATH_TO_TEST_REPO + "/" + self.__TEST_FILE
+        # and a model from that file
+        mappingModel: MappingModel = MappingModel(filePath)
+        # when listing the column types
+        types: dict = mappingModel.getColumnTypes()
+        # then the types are provided by column name
+        self.assertEqual(types["CostInBillingCurrency"], "float64")
+        self.assertEqual(types["Tags"], "object")
+        self.assertEqual(types["PartNumber"], "object")
+        self.assertEqual(len(types), len(MandatoryFields.ALL_FIELDS) + len(OptionalFields.ALL_FIELDS))
+
     def test_list_optional(self) -> None:
         # given a model descrition file
         filePath: str = ModelTestConstants.PATH_TO_TEST_REPO + "/" + self.__TEST_FILE
@@ -213,6 +248,86 @@ class TestMappingModelRepo(unittest.TestCase):
         # and a standard_lc model
         self.assertTrue("standard_lc" in models, "standard_lc was found and loaded")
 
+    def test_models_reload(self) -> None:
+        # given a repo loaded from a copy of the models
+        tmpDirPath: str = tempfile.mkdtemp()
+        try:
+            for f in ["standard.yaml", "standard_lc.yaml"]:
+                shutil.copyfile(os.path.join(ModelTestConstants.PATH_TO_TEST_REPO, f), os.path.join(tmpDirPath, f))
+            repo: MappingModelRepository = MappingModelRepository(tmpDirPath)
+            standard: MappingModel = repo.getModel("standard")
+            standardLc: MappingModel = repo.getModel("standard_lc")
+            version: int = repo.getVersion()
+            # when nothing changed
+            # then nothing is reloaded
+            self.assertFalse(repo.refresh())
+            self.assertEqual(repo.getVersion(), version)
+
+            # when a model file is modified, another one is removed and an invalid one is added
+            lcPath: str = os.path.join(tmpDirPath, "standard_lc.yaml")
+            with open(lcPath, "r", newline="") as f:
+                content: str = f.read()
+            with open(lcPath, "w", newline="") as f:
+                f.write(content.replace('dateFormat: "%m/%d/%Y"', 'dateFormat: "%d/%m/%Y"'))
+            os.utime(lcPath, ns=(os.stat(lcPath).st_atime_ns, os.stat(lcPath).st_mtime_ns + 1000000000))
+            os.remove(os.path.join(tmpDirPath, "standard.yaml"))
+            with open(os.path.join(tmpDirPath, "broken.yaml"), "w") as f:
+                f.write("model: {}")
+            # then only the modified model is reloaded
+            self.assertTrue(repo.refresh())
+            self.assertGreater(repo.getVersion(), version)
+            self.assertEqual(repo.listModelNames(), ["standard_lc"])
+            self.assertIsNot(repo.getModel("standard_lc"), standardLc)
+            self.assertEqual(repo.getModel("standard_lc").getOption(OptionFlags.DATE_FORMAT), "%d/%m/%Y")
+            self.assertEqual(standard.getName(), "standard")
+        finally:
+            shutil.rmtree(tmpDirPath)
+
+    def test_models_snapshot(self) -> None:
+        # given a repo saving its models to a snapshot
+        tmpDirPath: str = tempfile.mkdtemp()
+        try:
+            modelsDirPath: str = os.path.join(tmpDirPath, "models")
+            shutil.copytree(ModelTestConstants.PATH_TO_TEST_REPO, modelsDirPath)
+            snapshotPath: str = os.path.join(tmpDirPath, "models.snapshot")
+            repo: MappingModelRepository = MappingModelRepository(modelsDirPath, snapshotPath=snapshotPath)
+            self.assertTrue(os.path.exists(snapshotPath))
+            # when another repo is created on the same unchanged models
+            restored: MappingModelRepository = MappingModelRepository(modelsDirPath, snapshotPath=snapshotPath)
+            # then it gets the same models
+            self.assertEqual(restored.listModelNames(), repo.listModelNames())
+            self.assertEqual(
+                restored.getModel("standard").getMandatoryColumnNames(), repo.getModel("standard").getMandatoryColumnNames()
+            )
+            # when a model file is removed
+            os.remove(os.path.join(modelsDirPath, "standard_lc.yaml"))
+            # then the outdated snapshot is not used
+            self.assertEqual(MappingModelRepository(modelsDirPath, snapshotPath=snapshotPath).listModelNames(), ["standard"])
+        finally:
+            shutil.rmtree(tmpDirPath)
+
+    def test_picking_without_pandas(self) -> None:
+        # when picking a model in a fresh interpreter
+        script: str = (
+            "import sys\n"
+            "from azinvoicer.invoice_model import MappingModelRepository, ModelCompliancePicker\n"
+            "repo = MappingModelRepository('" + ModelTestConstants.PATH_TO_TEST_REPO + "')\n"
+            "pick = ModelCompliancePicker().getBestMatchingModel(repo, '" + InvoiceFixtures.TEST_FILE_MANDATORY_ONLY + "')\n"
+            "print(pick.getLevel().name, 'pandas' in sys.modules)\n"
+        )
+        output: str = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+        # then pandas was never imported
+        self.assertEqual(output.split(), ["MANDATORY_ONLY", "False"])
+
+    def test_model_index(self) -> None:
+        # given a model
+        model: MappingModel = MappingModel(ModelTestConstants.STD_MODEL)
+        # then its compiled index resolves options and can not be modified
+        self.assertEqual(model.getOption(OptionFlags.DATE_FORMAT), "%m/%d/%Y")
+        self.assertEqual(model.getIndex().mandatoryColumnNames, tuple(model.getMandatoryColumnNames()))
+        with self.assertRaises(TypeError):
+            model.getIndex().mandatoryColumns[MandatoryFields.TAGS] = "Other"
+
 
 class InvoiceFixtures(object):
     TEST_FILE_MANDATORY_AND_OPTIONAL = (
@@ -307,6 +422,70 @@ class TestModelCompliancePicker(unittest.TestCase):
             "not compliant files get a non compliant rating",
         )
 
+    def test_model_picker_cached_per_header(self) -> None:
+        # given a repo and two files sharing the same header
+        repo: MappingModelRepository = MappingModelRepository(ModelTestConstants.PATH_TO_TEST_REPO)
+        tmpDirPath: str = tempfile.mkdtemp()
+        try:
+            copyPath: str = os.path.join(tmpDirPath, "copy.csv")
+            shutil.copyfile(InvoiceFixtures.TEST_FILE_MANDATORY_ONLY, copyPath)
+            # when the best model is picked for both files
+            first: ModelCompliancePick = ModelCompliancePicker().getBestMatchingModel(
+                repo, InvoiceFixtures.TEST_FILE_MANDATORY_ONLY
+            )
+            second: ModelCompliancePick = ModelCompliancePicker().getBestMatchingModel(repo, copyPath)
+            # then the pick is computed once and shared
+            self.assertIs(first, second)
+            self.assertEqual(first.getLevel(), ModelComplianceLevel.MANDATORY_ONLY)
+            # and another header gets its own pick
+            other: ModelCompliancePick = ModelCompliancePicker().getBestMatchingModel(
+                repo, InvoiceFixtures.TEST_FILE_MANDATORY_AND_OPTIONAL
+            )
+            self.assertEqual(other.getLevel(), ModelComplianceLevel.MANDATORY_AND_OPTIONAL)
+        finally:
+            shutil.rmtree(tmpDirPath)
+
+    def test_model_picker_not_blocked_by_refresh(self) -> None:
+        # given a repository slowly refreshing its models while a pick is made
+        slow: SlowRefreshRepository = SlowRefreshRepository(ModelTestConstants.PATH_TO_TEST_REPO)
+        slowPick = threading.Thread(
+            target=ModelCompliancePicker().getBestMatchingModel, args=(slow, InvoiceFixtures.TEST_FILE_MANDATORY_ONLY)
+        )
+        slowPick.start()
+        self.assertTrue(slow.refreshing.wait(10))
+        try:
+            # when a pick is made on another repository meanwhile
+            repo: MappingModelRepository = MappingModelRepository(ModelTestConstants.PATH_TO_TEST_REPO)
+            otherPick = threading.Thread(
+                target=ModelCompliancePicker().getBestMatchingModel, args=(repo, InvoiceFixtures.TEST_FILE_MANDATORY_ONLY)
+            )
+            otherPick.start()
+            otherPick.join(5)
+            # then it does not wait for the refresh
+            self.assertFalse(otherPick.is_alive())
+        finally:
+            slow.released.set()
+            slowPick.join()
+
+
+class TestInvoiceHeaderSniffer(unittest.TestCase):
+    def test_header_with_bom(self) -> None:
+        # when reading the header of an invoice starting with a byte order mark
+        header: list = InvoiceHeaderSniffer.getHeader(InvoiceFixtures.TEST_FILE_MANDATORY_AND_OPTIONAL)
+        # then the first column is kept, without the mark
+        self.assertEqual(header[0], "BillingAccountId")
+        self.assertIn("Tags", header)
+        # and the same header always gets the same signature
+        self.assertEqual(InvoiceHeaderSniffer.getSignature(header), InvoiceHeaderSniffer.getSignature(list(header)))
+        self.assertNotEqual(InvoiceHeaderSniffer.getSignature(header), InvoiceHeaderSniffer.getSignature(header[1:]))
+
+    def test_model_column_sets(self) -> None:
+        # given a model
+        model: MappingModel = MappingModel(ModelTestConstants.STD_MODEL)
+        # then its column requirements are available as sets
+        self.assertEqual(model.getMandatoryColumnSet(), frozenset(model.getMandatoryColumnNames()))
+        self.assertEqual(model.getOptionalColumnSet(), frozenset(model.getOptionalColumnNames()))
+
 
 class TestOutputModel(unittest.TestCase):
     def test_column_names_out(self) -> None:
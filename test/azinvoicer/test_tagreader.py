@@ -1,6 +1,11 @@
 import unittest
+import json
+from unittest import mock
+import pandas as pd
 
 from azinvoicer.invoice_tagreader import TagReader
+from azinvoicer.invoice_reader import InvoiceLoader
+from azinvoicer.invoice_model import MappingModel, ModelComplianceLevel, MandatoryFields
 
 
 class TestTagReader(unittest.TestCase):
@@ -50,6 +55,116 @@ class TestTagReader(unittest.TestCase):
         # then keys/values are correctly intepretted
         self.ensure_keyValuesOk(data)
 
+    def test_doublequoted_non_word_keys(self) -> None:
+        # given doubled quoted tags with keys and values holding non word characters
+        tags: str = '{ ""cost-center"" : ""team a/b"", ""empty"" : """" }'
+        # when parsed by the tag reader
+        data: dict = TagReader.getDictFromTags(tags)
+        # then keys/values are correctly intepretted
+        self.assertEqual(dict(data), {"cost-center": "team a/b", "empty": ""})
+
+    def test_classic_json_empty_value(self) -> None:
+        # given a classic json string holding an empty value
+        data: dict = TagReader.getDictFromTags('{ "me" : "dev", "you" : "customer", "them" : "" }')
+        # then it is not mistaken for the doubled quote format
+        self.ensure_keyValuesOk(data)
+        self.assertEqual(data["them"], "")
+
+    def test_cached_and_read_only(self) -> None:
+        # given the same tags parsed twice
+        tags: str = '""me"" : ""dev"", ""you"" : ""customer""'
+        first: dict = TagReader.getDictFromTags(tags)
+        second: dict = TagReader.getDictFromTags(tags)
+        # then the same mapping is shared
+        self.assertIs(first, second)
+        # and it can not be modified
+        with self.assertRaises(TypeError):
+            first["me"] = "prod"
+
+    def test_parse_failures_counted(self) -> None:
+        # given a reset failure counter
+        TagReader.resetParseFailures()
+        # when invalid tags are parsed several times
+        for i in range(3):
+            data: dict = TagReader.getDictFromTags('""me"" : dev')
+            # then an empty mapping is returned
+            self.assertEqual(len(data), 0)
+        # and every failure is counted
+        self.assertEqual(TagReader.getParseFailures(), 3)
+
+    def test_tag_keys(self) -> None:
+        # given doubled quoted and classic tags
+        # then their keys are listed in declaration order
+        self.assertEqual(TagReader.getTagKeys('{ ""me"" : ""dev"", ""you"" : ""customer"" }'), ("me", "you"))
+        self.assertEqual(TagReader.getTagKeys('{ "me" : "dev", "you" : "customer" }'), ("me", "you"))
+        self.assertEqual(TagReader.getTagKeys(float("nan")), tuple())
+        # and keys the scanner does not read are still decoded
+        self.assertEqual(TagReader.getTagKeys('"a": 4, "b": "c"'), ("a", "b"))
+
+    def test_tag_keys_loaded(self) -> None:
+        # given the tags of an invoice as decoded by the loader
+        model: MappingModel = MappingModel("./azinvoicer/models/in/standard.yaml")
+        table: pd.DataFrame = InvoiceLoader().loadInvoice(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, "./test/azinvoicer/fixtures/invoices/std_multiple_lines.csv"
+        )
+        tags: list = table[model.getMandatoryColumnName(MandatoryFields.TAGS)].tolist()
+        # when their keys are listed without the json decoder
+        with mock.patch.object(json, "loads", side_effect=AssertionError("tags were decoded")):
+            keys: list = [TagReader.getTagKeys(t) for t in tags]
+        # then they are the decoded ones
+        self.assertEqual(keys[0], ("Env", "Owner"))
+        self.assertEqual(keys, [tuple(TagReader.getDictFromTags(t).keys()) for t in tags])
+
+    def test_selected_tags(self) -> None:
+        # given doubled quoted tags where a key name is also used as a value
+        tags: str = '{ ""owner"" : ""env"", ""env"" : ""prod"", ""them"" : """" }'
+        # when only some keys are extracted
+        data: dict = TagReader.getSelectedTags(tags, ["env", "them", "missing"])
+        # then only the requested keys present in the tags are returned
+        self.assertEqual(data, {"env": "prod", "them": ""})
+        # and so for classic json
+        self.assertEqual(TagReader.getSelectedTags('{ "env" : "dev", "you" : "me" }', ["env"]), {"env": "dev"})
+
+    def test_selected_tags_loaded(self) -> None:
+        # given the tags of an invoice as decoded by the loader
+        model: MappingModel = MappingModel("./azinvoicer/models/in/standard.yaml")
+        table: pd.DataFrame = InvoiceLoader().loadInvoice(
+            ModelComplianceLevel.MANDATORY_AND_OPTIONAL, model, "./test/azinvoicer/fixtures/invoices/std_multiple_lines.csv"
+        )
+        tags: list = table[model.getMandatoryColumnName(MandatoryFields.TAGS)].tolist()
+        self.assertEqual(tags[0], '"Env": "production","Owner": "ops"')
+        # when some keys are extracted without the json decoder
+        with mock.patch.object(json, "loads", side_effect=AssertionError("tags were decoded")):
+            selected: list = [TagReader.getSelectedTags(t, ["Env", "Owner", "CostCenter"]) for t in tags]
+        # then the values are the decoded ones
+        self.assertEqual(selected[0], {"Env": "production", "Owner": "ops"})
+        self.assertEqual(selected[4], dict())
+        for t, s in zip(tags, selected):
+            decoded: dict = TagReader.getDictFromTags(t)
+            self.assertEqual(s, {k: decoded[k] for k in ["Env", "Owner", "CostCenter"] if k in decoded})
+
+    def test_selected_tags_json_values(self) -> None:
+        # given json tags holding escaped quotes, a key name used as a value and a value the scanner does not read
+        tags: str = '"a": "say \\"env\\": x", "b": "env", "env": "dev", "empty": "", "n": 4'
+        # when keys are extracted
+        # then values are unescaped and only keys are matched
+        self.assertEqual(TagReader.getSelectedTags(tags, ["a", "env", "empty"]), {"a": 'say "env": x', "env": "dev", "empty": ""})
+        # and values that are not strings are still decoded
+        self.assertEqual(TagReader.getSelectedTags(tags, ["env", "n"]), {"env": "dev", "n": 4})
+
+    def test_selected_tags_column(self) -> None:
+        # given a column of tags with missing values
+        tags: pd.Series = pd.Series(
+            ['""env"" : ""prod"", ""owner"" : ""ops""', float("nan"), '""env"" : ""dev""', '""env"" : ""prod"", ""owner"" : ""ops""'],
+            index=[3, 4, 5, 6],
+        )
+        # when the keys are extracted from the whole column
+        selected: pd.DataFrame = TagReader.getSelectedTagsColumn(tags, ["env", "owner"])
+        # then there is one aligned column per key
+        self.assertEqual(list(selected.index), [3, 4, 5, 6])
+        self.assertEqual(selected["env"].tolist(), ["prod", None, "dev", "prod"])
+        self.assertEqual(selected["owner"].tolist(), ["ops", None, None, "ops"])
+
 
 if __name__ == "__main__":
     unittest.main()